@@ -0,0 +1,203 @@
+"""
+CE-LIMS Analytics Module
+In-process columnar star schema over test results for manager analytics
+"""
+
+import threading
+import pandas as pd
+from database import get_connection, get_db_path, get_table_versions
+
+# Fact rows are loaded from SQLite in one query per refresh; only results
+# with a rowid above the watermark or updated since the last refresh are read
+# (via the rowid and idx_test_results_updated respectively; CROSS JOIN keeps
+# test_results as the outer loop so those ranges drive the query).
+FACT_COLUMNS = """
+        tr.id as result_id,
+        ta.sample_id,
+        s.sample_id as sample_code,
+        s.material_type,
+        s.project_id,
+        ta.test_method_id as method_id,
+        tr.tested_by as technician_id,
+        tr.test_completed_at as completed_at,
+        tr.result_value,
+        tr.status,
+        tr.is_deleted,
+        COALESCE(tr.updated_at, '') as updated_at
+"""
+
+FACT_QUERY = f"""
+    SELECT {FACT_COLUMNS}
+    FROM test_results tr
+    CROSS JOIN test_assignments ta ON tr.assignment_id = ta.id
+    JOIN samples s ON ta.sample_id = s.id
+    WHERE tr.id > :watermark
+    UNION ALL
+    SELECT {FACT_COLUMNS}
+    FROM test_results tr
+    CROSS JOIN test_assignments ta ON tr.assignment_id = ta.id
+    JOIN samples s ON ta.sample_id = s.id
+    WHERE tr.updated_at >= :updated_mark AND +tr.id <= :watermark
+"""
+
+DIMENSION_QUERIES = {
+    'project': "SELECT id as project_id, project_code, project_name FROM projects",
+    'method': """
+        SELECT id as method_id, test_code, test_name, standard, material_type as method_material
+        FROM test_methods
+    """,
+    'technician': "SELECT id as technician_id, full_name as technician_name FROM users",
+}
+
+# Tables each dimension is loaded from (reloaded when their version changes)
+DIMENSION_TABLES = {
+    'project': ['projects'],
+    'method': ['test_methods'],
+    'technician': ['users'],
+}
+
+class AnalyticsStore:
+    """Star schema of test results held as in-memory columnar DataFrames.
+
+    fact_test_result has one row per test result with keys into the sample,
+    project, method, technician and date dimensions. Project, method and
+    technician are reloaded when their table is written; sample and date
+    are derived from the loaded facts. Facts are refreshed incrementally by
+    rowid watermark plus updated_at, with a full reload if rows were
+    hard-deleted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything loaded so far"""
+        self.db_path = None
+        self.facts = None
+        self.dimensions = {}
+        self.dimension_versions = {}
+        self.watermark = 0
+        self.updated_mark = ''
+        self.stats = {'refreshes': 0, 'full_loads': 0, 'rows_loaded': 0}
+
+    def refresh(self, conn=None):
+        """Bring facts and dimensions up to date with the database"""
+        close_conn = False
+        if conn is None:
+            conn = get_connection()
+            close_conn = True
+
+        try:
+            with self._lock:
+                if self.db_path != get_db_path():
+                    self.reset()
+                    self.db_path = get_db_path()
+                facts_changed = self._refresh_facts(conn)
+                self._refresh_dimensions(conn, facts_changed)
+                self.stats['refreshes'] += 1
+        finally:
+            if close_conn:
+                conn.close()
+
+    def _refresh_dimensions(self, conn, facts_changed):
+        for name, query in DIMENSION_QUERIES.items():
+            versions = get_table_versions(DIMENSION_TABLES[name], conn)
+            if self.dimension_versions.get(name) != versions:
+                self.dimensions[name] = pd.read_sql_query(query, conn)
+                self.dimension_versions[name] = versions
+
+        if not facts_changed and 'date' in self.dimensions:
+            return
+
+        # Sample and date dimensions cover the samples and days in the facts
+        self.dimensions['sample'] = (self.facts[['sample_id', 'sample_code', 'material_type']]
+                                     .drop_duplicates('sample_id', keep='last'))
+        days = pd.DatetimeIndex(self.facts['date'].dropna().unique()).sort_values()
+        self.dimensions['date'] = pd.DataFrame({
+            'date': days,
+            'year': days.year,
+            'month': days.to_period('M').astype(str),
+            'week': days.to_period('W').astype(str),
+        })
+
+    def _refresh_facts(self, conn):
+        """Load new and updated fact rows; returns True if anything changed"""
+        total = conn.execute("SELECT COUNT(*) as count FROM test_results").fetchone()['count']
+        if self.facts is not None and len(self.facts) > total:
+            # Rows were removed (INSERT OR REPLACE / DELETE): start over
+            self.facts = None
+
+        if self.facts is None:
+            self.watermark, self.updated_mark = 0, ''
+            self.stats['full_loads'] += 1
+
+        delta = pd.read_sql_query(FACT_QUERY, conn, params={
+            'watermark': self.watermark,
+            'updated_mark': self.updated_mark,
+        })
+        self.stats['rows_loaded'] += len(delta)
+
+        delta['result_value'] = pd.to_numeric(delta['result_value'], errors='coerce')
+        delta['completed_at'] = pd.to_datetime(delta['completed_at'], errors='coerce')
+        delta['date'] = delta['completed_at'].dt.normalize()
+        if not delta.empty:
+            self.watermark = max(self.watermark, int(delta['result_id'].max()))
+            self.updated_mark = max(self.updated_mark, delta['updated_at'].max())
+
+        if self.facts is None:
+            self.facts = delta
+            return True
+        if delta.empty:
+            return False
+        kept = self.facts[~self.facts['result_id'].isin(delta['result_id'])]
+        self.facts = pd.concat([kept, delta], ignore_index=True)
+        return True
+
+    def fact_view(self, approved_only=False):
+        """Facts joined to their dimensions (live, non-deleted results only)"""
+        with self._lock:
+            facts = self.facts
+            dims = dict(self.dimensions)
+
+        facts = facts[facts['is_deleted'] == 0].drop(columns=['sample_code', 'material_type'])
+        if approved_only:
+            facts = facts[facts['status'] == 'approved']
+
+        return (facts
+                .merge(dims['project'], on='project_id', how='left')
+                .merge(dims['method'], on='method_id', how='left')
+                .merge(dims['technician'], on='technician_id', how='left')
+                .merge(dims['sample'], on='sample_id', how='left')
+                .merge(dims['date'], on='date', how='left'))
+
+_store = AnalyticsStore()
+
+def get_analytics_store(refresh=True):
+    """Get the process-wide analytics store, refreshed from the database"""
+    if refresh:
+        _store.refresh()
+    return _store
+
+def results_per_month(project_id=None, store=None):
+    """Count results per month x project x method"""
+    store = store or get_analytics_store()
+    view = store.fact_view()
+    if project_id is not None:
+        view = view[view['project_id'] == project_id]
+    return (view.dropna(subset=['month'])
+            .groupby(['month', 'project_name', 'test_name'], as_index=False)
+            .agg(results=('result_id', 'size'))
+            .sort_values('month'))
+
+def result_distribution(approved_only=True, store=None):
+    """Result value percentiles per test method"""
+    store = store or get_analytics_store()
+    view = store.fact_view(approved_only=approved_only).dropna(subset=['result_value'])
+    grouped = view.groupby(['standard', 'test_name'])['result_value']
+    summary = grouped.agg(['count', 'mean', 'min', 'max'])
+    quantiles = grouped.quantile([0.1, 0.5, 0.9]).unstack().reindex(columns=[0.1, 0.5, 0.9])
+    quantiles.columns = ['p10', 'p50', 'p90']
+    return summary.join(quantiles).reset_index()[
+        ['standard', 'test_name', 'count', 'mean', 'p10', 'p50', 'p90', 'min', 'max']
+    ]
@@ -6,7 +6,8 @@ ISO 17025 Compliant
 
 import streamlit as st
 from auth import check_authentication, show_login_page, logout, get_current_user
-from database import init_database
+from database import init_database, get_db_path
+from migrations import apply_migrations
 import os
 
 # Page configuration
@@ -17,9 +18,17 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Initialize database if not exists
-if not os.path.exists("ce_lims.db"):
-    init_database()
+@st.cache_resource
+def prepare_database():
+    """Create or migrate the database once per server process"""
+    if not os.path.exists(get_db_path()):
+        init_database()
+    else:
+        apply_migrations(verbose=False)
+    return True
+
+# Initialize database if not exists, apply pending migrations otherwise
+prepare_database()
 
 # Check authentication
 if not check_authentication():
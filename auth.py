@@ -48,6 +48,10 @@ def logout():
     """Logout user and clear session"""
     st.session_state.authenticated = False
     st.session_state.user = None
+    # Cached section data and list positions belong to the user who loaded them
+    st.session_state.pop('section_cache', None)
+    for key in [k for k in st.session_state if str(k).endswith('_cursors')]:
+        del st.session_state[key]
     st.rerun()
 
 def get_current_user():
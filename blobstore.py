@@ -0,0 +1,414 @@
+"""
+CE-LIMS Blob Store Module
+Content-addressed, compressed storage and integrity scrubbing for uploaded raw files
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import itertools
+import os
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from database import get_connection, transaction, configure_database
+from reports import REPORT_DIR
+
+try:
+    import zstandard
+except ImportError:  # optional: blobs are gzip-compressed without it
+    zstandard = None
+
+# Root directory of the store
+BLOB_ROOT = os.environ.get("CE_LIMS_BLOB_ROOT", "uploads")
+
+# Bytes read or written at a time
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+# Blobs are stored as <root>/ab/cd/abcd...: two levels of 256 directories
+# keep every directory small however many files accumulate
+BLOB_FANOUT = 2
+
+# Compression of new blobs: 'zstd' (needs the zstandard package), 'gzip' or 'none'
+BLOB_COMPRESSION = os.environ.get("CE_LIMS_BLOB_COMPRESSION", "zstd" if zstandard else "gzip")
+
+# A payload is stored compressed only if its first chunk compresses below
+# this fraction of its size (images, PDFs and XLSX files are already compressed)
+BLOB_COMPRESS_MAX_RATIO = 0.9
+
+# Suffix of a blob file per compression
+BLOB_SUFFIXES = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# Largest download served in one piece. Streamlit holds a download in memory,
+# so bigger files are offered as ranged parts of this size
+DOWNLOAD_PART_SIZE = int(os.environ.get("CE_LIMS_DOWNLOAD_PART_MB", "64")) * 1024 * 1024
+
+# Files verified in parallel by the scrub, and rows read per checkpointed batch
+SCRUB_WORKERS = 4
+SCRUB_BATCH_SIZE = 500
+
+# Errors raised when reading a damaged compressed blob
+_READ_ERRORS = (OSError, EOFError, zlib.error, ValueError) + ((zstandard.ZstdError,) if zstandard else ())
+
+def blob_key(digest):
+    """Path of a blob relative to the store root"""
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise ValueError(f"Invalid blob hash: {digest}")
+    parts = [digest[i * 2:i * 2 + 2] for i in range(BLOB_FANOUT)]
+    return os.path.join(*parts, digest)
+
+def blob_path(digest, root=None):
+    """Path of a blob (without the suffix of its compression)"""
+    return os.path.join(root or BLOB_ROOT, blob_key(digest))
+
+def _stored_file(digest, root=None):
+    """(path, compression) of a stored blob, or None"""
+    path = blob_path(digest, root)
+    for compression, suffix in BLOB_SUFFIXES.items():
+        if os.path.exists(path + suffix):
+            return path + suffix, compression
+    return None
+
+def blob_exists(digest, root=None):
+    """Check whether a blob is stored"""
+    return _stored_file(digest, root) is not None
+
+def _compresses(compression, sample):
+    """Check whether a payload's first chunk is worth compressing"""
+    if compression == 'none' or len(sample) < 512:
+        return False
+    if compression == 'zstd':
+        compressed = zstandard.ZstdCompressor(level=1).compress(sample)
+    else:
+        compressed = zlib.compress(sample, 1)
+    return len(compressed) < len(sample) * BLOB_COMPRESS_MAX_RATIO
+
+def _compressing_writer(compression, f):
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).stream_writer(f, closefd=False)
+    return gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6, mtime=0)
+
+def put_blob(source, root=None, compression=None, chunk_size=BLOB_CHUNK_SIZE):
+    """Stream a file-like object (or bytes) into the store.
+
+    The payload is hashed and written chunk by chunk to a temporary file,
+    compressed if its first chunk compresses well, then renamed to its
+    content address (the hash of the uncompressed payload); if that blob
+    already exists the copy is dropped instead. Returns (sha256 hex digest,
+    size, True if the blob was new).
+    """
+    root = root or BLOB_ROOT
+    compression = compression or BLOB_COMPRESSION
+    if compression not in BLOB_SUFFIXES:
+        raise ValueError(f"Unknown compression: {compression}")
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package")
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+        chunks = (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+    else:
+        chunks = iter(lambda: source.read(chunk_size), b"")
+    first = next(chunks, b"")
+    if not _compresses(compression, first):
+        compression = 'none'
+
+    incoming = os.path.join(root, "incoming")
+    os.makedirs(incoming, exist_ok=True)
+    sha256 = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=incoming)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer = f if compression == 'none' else _compressing_writer(compression, f)
+            for chunk in itertools.chain([first], chunks):
+                sha256.update(chunk)
+                writer.write(chunk)
+                size += len(chunk)
+            if writer is not f:
+                writer.close()
+            f.flush()
+            os.fsync(f.fileno())
+
+        digest = sha256.hexdigest()
+        if blob_exists(digest, root):
+            os.remove(temp_path)
+            return digest, size, False
+        path = blob_path(digest, root) + BLOB_SUFFIXES[compression]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        return digest, size, True
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def open_blob(digest, root=None):
+    """Open a stored blob for reading its uncompressed bytes (binary file object)"""
+    stored = _stored_file(digest, root)
+    if stored is None:
+        raise ValueError(f"Blob not found: {digest}")
+    path, compression = stored
+    if compression == 'gzip':
+        return gzip.open(path, "rb")
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError(f"Blob {digest} is zstd-compressed; the zstandard package is required")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+def iter_blob(digest, start=0, end=None, root=None, chunk_size=BLOB_CHUNK_SIZE):
+    """Yield the bytes start..end (exclusive; None for the end) of a blob in chunks"""
+    with open_blob(digest, root) as f:
+        f.seek(start)
+        remaining = None if end is None else max(end - start, 0)
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+def open_raw_file(file, root=None):
+    """Open a raw_files row's content (stored blob, or a file uploaded before the store)"""
+    if file['content_hash']:
+        return open_blob(file['content_hash'], root)
+    if not os.path.exists(file['file_path']):
+        raise ValueError(f"File not found: {file['file_path']}")
+    return open(file['file_path'], "rb")
+
+def read_raw_file(file, root=None, start=0, end=None):
+    """Read a raw_files row's content, or the bytes start..end of it (end exclusive)"""
+    if file['content_hash']:
+        return b"".join(iter_blob(file['content_hash'], start, end, root))
+    with open_raw_file(file, root) as f:
+        f.seek(start)
+        return f.read() if end is None else f.read(max(end - start, 0))
+
+def raw_file_parts(file, part_size=DOWNLOAD_PART_SIZE):
+    """(start, end) byte ranges splitting a raw_files row into downloads of at most part_size"""
+    size = file['file_size']
+    if not size or size <= part_size:
+        return [(0, None)]
+    return [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+
+def import_legacy_files(conn=None, root=None):
+    """Move raw files uploaded before the store into it.
+
+    Every raw_files row without a content hash whose file still exists is
+    copied into the store and pointed at its blob. Returns (imported,
+    missing) row counts; the original files are left in place.
+    """
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    try:
+        rows = conn.execute("""
+            SELECT id, file_path FROM raw_files WHERE content_hash IS NULL ORDER BY id
+        """).fetchall()
+        imported = missing = 0
+        for row in rows:
+            if not os.path.exists(row['file_path']):
+                missing += 1
+                continue
+            with open(row['file_path'], "rb") as f:
+                digest, size, _ = put_blob(f, root)
+            with transaction(conn):
+                conn.execute("""
+                    UPDATE raw_files SET content_hash = ?, file_size = ?, file_path = ? WHERE id = ?
+                """, (digest, size, blob_key(digest), row['id']))
+            imported += 1
+        return imported, missing
+    finally:
+        if close_conn:
+            conn.close()
+
+SCRUB_QUERY = """
+    SELECT id, test_result_id, file_name, file_path, file_size, content_hash
+    FROM raw_files
+    WHERE id > ? AND is_deleted = 0
+    ORDER BY id
+    LIMIT ?
+"""
+
+SCRUB_REPORT_COLUMNS = ['file_id', 'test_result_id', 'file_name', 'content_hash', 'status', 'detail']
+
+class _Throttle:
+    """Paces reads shared by several threads to a number of bytes per second"""
+
+    def __init__(self, bytes_per_second=None):
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def consume(self, size):
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + size / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+def verify_blob(digest, size=None, root=None, throttle=None):
+    """Re-hash a stored blob; returns (status, detail).
+
+    status is 'ok', 'missing' or 'corrupt' (the content no longer matches
+    its hash or recorded size, or cannot be decompressed).
+    """
+    if not blob_exists(digest, root):
+        return 'missing', 'Blob not found'
+    sha256 = hashlib.sha256()
+    read = 0
+    try:
+        with open_blob(digest, root) as f:
+            for chunk in iter(lambda: f.read(BLOB_CHUNK_SIZE), b""):
+                if throttle:
+                    throttle.consume(len(chunk))
+                sha256.update(chunk)
+                read += len(chunk)
+    except _READ_ERRORS as e:
+        return 'corrupt', f"Unreadable: {e}"
+    if sha256.hexdigest() != digest:
+        return 'corrupt', f"Hash mismatch ({sha256.hexdigest()})"
+    if size is not None and read != size:
+        return 'corrupt', f"Size {read} instead of {size}"
+    return 'ok', ''
+
+def _verify_file(file, root, throttle):
+    if file['content_hash']:
+        return verify_blob(file['content_hash'], file['file_size'], root, throttle)
+    # Uploaded before the store: no hash to check against
+    if not os.path.exists(file['file_path']):
+        return 'missing', f"File not found: {file['file_path']}"
+    return 'unverified', 'No content hash (run --import-legacy)'
+
+def scrub_raw_files(root=None, workers=SCRUB_WORKERS, bytes_per_second=None,
+                    batch_size=SCRUB_BATCH_SIZE, restart=False, report_path=None, progress=None):
+    """Verify every live raw_files entry against its stored content.
+
+    Rows are read in id order, batch_size at a time; each distinct blob is
+    re-hashed once, across a pool of worker threads whose combined reads
+    are limited to bytes_per_second (None: unlimited). The last row id of
+    each finished batch is checkpointed, so an interrupted scrub resumes
+    from there (restart=True starts over); the checkpoint is cleared when
+    the scrub completes.
+
+    Every missing, corrupt or unverified file is listed in a CSV report.
+    progress is called with the running summary after each batch. Returns
+    the summary.
+    """
+    if report_path is None:
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        report_path = os.path.join(REPORT_DIR, f"scrub_{stamp}.csv")
+
+    throttle = _Throttle(bytes_per_second)
+    conn = get_connection()
+    pool = ThreadPoolExecutor(workers)
+    try:
+        after_id = 0
+        if not restart:
+            row = conn.execute("SELECT last_id FROM rollup_state WHERE name = 'scrub'").fetchone()
+            after_id = row['last_id'] if row else 0
+
+        summary = {
+            'resumed_after': after_id,
+            'scanned': 0,
+            'ok': 0,
+            'missing': 0,
+            'corrupt': 0,
+            'unverified': 0,
+            'report': report_path,
+        }
+
+        with open(report_path, "w", newline="", encoding="utf-8-sig") as f:
+            report = csv.writer(f)
+            report.writerow(SCRUB_REPORT_COLUMNS)
+
+            while True:
+                files = conn.execute(SCRUB_QUERY, (after_id, batch_size)).fetchall()
+                if not files:
+                    break
+
+                # One check per distinct blob in the batch
+                checks = {}
+                for file in files:
+                    key = file['content_hash'] or ('file', file['id'])
+                    if key not in checks:
+                        checks[key] = pool.submit(_verify_file, file, root, throttle)
+
+                for file in files:
+                    status, detail = checks[file['content_hash'] or ('file', file['id'])].result()
+                    summary[status] += 1
+                    if status != 'ok':
+                        report.writerow([file['id'], file['test_result_id'], file['file_name'],
+                                         file['content_hash'] or '', status, detail])
+                summary['scanned'] += len(files)
+                f.flush()
+
+                after_id = files[-1]['id']
+                with transaction(conn):
+                    conn.execute("""
+                        INSERT OR REPLACE INTO rollup_state (name, last_id, updated_mark, refreshed_at)
+                        VALUES ('scrub', ?, '', CURRENT_TIMESTAMP)
+                    """, (after_id,))
+                if progress:
+                    progress(summary)
+
+        with transaction(conn):
+            conn.execute("DELETE FROM rollup_state WHERE name = 'scrub'")
+        return summary
+    finally:
+        pool.shutdown(cancel_futures=True)
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the CE-LIMS raw file store")
+    parser.add_argument("--db", help="Database file (defaults to CE_LIMS_DB_PATH or ce_lims.db)")
+    parser.add_argument("--root", help="Store root directory (defaults to CE_LIMS_BLOB_ROOT or uploads)")
+    parser.add_argument("--import-legacy", action="store_true",
+                        help="Copy raw files uploaded before the store into it")
+    parser.add_argument("--scrub", action="store_true", help="Verify every raw file against its content hash")
+    parser.add_argument("--workers", type=int, default=SCRUB_WORKERS, help="Files verified in parallel")
+    parser.add_argument("--rate", type=float, help="Scrub read limit in MB per second (default: unlimited)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint of an interrupted scrub")
+    parser.add_argument("--report", help="CSV report path (default: a new file in the reports directory)")
+    args = parser.parse_args()
+
+    if args.db:
+        configure_database(args.db)
+
+    if args.import_legacy:
+        imported, missing = import_legacy_files(root=args.root)
+        print(f"✅ {imported} file(s) imported, {missing} missing")
+
+    if args.scrub:
+        def show_progress(summary):
+            print(f"  ... {summary['scanned']} checked, {summary['missing']} missing, {summary['corrupt']} corrupt",
+                  end="\r", flush=True)
+
+        print("🔍 Scrubbing raw files...")
+        summary = scrub_raw_files(
+            root=args.root,
+            workers=args.workers,
+            bytes_per_second=args.rate * 1024 * 1024 if args.rate else None,
+            restart=args.restart,
+            report_path=args.report,
+            progress=show_progress,
+        )
+        print()
+        if summary['resumed_after']:
+            print(f"  ↪️ Resumed after file {summary['resumed_after']}")
+        print(f"{'✅' if not summary['missing'] and not summary['corrupt'] else '❌'} "
+              f"{summary['scanned']} file(s) checked: {summary['ok']} ok, {summary['missing']} missing, "
+              f"{summary['corrupt']} corrupt, {summary['unverified']} unverified")
+        print(f"📄 Report: {summary['report']}")
@@ -4,7 +4,9 @@ ASTM standard calculations for various test methods
 """
 
 import math
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List
+
+import numpy as np
 
 def calculate_penetration_test(data: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -304,6 +306,25 @@ def calculate_cbr(data: Dict[str, Any]) -> Dict[str, Any]:
         'standard': 'ASTM D1883'
     }
 
+CALCULATORS = {
+    'ASTM D5': calculate_penetration_test,
+    'ASTM C39': calculate_compressive_strength,
+    'ASTM D1557': calculate_proctor_test,
+    'ASTM D2166': calculate_unconfined_compression,
+    'ASTM D4318': calculate_atterberg_limits,
+    'ASTM D1883': calculate_cbr,
+}
+
+# Key of each calculator's headline value (stored as test_results.result_value)
+RESULT_VALUE_KEYS = {
+    'ASTM D5': 'average_penetration',
+    'ASTM C39': 'compressive_strength',
+    'ASTM D1557': 'dry_density',
+    'ASTM D2166': 'unconfined_compressive_strength',
+    'ASTM D4318': 'plasticity_index',
+    'ASTM D1883': 'cbr_value',
+}
+
 def auto_calculate(test_standard: str, test_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Automatically calculate test results based on test standard
@@ -315,16 +336,7 @@ def auto_calculate(test_standard: str, test_data: Dict[str, Any]) -> Dict[str, A
     Returns:
         Dictionary with calculated results
     """
-    calculators = {
-        'ASTM D5': calculate_penetration_test,
-        'ASTM C39': calculate_compressive_strength,
-        'ASTM D1557': calculate_proctor_test,
-        'ASTM D2166': calculate_unconfined_compression,
-        'ASTM D4318': calculate_atterberg_limits,
-        'ASTM D1883': calculate_cbr,
-    }
-    
-    calculator = calculators.get(test_standard)
+    calculator = CALCULATORS.get(test_standard)
     
     if calculator:
         return calculator(test_data)
@@ -334,6 +346,291 @@ def auto_calculate(test_standard: str, test_data: Dict[str, Any]) -> Dict[str, A
             'manual_entry_required': True
         }
 
+# ---------------------------------------------------------------------------
+# Batch mode: the same calculations over columns of many specimens at once.
+# Each batch calculator returns {'error': mask, 'error_message': str, ...}
+# with one NumPy array (or constant) per key of the scalar result.
+# ---------------------------------------------------------------------------
+
+def _record_count(records: Any) -> int:
+    """Number of rows in a DataFrame or dict of columns"""
+    if hasattr(records, 'columns'):
+        return len(records)
+    for values in records.values():
+        return len(values)
+    return 0
+
+def _column(records: Any, name: str, n: int, default: float = 0) -> np.ndarray:
+    """
+    One input column as an array; missing columns and NaN/None cells take
+    the default, as a missing key does in the scalar calculators
+    """
+    if name not in records:
+        return np.full(n, default)
+    values = np.asarray(records[name])
+    if values.dtype == object:
+        values = np.array([default if v is None else v for v in values], dtype=float)
+    if values.dtype.kind == 'f':
+        values = np.where(np.isnan(values), default, values)
+    return values
+
+def _readings_matrix(values: Any) -> np.ndarray:
+    """Readings as a 2-D float array, rows of unequal length padded with NaN"""
+    if isinstance(values, np.ndarray) and values.dtype != object and values.ndim == 2:
+        return values.astype(float)
+    # Lengths are compared before any array is built: numpy refuses ragged
+    # nested lists instead of making an object array
+    rows = [list(r) if isinstance(r, (list, tuple, np.ndarray)) else [] for r in values]
+    width = max((len(r) for r in rows), default=0)
+    if rows and all(len(r) == width for r in rows):
+        return np.asarray(rows, dtype=float)
+    matrix = np.full((len(rows), width), np.nan)
+    for i, row in enumerate(rows):
+        matrix[i, :len(row)] = row
+    return matrix
+
+def _round(values: np.ndarray, ndigits: int) -> np.ndarray:
+    """
+    Round like the built-in round(); np.round can differ near a tie, so
+    those few values are rounded with round() itself
+    """
+    scale = 10.0 ** ndigits
+    scaled = values * scale
+    rounded = np.round(scaled) / scale
+    with np.errstate(invalid='ignore'):
+        near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_tie):
+        rounded[i] = round(float(values[i]), ndigits)
+    return rounded
+
+def _classify(values: np.ndarray, thresholds: List[float], labels: List[str]) -> np.ndarray:
+    """Label each value by the number of thresholds it reaches (value >= threshold)"""
+    return np.asarray(labels, dtype=object)[np.searchsorted(thresholds, values, side='right')]
+
+def calculate_penetration_test_batch(records: Any) -> Dict[str, Any]:
+    """ASTM D5 over many specimens; readings is a 2-D array or a column of lists"""
+    n = _record_count(records)
+    readings = _readings_matrix(records['readings']) if 'readings' in records else np.empty((n, 0))
+    present = ~np.isnan(readings)
+    count = present.sum(axis=1)
+
+    # Sum column by column so the additions happen in the scalar order
+    total = np.zeros(n)
+    for j in range(readings.shape[1]):
+        total = total + np.where(present[:, j], readings[:, j], 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_penetration = total / count
+        squares = np.zeros(n)
+        for j in range(readings.shape[1]):
+            squares = squares + np.where(present[:, j], (readings[:, j] - avg_penetration) ** 2, 0)
+        std_dev = np.sqrt(squares / count)
+        cv = np.where(avg_penetration > 0, std_dev / avg_penetration * 100, 0)
+
+    return {
+        'error': count < 3,
+        'error_message': 'At least 3 readings required',
+        'average_penetration': _round(avg_penetration, 1),
+        'unit': '0.1mm',
+        'std_deviation': _round(std_dev, 2),
+        'coefficient_of_variation': _round(cv, 2),
+        'grade': _classify(avg_penetration, [50, 100, 150, 200],
+                           ["Unknown", "85/100", "80/100", "60/70", "40/50"]),
+        'pass_fail': np.where(cv <= 10, 'pass', 'fail').astype(object),
+        'formula': 'Average = Σ(readings) / n',
+        'standard': 'ASTM D5'
+    }
+
+def calculate_compressive_strength_batch(records: Any) -> Dict[str, Any]:
+    """ASTM C39 over many specimens"""
+    n = _record_count(records)
+    diameter = _column(records, 'diameter', n)
+    max_load = _column(records, 'max_load', n)
+    age = _column(records, 'age', n, 28)
+
+    radius = diameter / 2
+    area = math.pi * radius ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        strength = (max_load * 1000) / area
+    min_strength = np.select([age == 7, age == 28], [20, 30], 25)
+
+    return {
+        'error': (diameter <= 0) | (max_load <= 0),
+        'error_message': 'Invalid input values',
+        'compressive_strength': _round(strength, 2),
+        'unit': 'MPa',
+        'cross_sectional_area': _round(area, 2),
+        'area_unit': 'mm²',
+        'age': age,
+        'min_required_strength': min_strength,
+        'pass_fail': np.where(strength >= min_strength, 'pass', 'fail').astype(object),
+        'formula': 'Strength (MPa) = Load (kN) × 1000 / Area (mm²)',
+        'standard': 'ASTM C39'
+    }
+
+def calculate_proctor_test_batch(records: Any) -> Dict[str, Any]:
+    """ASTM D1557 over many specimens"""
+    n = _record_count(records)
+    mold_volume = _column(records, 'mold_volume', n)
+    wet_mass = _column(records, 'wet_mass', n)
+    mold_mass = _column(records, 'mold_mass', n)
+    water_content = _column(records, 'water_content', n)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        wet_density = (wet_mass - mold_mass) / mold_volume
+        dry_density = wet_density / (1 + water_content / 100)
+
+    return {
+        'error': (mold_volume <= 0) | (wet_mass <= mold_mass),
+        'error_message': 'Invalid input values',
+        'wet_density': _round(wet_density, 3),
+        'dry_density': _round(dry_density, 3),
+        'unit': 'g/cm³',
+        'water_content': water_content,
+        'optimum_moisture_content': 'To be determined from curve',
+        'maximum_dry_density': 'To be determined from curve',
+        'formula': 'Dry Density = Wet Density / (1 + w/100)',
+        'standard': 'ASTM D1557'
+    }
+
+def calculate_unconfined_compression_batch(records: Any) -> Dict[str, Any]:
+    """
+    ASTM D2166 over many specimens; a deformation equal to the height
+    (where the scalar calculator divides by zero) is flagged as an error
+    """
+    n = _record_count(records)
+    diameter = _column(records, 'diameter', n)
+    height = _column(records, 'height', n)
+    max_load = _column(records, 'max_load', n)
+    deformation = _column(records, 'deformation', n)
+
+    initial_area = math.pi * (diameter / 2) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        strain = (deformation / height) * 100
+        corrected_area = initial_area / (1 - deformation / height)
+        qu = (max_load * 1000) / corrected_area
+
+    return {
+        'error': (diameter <= 0) | (height <= 0) | (max_load <= 0) | (deformation == height),
+        'error_message': 'Invalid input values',
+        'unconfined_compressive_strength': _round(qu, 2),
+        'unit': 'kPa',
+        'strain_at_failure': _round(strain, 2),
+        'strain_unit': '%',
+        'consistency': _classify(qu, [25, 50, 100, 200, 400],
+                                 ["Very Soft", "Soft", "Medium", "Stiff", "Very Stiff", "Hard"]),
+        'formula': 'qu = P / A_corrected',
+        'standard': 'ASTM D2166'
+    }
+
+def calculate_atterberg_limits_batch(records: Any) -> Dict[str, Any]:
+    """ASTM D4318 over many specimens; activity is NaN where the scalar result omits it"""
+    n = _record_count(records)
+    liquid_limit = _column(records, 'liquid_limit', n)
+    plastic_limit = _column(records, 'plastic_limit', n)
+    clay_fraction = _column(records, 'clay_fraction', n)
+
+    plasticity_index = liquid_limit - plastic_limit
+    with np.errstate(divide='ignore', invalid='ignore'):
+        activity = np.where(clay_fraction > 0, plasticity_index / clay_fraction, 0)
+
+    return {
+        'error': (liquid_limit <= 0) | (plastic_limit <= 0),
+        'error_message': 'Invalid input values',
+        'liquid_limit': liquid_limit,
+        'plastic_limit': plastic_limit,
+        'plasticity_index': plasticity_index,
+        'classification': _classify(plasticity_index, [7, 17],
+                                    ["Non-plastic to Low Plasticity", "Medium Plasticity", "High Plasticity"]),
+        'formula': 'PI = LL - PL',
+        'standard': 'ASTM D4318',
+        'activity': np.where(activity != 0, _round(activity, 2), np.nan)
+    }
+
+def calculate_cbr_batch(records: Any) -> Dict[str, Any]:
+    """ASTM D1883 over many specimens"""
+    n = _record_count(records)
+    load_2_5mm = _column(records, 'load_2_5mm', n)
+    load_5mm = _column(records, 'load_5mm', n)
+
+    cbr_2_5mm = np.where(load_2_5mm > 0, (load_2_5mm / 13.24) * 100, 0)
+    cbr_5mm = np.where(load_5mm > 0, (load_5mm / 19.96) * 100, 0)
+    cbr = np.maximum(cbr_2_5mm, cbr_5mm)
+
+    return {
+        'error': (load_2_5mm <= 0) & (load_5mm <= 0),
+        'error_message': 'Invalid input values',
+        'cbr_2_5mm': _round(cbr_2_5mm, 2),
+        'cbr_5mm': _round(cbr_5mm, 2),
+        'cbr_value': _round(cbr, 2),
+        'unit': '%',
+        'subgrade_classification': _classify(cbr, [3, 7, 20, 50],
+                                             ["Very Poor", "Poor to Fair", "Fair", "Good", "Excellent"]),
+        'formula': 'CBR = (Test Load / Standard Load) × 100',
+        'standard': 'ASTM D1883'
+    }
+
+BATCH_CALCULATORS = {
+    'ASTM D5': calculate_penetration_test_batch,
+    'ASTM C39': calculate_compressive_strength_batch,
+    'ASTM D1557': calculate_proctor_test_batch,
+    'ASTM D2166': calculate_unconfined_compression_batch,
+    'ASTM D4318': calculate_atterberg_limits_batch,
+    'ASTM D1883': calculate_cbr_batch,
+}
+
+def auto_calculate_batch(test_standard: str, records: Any) -> Dict[str, Any]:
+    """
+    Calculate test results for many specimens of one standard at once
+    
+    Args:
+        test_standard: ASTM standard code (e.g., 'ASTM C39')
+        records: DataFrame or dict of equal-length columns (NumPy arrays or
+            lists) named like the scalar test_data keys; NaN/None cells
+            count as missing keys
+    
+    Returns:
+        Dictionary with 'error' (boolean mask of rows the scalar calculator
+        rejects), 'error_message', and one array per result key (values in
+        error rows are meaningless); constant keys are plain values
+    """
+    calculator = BATCH_CALCULATORS.get(test_standard)
+    
+    if calculator:
+        return calculator(records)
+    else:
+        return {
+            'error': np.ones(_record_count(records), dtype=bool),
+            'error_message': f'No calculator available for {test_standard}',
+            'manual_entry_required': True
+        }
+
+def iter_batch_results(batch: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Yield one result dictionary per row of an auto_calculate_batch()
+    result, identical to what auto_calculate() returns for that row
+    """
+    error = batch['error']
+    columns = {k: v for k, v in batch.items() if k not in ('error', 'error_message', 'manual_entry_required')}
+    
+    for i in range(len(error)):
+        if error[i]:
+            result = {'error': batch['error_message']}
+            if batch.get('manual_entry_required'):
+                result['manual_entry_required'] = True
+            yield result
+            continue
+        
+        result = {}
+        for key, values in columns.items():
+            value = values[i] if isinstance(values, np.ndarray) else values
+            if isinstance(value, np.generic):
+                value = value.item()
+            if key == 'activity' and value != value:
+                continue
+            result[key] = value
+        yield result
+
 # Example usage and testing
 if __name__ == "__main__":
     # Test penetration calculation
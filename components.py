@@ -5,6 +5,11 @@ Modern Dark Mode Design with Blue Accent
 
 import streamlit as st
 from auth import get_current_user, logout, get_role_name
+from database import get_table_versions, PAGE_SIZE
+from search import search
+
+# Section results kept per session (one entry per visited page or filter)
+SECTION_CACHE_SIZE = 32
 
 def load_custom_css():
     """Load custom CSS with modern dark mode design"""
@@ -449,6 +454,31 @@ def show_header(active_page="dashboard"):
             </div>
         </div>
     """, unsafe_allow_html=True)
+    
+    # Global search
+    query = st.text_input(
+        "Search / بحث",
+        key="global_search",
+        placeholder="🔍 Search samples, projects, tests, observations... / ابحث في العينات والمشاريع والاختبارات...",
+        label_visibility="collapsed"
+    )
+    if query.strip():
+        show_search_results(query)
+
+def show_search_results(query):
+    """Display global search results"""
+    icons = {'sample': '🧪', 'project': '🏗️', 'test_method': '📐', 'test_result': '📝'}
+    results = search(query)
+    
+    with st.container(border=True):
+        if not results:
+            st.info(f"ℹ️ No results for \"{query}\" / لا توجد نتائج")
+            return
+        
+        st.caption(f"{len(results)} result(s) / نتيجة")
+        for result in results:
+            st.markdown(f"{icons.get(result['kind'], '🔎')} **{result['label']}** — {result['detail']}")
+            st.caption(result['snippet'])
 
 def show_page_title(title_en, title_ar):
     """Display page title bar"""
@@ -505,3 +535,178 @@ def show_footer():
             © 2024 CE-LIMS. All rights reserved. / جميع الحقوق محفوظة.
         </div>
     """, unsafe_allow_html=True)
+
+def show_sections(sections, key):
+    """Display a tab bar that only executes the active section.
+
+    sections is a list of (label, render_function). Unlike st.tabs, which
+    runs every tab body on each rerun, only the selected section's queries
+    and widgets are executed.
+    """
+    labels = [label for label, _ in sections]
+    active = st.radio(
+        "Section / القسم",
+        options=labels,
+        horizontal=True,
+        key=key,
+        label_visibility="collapsed"
+    )
+    st.markdown("---")
+    dict(sections)[active]()
+
+def cached_section_data(key, tables, loader):
+    """Return loader() cached in the session until one of tables is written.
+
+    Validity is checked against the table_versions counters, so the query
+    re-runs only after a write to a table the section depends on. Keys of
+    per-user data must include the user id. The cache keeps the
+    SECTION_CACHE_SIZE most recently used entries.
+    """
+    versions = get_table_versions(tables)
+    cache = st.session_state.setdefault('section_cache', {})
+    entry = cache.pop(key, None)
+    if entry is None or entry[0] != versions:
+        entry = (versions, loader())
+    # Re-inserted so the dict stays in least recently used order
+    cache[key] = entry
+    while len(cache) > SECTION_CACHE_SIZE:
+        del cache[next(iter(cache))]
+    return entry[1]
+
+def get_page_request(key, default_size=PAGE_SIZE):
+    """Get (after cursor, page size) for a paginated list"""
+    cursors = st.session_state.setdefault(f"{key}_cursors", [None])
+    page_size = st.session_state.get(f"{key}_page_size", default_size)
+    return cursors[-1], page_size
+
+def reset_pager(key):
+    """Go back to the first page of a paginated list"""
+    st.session_state[f"{key}_cursors"] = [None]
+
+def page_total_label(page):
+    """Format a page's total count (estimates are shown as N+)"""
+    return f"{page.total}" if page.total_exact else f"{page.total}+"
+
+def show_pager(key, page, page_sizes=(10, 20, 50, 100)):
+    """Display Previous/Next controls and page size for a keyset-paginated list"""
+    cursors = st.session_state.setdefault(f"{key}_cursors", [None])
+    
+    def go_next():
+        cursors.append(page.next_cursor)
+    
+    def go_previous():
+        if len(cursors) > 1:
+            cursors.pop()
+    
+    col1, col2, col3, col4 = st.columns([1, 2, 1, 1])
+    
+    with col1:
+        st.button("◀ Previous / السابق", key=f"{key}_prev", on_click=go_previous,
+                  disabled=len(cursors) <= 1, use_container_width=True)
+    
+    with col2:
+        st.caption(f"Page {len(cursors)} / الصفحة {len(cursors)} · "
+                   f"Total / الإجمالي: {page_total_label(page)}")
+    
+    with col3:
+        st.button("Next / التالي ▶", key=f"{key}_next", on_click=go_next,
+                  disabled=not page.has_more, use_container_width=True)
+    
+    with col4:
+        current = st.session_state.get(f"{key}_page_size", PAGE_SIZE)
+        st.selectbox(
+            "Page size / حجم الصفحة",
+            options=list(page_sizes),
+            index=list(page_sizes).index(current) if current in page_sizes else 0,
+            key=f"{key}_page_size",
+            on_change=reset_pager,
+            args=(key,),
+            label_visibility="collapsed"
+        )
+
+def _parameter_label(field):
+    label = field.label if field.label_ar == field.label else f"{field.label} / {field.label_ar}"
+    return f"{label} ({field.unit}):" if field.unit else f"{label}:"
+
+def _number_field(field, label, key):
+    cast = int if field.type == 'integer' else float
+    # A value already put in the session (e.g. pre-filled from a machine
+    # export) takes the place of the default
+    default = {} if key in st.session_state else {'value': cast(field.default)}
+    return st.number_input(
+        label,
+        min_value=cast(field.min) if field.min is not None else None,
+        max_value=cast(field.max) if field.max is not None else None,
+        step=cast(field.step or 0.1),
+        key=key,
+        **default
+    )
+
+def show_parameter_form(schema, key_suffix):
+    """Display inputs for a compiled parameter schema; returns {field name: value}.
+
+    Single-value fields are laid out in two columns, readings fields as a
+    row of one input per reading below them.
+    """
+    values = {}
+    cols = st.columns(2)
+    single = [f for f in schema.fields if f.type != 'readings']
+    for i, field in enumerate(single):
+        key = f"param_{field.name}_{key_suffix}"
+        with cols[i % 2]:
+            if field.type == 'choice':
+                values[field.name] = st.selectbox(
+                    _parameter_label(field), options=list(field.options),
+                    index=field.options.index(field.default), key=key
+                )
+            elif field.type == 'text':
+                values[field.name] = st.text_input(_parameter_label(field), value=field.default, key=key)
+            else:
+                values[field.name] = _number_field(field, _parameter_label(field), key)
+    
+    for field in schema.fields:
+        if field.type != 'readings':
+            continue
+        st.markdown(f"#### {field.label} / {field.label_ar}")
+        reading_cols = st.columns(field.count)
+        values[field.name] = []
+        for n, col in enumerate(reading_cols, start=1):
+            with col:
+                values[field.name].append(_number_field(
+                    field, f"Reading {n} ({field.unit})" if field.unit else f"Reading {n}",
+                    f"param_{field.name}_{n}_{key_suffix}"
+                ))
+    
+    return {field.name: values[field.name] for field in schema.fields}
+
+CURVE_AXIS_LABELS = {
+    'load': "Load (kN) / الحمل",
+    'displacement': "Displacement (mm) / الإزاحة",
+    'time': "Time (s) / الزمن",
+}
+
+def show_curve_zoom(bounds, key):
+    """Display a range slider over a curve's x axis; returns the range (None for all of it)"""
+    low, high = bounds
+    if not high > low:
+        return None
+    selected = st.slider(
+        "Zoom / تكبير",
+        min_value=float(low),
+        max_value=float(high),
+        value=(float(low), float(high)),
+        key=key
+    )
+    return None if selected == (float(low), float(high)) else selected
+
+def show_curve_chart(series, color=None):
+    """Display a downsampled curve series (x and y columns, one line per color value) as a line chart"""
+    x, y = [c for c in series.columns if c != color][:2]
+    st.line_chart(
+        series,
+        x=x,
+        y=y,
+        color=color,
+        x_label=CURVE_AXIS_LABELS.get(x, x),
+        y_label=CURVE_AXIS_LABELS.get(y, y)
+    )
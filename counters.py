@@ -0,0 +1,116 @@
+"""
+CE-LIMS Dashboard Counters Module
+Constant-time dashboard metrics from the trigger-maintained dashboard_counters table
+"""
+
+import argparse
+from database import get_connection, transaction, configure_database
+
+# metric -> query producing (dim1, dim2, count) rows from the source tables.
+# The triggers from migration 5 keep the same numbers current on every write.
+COUNTER_QUERIES = {
+    'samples_by_status': """
+        SELECT status, '', COUNT(*)
+        FROM samples WHERE is_deleted = 0 GROUP BY status
+    """,
+    'samples_by_project': """
+        SELECT project_id, status, COUNT(*)
+        FROM samples WHERE is_deleted = 0 GROUP BY project_id, status
+    """,
+    'assignments_by_status': """
+        SELECT status, '', COUNT(*)
+        FROM test_assignments WHERE is_deleted = 0 GROUP BY status
+    """,
+    'assignments_by_supervisor': """
+        SELECT assigned_by, status, COUNT(*)
+        FROM test_assignments WHERE is_deleted = 0 GROUP BY assigned_by, status
+    """,
+    'assignments_by_material': """
+        SELECT s.material_type, '', COUNT(*)
+        FROM test_assignments ta JOIN samples s ON ta.sample_id = s.id
+        WHERE ta.is_deleted = 0 GROUP BY s.material_type
+    """,
+    'results_by_status': """
+        SELECT status, '', COUNT(*)
+        FROM test_results WHERE is_deleted = 0 GROUP BY status
+    """,
+}
+
+def get_counters(conn, metric, dim1=None):
+    """Get one metric's counts as a dict.
+
+    Without dim1 the result is keyed by dim1 (summed over dim2); with dim1
+    it is keyed by dim2 for that dim1 value. Zero counts are left out.
+    """
+    cursor = conn.cursor()
+    if dim1 is None:
+        cursor.execute("""
+            SELECT dim1 as dim, SUM(count) as count FROM dashboard_counters
+            WHERE metric = ? GROUP BY dim1
+        """, (metric,))
+    else:
+        cursor.execute("""
+            SELECT dim2 as dim, count FROM dashboard_counters
+            WHERE metric = ? AND dim1 = ?
+        """, (metric, str(dim1)))
+    return {row['dim']: row['count'] for row in cursor.fetchall() if row['count']}
+
+def compute_counters(conn):
+    """Compute every counter from the source tables: {(metric, dim1, dim2): count}"""
+    counts = {}
+    cursor = conn.cursor()
+    for metric, query in COUNTER_QUERIES.items():
+        cursor.execute(query)
+        for dim1, dim2, count in cursor.fetchall():
+            counts[(metric, str(dim1 if dim1 is not None else ''), str(dim2))] = count
+    return counts
+
+def rebuild_dashboard_counters(conn=None):
+    """Rebuild dashboard_counters from scratch.
+
+    Returns the cells whose stored value differed from the recomputed one
+    as {(metric, dim1, dim2): (stored, actual)}.
+    """
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    try:
+        with transaction(conn):
+            stored = {
+                (row['metric'], row['dim1'], row['dim2']): row['count']
+                for row in conn.execute("SELECT metric, dim1, dim2, count FROM dashboard_counters")
+                if row['count']
+            }
+            actual = compute_counters(conn)
+
+            conn.execute("DELETE FROM dashboard_counters")
+            conn.executemany("""
+                INSERT INTO dashboard_counters (metric, dim1, dim2, count)
+                VALUES (?, ?, ?, ?)
+            """, [key + (count,) for key, count in actual.items()])
+
+        return {
+            key: (stored.get(key, 0), actual.get(key, 0))
+            for key in set(stored) | set(actual)
+            if stored.get(key, 0) != actual.get(key, 0)
+        }
+    finally:
+        if close_conn:
+            conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild CE-LIMS dashboard counters from scratch")
+    parser.add_argument("--db", help="Database file (defaults to CE_LIMS_DB_PATH or ce_lims.db)")
+    args = parser.parse_args()
+
+    if args.db:
+        configure_database(args.db)
+
+    print("🔄 Reconciling dashboard counters...")
+    drift = rebuild_dashboard_counters()
+    for (metric, dim1, dim2), (stored, actual) in sorted(drift.items()):
+        label = "/".join(d for d in (dim1, dim2) if d)
+        print(f"  ⚠️ {metric} {label}: {stored} -> {actual}")
+    print(f"✅ Dashboard counters rebuilt ({len(drift)} cell(s) corrected)")
@@ -0,0 +1,207 @@
+"""
+CE-LIMS Curve Store Module
+Binary float32 storage of raw test curves, read back through memory maps
+"""
+
+import argparse
+import json
+import os
+import tempfile
+from collections import namedtuple
+import numpy as np
+from database import get_connection, transaction, configure_database, prefetch_related
+from machine import parse_export
+
+# Directory of the curve files
+CURVE_ROOT = os.environ.get("CE_LIMS_CURVE_ROOT", "curves")
+
+# Curve files per subdirectory (by result id)
+CURVE_FANOUT = 1000
+
+CURVE_ENCODINGS = ('raw', 'delta')
+
+def curve_path(result_id, root=None):
+    """Path of a result's curve file"""
+    return os.path.join(root or CURVE_ROOT, str(result_id // CURVE_FANOUT), f"{result_id}.npy")
+
+StagedCurve = namedtuple('StagedCurve', ['path', 'columns', 'points', 'encoding'])
+
+CurveInfo = namedtuple('CurveInfo', ['columns', 'points', 'encoding'])
+
+def stage_curve(curve, encoding='raw', root=None):
+    """Write a curve's file to the staging directory, ready for publish_curve().
+
+    curve maps column names (load, displacement, time, ...) to equally long
+    arrays. They are written as one float32 .npy array with a row per
+    column, so every column can be read back as a contiguous memory-mapped
+    view. With encoding='delta' each column is stored as its first value
+    followed by successive differences (smaller and more compressible for
+    steadily increasing columns such as time); reading it back then
+    rebuilds the column in memory instead of mapping it.
+    """
+    if encoding not in CURVE_ENCODINGS:
+        raise ValueError(f"Unknown curve encoding: {encoding}")
+    columns = list(curve)
+    if not columns:
+        raise ValueError("A curve needs at least one column")
+    data = np.vstack([np.asarray(curve[column], dtype=np.float32) for column in columns])
+    if encoding == 'delta':
+        data = np.diff(data.astype(np.float64), axis=1, prepend=0).astype(np.float32)
+
+    staging = os.path.join(root or CURVE_ROOT, "incoming")
+    os.makedirs(staging, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=staging, suffix=".npy")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, data)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return StagedCurve(temp_path, columns, data.shape[1], encoding)
+
+def record_curve(conn, result_id, staged):
+    """List a staged curve in test_curves (run inside the result's write transaction)"""
+    conn.execute("""
+        INSERT OR REPLACE INTO test_curves (result_id, columns, points, encoding, created_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, (result_id, json.dumps(staged.columns), staged.points, staged.encoding))
+
+def publish_curve(result_id, staged, root=None):
+    """Move a staged curve file into place once its row is committed"""
+    path = curve_path(result_id, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(staged.path, path)
+
+def discard_curve(staged):
+    """Remove a staged curve file whose result was not written"""
+    if staged is not None and os.path.exists(staged.path):
+        os.remove(staged.path)
+
+def save_curve(result_id, curve, encoding='raw', conn=None, root=None):
+    """Store a result's curve, replacing any earlier one.
+
+    The file is staged first, listed in test_curves, then moved into place
+    (see stage_curve() for the file layout).
+    """
+    staged = stage_curve(curve, encoding, root)
+
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    try:
+        with transaction(conn):
+            record_curve(conn, result_id, staged)
+        publish_curve(result_id, staged, root)
+    except BaseException:
+        discard_curve(staged)
+        raise
+    finally:
+        if close_conn:
+            conn.close()
+
+def load_curve(result_id, conn=None, root=None, info=None):
+    """Get a result's curve as {column: float32 array} (None if it has none).
+
+    Raw-encoded columns are read-only views of a memory map of the file,
+    so only the parts actually used are read from disk. info is the
+    result's CurveInfo when already fetched (see get_curve_info()), which
+    saves the query.
+    """
+    if info is None:
+        close_conn = False
+        if conn is None:
+            conn = get_connection()
+            close_conn = True
+
+        try:
+            row = conn.execute("""
+                SELECT columns, points, encoding FROM test_curves WHERE result_id = ?
+            """, (result_id,)).fetchone()
+        finally:
+            if close_conn:
+                conn.close()
+
+        if row is None:
+            return None
+        info = CurveInfo(json.loads(row['columns']), row['points'], row['encoding'])
+
+    path = curve_path(result_id, root)
+    if not os.path.exists(path):
+        raise ValueError(f"Curve file missing for result {result_id}")
+
+    data = np.load(path, mmap_mode='r')
+    if info.encoding == 'delta':
+        return {column: np.cumsum(data[i], dtype=np.float64).astype(np.float32)
+                for i, column in enumerate(info.columns)}
+    return {column: data[i] for i, column in enumerate(info.columns)}
+
+def get_curve_info(result_ids, conn):
+    """Get {result id: CurveInfo} for the results that have a stored curve"""
+    rows = prefetch_related(conn, """
+        SELECT result_id, columns, points, encoding FROM test_curves WHERE result_id IN ({keys})
+    """, result_ids, 'result_id')
+    return {
+        result_id: CurveInfo(json.loads(found[0]['columns']), found[0]['points'], found[0]['encoding'])
+        for result_id, found in rows.items() if found
+    }
+
+def backfill_curves(conn=None, encoding='raw'):
+    """Store curves of results submitted with a machine export but no stored curve.
+
+    Returns (stored, failed) counts.
+    """
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    try:
+        rows = conn.execute("""
+            SELECT tr.id, tr.raw_data
+            FROM test_results tr
+            WHERE tr.raw_data LIKE '%"machine_export"%' AND tr.is_deleted = 0
+              AND NOT EXISTS (SELECT 1 FROM test_curves tc WHERE tc.result_id = tr.id)
+            ORDER BY tr.id
+        """).fetchall()
+        stored = failed = 0
+        for row in rows:
+            try:
+                export = json.loads(row['raw_data'])['machine_export']
+                parsed = parse_export(export['content_hash'], export['file_name'])
+            except (ValueError, KeyError, TypeError, OSError) as e:
+                print(f"  ❌ Result {row['id']}: {e}")
+                failed += 1
+                continue
+            save_curve(row['id'], parsed['curve'], encoding, conn)
+            stored += 1
+        return stored, failed
+    finally:
+        if close_conn:
+            conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage stored CE-LIMS test curves")
+    parser.add_argument("result_id", nargs="*", type=int, help="Results whose curve to summarise")
+    parser.add_argument("--db", help="Database file (defaults to CE_LIMS_DB_PATH or ce_lims.db)")
+    parser.add_argument("--backfill", action="store_true",
+                        help="Store curves of results submitted with a machine export")
+    parser.add_argument("--delta", action="store_true", help="Delta-encode backfilled curves")
+    args = parser.parse_args()
+
+    if args.db:
+        configure_database(args.db)
+
+    if args.backfill:
+        stored, failed = backfill_curves(encoding='delta' if args.delta else 'raw')
+        print(f"✅ {stored} curve(s) stored, {failed} failed")
+
+    for result_id in args.result_id:
+        curve = load_curve(result_id)
+        if curve is None:
+            print(f"➖ Result {result_id}: no curve")
+            continue
+        print(f"📈 Result {result_id}: {len(next(iter(curve.values())))} points")
+        for column, values in curve.items():
+            print(f"  {column}: min {values.min():g}, max {values.max():g}")
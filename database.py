@@ -4,18 +4,529 @@ ISO 17025 Compliant Database Structure
 """
 
 import sqlite3
-from datetime import datetime
+from datetime import datetime, date
 import hashlib
+import json
 import os
+import threading
+import queue
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager
 
-DB_PATH = "ce_lims.db"
+DB_PATH = os.environ.get("CE_LIMS_DB_PATH", "ce_lims.db")
 
-def get_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_PATH)
+# Connection tuning applied once when a pooled connection is opened.
+# WAL lets readers proceed while a writer holds the lock; NORMAL sync is
+# durable across application crashes in WAL mode and avoids an fsync per commit.
+BUSY_TIMEOUT_MS = 5000
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,        # ~20 MB page cache per connection
+    'mmap_size': 268435456,      # 256 MB memory-mapped I/O
+    'temp_store': 'MEMORY',
+    'busy_timeout': BUSY_TIMEOUT_MS,
+}
+POOL_SIZE = int(os.environ.get("CE_LIMS_POOL_SIZE", "16"))
+
+# Writer service: jobs arriving within the window share one commit
+GROUP_COMMIT_WINDOW_MS = 5
+MAX_WRITE_BATCH = 64
+WRITE_TIMEOUT = 30
+
+# Keyset pagination defaults
+PAGE_SIZE = 20
+COUNT_LIMIT = 10000
+
+
+def open_connection(db_path, pragmas=None, factory=sqlite3.Connection):
+    """Open a new SQLite connection with the tuning pragmas applied"""
+    pragmas = PRAGMAS if pragmas is None else pragmas
+    conn = sqlite3.connect(
+        db_path,
+        timeout=pragmas.get('busy_timeout', BUSY_TIMEOUT_MS) / 1000,
+        check_same_thread=False,
+        factory=factory
+    )
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
     conn.row_factory = sqlite3.Row
     return conn
 
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to the pool"""
+
+    _pool = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.release(self)
+        else:
+            super().close()
+
+    def close_physical(self):
+        """Really close the underlying SQLite handle"""
+        self._pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """Process-wide pool of tuned SQLite connections.
+
+    A connection is checked out by one script thread at a time and returned
+    to the idle list when the caller closes it, so a Streamlit rerun reuses an
+    already-open, already-tuned handle instead of paying connect cost.
+    """
+
+    def __init__(self, db_path, pool_size=POOL_SIZE, pragmas=None):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.pragmas = dict(PRAGMAS if pragmas is None else pragmas)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._stats = {
+            'opened': 0,
+            'reused': 0,
+            'checkouts': 0,
+            'returned': 0,
+            'discarded': 0,
+            'in_use': 0,
+        }
+
+    def _open(self):
+        return open_connection(self.db_path, self.pragmas, factory=PooledConnection)
+
+    def acquire(self):
+        """Check out a connection, opening a new one if the pool is empty"""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            if conn is not None:
+                self._stats['reused'] += 1
+            else:
+                self._stats['opened'] += 1
+
+        if conn is None:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._lock:
+                    self._stats['in_use'] -= 1
+                raise
+
+        conn._pool = self
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the idle list, discarding any open transaction"""
+        conn._pool = None
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close_physical()
+            with self._lock:
+                self._stats['in_use'] -= 1
+                self._stats['discarded'] += 1
+            return
+
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                self._stats['returned'] += 1
+                return
+            self._stats['discarded'] += 1
+        conn.close_physical()
+
+    def close_all(self):
+        """Close every idle connection (checked-out ones close on release)"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close_physical()
+
+    def stats(self):
+        """Snapshot of pool counters for monitoring"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['idle'] = len(self._idle)
+        snapshot['pool_size'] = self.pool_size
+        snapshot['db_path'] = self.db_path
+        return snapshot
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def configure_database(db_path=None, pool_size=None, pragmas=None):
+    """Point the connection manager at a database file and reset the pool"""
+    global DB_PATH, _pool
+    with _pool_lock:
+        if db_path is not None:
+            DB_PATH = db_path
+        old_pool = _pool
+        _pool = ConnectionPool(
+            DB_PATH,
+            pool_size=POOL_SIZE if pool_size is None else pool_size,
+            pragmas=pragmas
+        )
+    if old_pool is not None:
+        old_pool.close_all()
+    return _pool
+
+def get_pool():
+    """Get the process-wide connection pool, creating it on first use"""
+    global _pool
+    pool = _pool
+    if pool is None or pool.db_path != DB_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.db_path != DB_PATH:
+                old_pool, _pool = _pool, ConnectionPool(DB_PATH)
+                if old_pool is not None:
+                    old_pool.close_all()
+            pool = _pool
+    return pool
+
+def get_pool_stats():
+    """Get connection pool statistics"""
+    return get_pool().stats()
+
+def get_db_path():
+    """Get the configured database file path"""
+    return DB_PATH
+
+def get_connection():
+    """Get database connection (pooled; close() returns it to the pool)"""
+    return get_pool().acquire()
+
+_write_listeners = []
+
+def add_write_listener(callback):
+    """Register callback() to run after every commit made in this process
+    through transaction() or the writer service (e.g. to invalidate caches)"""
+    _write_listeners.append(callback)
+
+def notify_write_listeners():
+    """Tell the write listeners that a commit happened"""
+    for callback in list(_write_listeners):
+        try:
+            callback()
+        except Exception as e:
+            print(f"⚠️ Write listener failed: {e}")
+
+@contextmanager
+def transaction(conn=None):
+    """Unit of work: run a block of writes in one BEGIN IMMEDIATE transaction.
+
+    Pass the connection the view already holds so the domain write, chain of
+    custody record and audit row commit together; without one a pooled
+    connection is checked out for the block. The write lock is taken up front,
+    so the transaction either gets it (waiting up to the busy timeout) or fails
+    before any work is done, and it is committed with a single fsync.
+    """
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    # Join a transaction the caller already started rather than nesting
+    owns_transaction = not conn.in_transaction
+    if owns_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+    try:
+        yield conn
+        if owns_transaction:
+            conn.commit()
+            notify_write_listeners()
+    except BaseException:
+        if owns_transaction:
+            conn.rollback()
+        raise
+    finally:
+        if close_conn:
+            conn.close()
+
+WriteResult = namedtuple('WriteResult', ['lastrowid', 'rowcount'])
+
+
+class WriteService:
+    """Single writer thread that owns the only write connection.
+
+    Script threads submit write jobs and get a Future back. The writer takes
+    the first queued job, waits up to GROUP_COMMIT_WINDOW_MS for more, and runs
+    the whole batch in one BEGIN IMMEDIATE transaction with one commit. Each
+    job runs under its own savepoint, so a failing job is rolled back alone
+    and the rest of the batch still commits.
+    """
+
+    def __init__(self, db_path, window_ms=GROUP_COMMIT_WINDOW_MS, max_batch=MAX_WRITE_BATCH):
+        self.db_path = db_path
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'batches': 0,
+            'largest_batch': 0,
+        }
+        self._thread = threading.Thread(target=self._run, name="ce-lims-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, job, params=()):
+        """Queue a write job and return a Future.
+
+        job is either an SQL statement (the Future resolves to a WriteResult
+        with lastrowid and rowcount) or a callable taking the write
+        connection (the Future resolves to its return value).
+        """
+        future = Future()
+        with self._lock:
+            self._stats['submitted'] += 1
+        self._queue.put((job, params, future))
+        return future
+
+    def stop(self):
+        """Finish queued jobs and stop the writer thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        """Snapshot of writer counters for monitoring"""
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot['queue_depth'] = self._queue.qsize()
+        snapshot['db_path'] = self.db_path
+        return snapshot
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run_job(self, conn, job, params):
+        if callable(job):
+            return job(conn)
+        cursor = conn.execute(job, params)
+        return WriteResult(cursor.lastrowid, cursor.rowcount)
+
+    def _run(self):
+        conn = open_connection(self.db_path)
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                self._run_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _run_batch(self, conn, batch):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, params, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write_job")
+                try:
+                    result = self._run_job(conn, job, params)
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO write_job")
+                    conn.execute("RELEASE write_job")
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute("RELEASE write_job")
+                    outcomes.append((future, result, None))
+            conn.commit()
+        except BaseException as e:
+            # Could not begin or commit: nothing in the batch was written
+            if conn.in_transaction:
+                conn.rollback()
+            pending = {id(f) for f, _, _ in outcomes}
+            outcomes = [(f, None, e) for f, _, _ in outcomes]
+            outcomes += [(f, None, e) for _, _, f in batch
+                         if id(f) not in pending and not f.cancelled()]
+        else:
+            # Before resolving futures, so callers see fresh data on return
+            notify_write_listeners()
+
+        failed = 0
+        for future, result, error in outcomes:
+            if error is not None:
+                failed += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+            self._stats['completed'] += len(outcomes) - failed
+            self._stats['failed'] += failed
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """Get the process-wide writer service, starting it on first use"""
+    global _writer
+    writer = _writer
+    if writer is None or writer.db_path != DB_PATH:
+        with _writer_lock:
+            if _writer is None or _writer.db_path != DB_PATH:
+                old_writer, _writer = _writer, WriteService(DB_PATH)
+                if old_writer is not None:
+                    old_writer.stop()
+            writer = _writer
+    return writer
+
+def get_writer_stats():
+    """Get writer service statistics"""
+    return get_writer().stats()
+
+def submit_write(job, params=()):
+    """Queue a write job on the writer thread and return its Future"""
+    return get_writer().submit(job, params)
+
+def run_write(job, params=(), timeout=WRITE_TIMEOUT):
+    """Run a write job on the writer thread and wait for its result"""
+    return submit_write(job, params).result(timeout=timeout)
+
+def get_table_versions(tables, conn=None):
+    """Get write version counters for tables (maintained by triggers).
+
+    The returned tuple changes whenever any of the tables is written by any
+    connection or process, so it can be used as a cache validity key.
+    """
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
+    tables = tuple(tables)
+    placeholders = ", ".join("?" for _ in tables)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT table_name, version FROM table_versions
+        WHERE table_name IN ({placeholders})
+    """, tables)
+    versions = {row['table_name']: row['version'] for row in cursor.fetchall()}
+    
+    if close_conn:
+        conn.close()
+    
+    return tuple(versions.get(table, 0) for table in tables)
+
+def prefetch_related(conn, query, keys, key_column, chunk_size=500):
+    """Load child rows for many parent keys at once, grouped by key.
+
+    query must contain a {keys} placeholder inside an IN (...) clause, e.g.
+    "SELECT * FROM raw_files WHERE test_result_id IN ({keys})". Keys are sent
+    in chunks of chunk_size to stay under SQLite's parameter limit, so a page
+    of N parents costs ceil(N / chunk_size) statements instead of N.
+    Every key is present in the result, mapped to a (possibly empty) list.
+    """
+    keys = list(dict.fromkeys(keys))
+    grouped = {key: [] for key in keys}
+    cursor = conn.cursor()
+    
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        placeholders = ", ".join("?" for _ in chunk)
+        cursor.execute(query.format(keys=placeholders), chunk)
+        for row in cursor.fetchall():
+            grouped.setdefault(row[key_column], []).append(dict(row))
+    
+    return grouped
+
+Page = namedtuple('Page', ['rows', 'next_cursor', 'has_more', 'total', 'total_exact'])
+
+def fetch_page(conn, query, params=(), order_by=('id',), after=None,
+               page_size=PAGE_SIZE, descending=False, count_limit=COUNT_LIMIT):
+    """Fetch one page of a list query using a keyset cursor.
+
+    query is a SELECT without ORDER BY/LIMIT whose result columns include
+    every name in order_by; the last order_by column must be unique (the
+    row id) and none may be NULL. after is the next_cursor of the previous
+    page (None for the first page). Instead of OFFSET, the page starts with
+    a (sort_key, id) > (?, ?) comparison, so deep pages cost the same as the
+    first one. total counts at most count_limit rows; total_exact is False
+    when the real total is larger.
+    """
+    direction = "DESC" if descending else "ASC"
+    comparison = "<" if descending else ">"
+    columns = ", ".join(order_by)
+    
+    sql = f"SELECT * FROM ({query}) AS page_source"
+    args = list(params)
+    if after is not None:
+        placeholders = ", ".join("?" for _ in order_by)
+        sql += f" WHERE ({columns}) {comparison} ({placeholders})"
+        args += list(after)
+    sql += " ORDER BY " + ", ".join(f"{column} {direction}" for column in order_by)
+    sql += " LIMIT ?"
+    args.append(page_size + 1)
+    
+    cursor = conn.cursor()
+    cursor.execute(sql, args)
+    rows = [dict(r) for r in cursor.fetchall()]
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = tuple(rows[-1][column] for column in order_by) if has_more else None
+    
+    cursor.execute(f"SELECT COUNT(*) as count FROM (SELECT 1 FROM ({query}) LIMIT ?)",
+                   list(params) + [count_limit + 1])
+    total = cursor.fetchone()['count']
+    total_exact = total <= count_limit
+    
+    return Page(rows, next_cursor, has_more, min(total, count_limit), total_exact)
+
+class StatementCounter:
+    """Count SQL statements executed on a connection (for query budgets)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.statements = []
+
+    def __enter__(self):
+        self.conn.set_trace_callback(self.statements.append)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.conn.set_trace_callback(None)
+        return False
+
+    @property
+    def count(self):
+        return len(self.statements)
+
 def hash_password(password):
     """Hash password using SHA256"""
     return hashlib.sha256(password.encode()).hexdigest()
@@ -267,6 +778,11 @@ def init_database():
     
     conn.commit()
     conn.close()
+    
+    # Indexes and later schema changes are versioned migrations
+    from migrations import apply_migrations
+    apply_migrations(verbose=False)
+    
     print("✅ Database initialized successfully!")
 
 def seed_initial_data():
@@ -306,12 +822,17 @@ def seed_initial_data():
     """, projects)
     
     # Create test methods
+    from schemas import STANDARD_SCHEMAS
+
+    def parameters(standard):
+        return json.dumps(STANDARD_SCHEMAS[standard], ensure_ascii=False)
+
     test_methods = [
-        ('ASTM-D5', 'Penetration Test', 'اختبار الاختراق', 'ASTM D5', 'ASTM D5', 'Asphalt Binder', 'Test for penetration of bituminous materials', 'اختبار اختراق المواد البيتومينية', '{"temperature": 25, "load": 100, "time": 5}', 'penetration = depth / 10', 60),
-        ('ASTM-C39', 'Compressive Strength', 'مقاومة الضغط', 'ASTM C39', 'ASTM C39', 'Concrete', 'Standard test method for compressive strength of cylindrical concrete specimens', 'طريقة الاختبار القياسية لمقاومة الضغط للعينات الخرسانية الأسطوانية', '{"diameter": 150, "height": 300}', 'strength = load / area', 30),
-        ('ASTM-D1557', 'Modified Proctor', 'بروكتور المعدل', 'ASTM D1557', 'ASTM D1557', 'Soil', 'Laboratory compaction characteristics of soil', 'خصائص الدمك المعملي للتربة', '{"layers": 5, "blows": 25}', 'density = mass / volume', 120),
-        ('ASTM-D2166', 'Unconfined Compression', 'الضغط غير المحصور', 'ASTM D2166', 'ASTM D2166', 'Soil', 'Unconfined compressive strength of cohesive soil', 'مقاومة الضغط غير المحصور للتربة المتماسكة', '{"strain_rate": 1}', 'qu = P / A', 45),
-        ('ASTM-D4318', 'Atterberg Limits', 'حدود أتربرج', 'ASTM D4318', 'ASTM D4318', 'Soil', 'Liquid limit, plastic limit, and plasticity index of soils', 'حد السيولة وحد اللدونة ومعامل اللدونة للتربة', '{}', 'PI = LL - PL', 90),
+        ('ASTM-D5', 'Penetration Test', 'اختبار الاختراق', 'ASTM D5', 'ASTM D5', 'Asphalt Binder', 'Test for penetration of bituminous materials', 'اختبار اختراق المواد البيتومينية', parameters('ASTM D5'), 'penetration = depth / 10', 60),
+        ('ASTM-C39', 'Compressive Strength', 'مقاومة الضغط', 'ASTM C39', 'ASTM C39', 'Concrete', 'Standard test method for compressive strength of cylindrical concrete specimens', 'طريقة الاختبار القياسية لمقاومة الضغط للعينات الخرسانية الأسطوانية', parameters('ASTM C39'), 'strength = load / area', 30),
+        ('ASTM-D1557', 'Modified Proctor', 'بروكتور المعدل', 'ASTM D1557', 'ASTM D1557', 'Soil', 'Laboratory compaction characteristics of soil', 'خصائص الدمك المعملي للتربة', parameters('ASTM D1557'), 'density = mass / volume', 120),
+        ('ASTM-D2166', 'Unconfined Compression', 'الضغط غير المحصور', 'ASTM D2166', 'ASTM D2166', 'Soil', 'Unconfined compressive strength of cohesive soil', 'مقاومة الضغط غير المحصور للتربة المتماسكة', parameters('ASTM D2166'), 'qu = P / A', 45),
+        ('ASTM-D4318', 'Atterberg Limits', 'حدود أتربرج', 'ASTM D4318', 'ASTM D4318', 'Soil', 'Liquid limit, plastic limit, and plasticity index of soils', 'حد السيولة وحد اللدونة ومعامل اللدونة للتربة', parameters('ASTM D4318'), 'PI = LL - PL', 90),
     ]
     
     cursor.executemany("""
@@ -340,9 +861,13 @@ def seed_initial_data():
     print("  Lab Tech      - Username: omar     Password: 123456")
     print("  Manager       - Username: fatima   Password: 123456")
 
-def log_audit(table_name, record_id, action, old_values, new_values, changed_by):
+def log_audit(table_name, record_id, action, old_values, new_values, changed_by, conn=None):
     """Log audit trail for ISO 17025 compliance"""
-    conn = get_connection()
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -350,8 +875,31 @@ def log_audit(table_name, record_id, action, old_values, new_values, changed_by)
         VALUES (?, ?, ?, ?, ?, ?)
     """, (table_name, record_id, action, old_values, new_values, changed_by))
     
-    conn.commit()
-    conn.close()
+    if close_conn:
+        conn.commit()
+        conn.close()
+
+def log_audit_many(entries, conn=None):
+    """Log many audit trail rows in one statement.
+
+    entries is an iterable of (table_name, record_id, action, old_values,
+    new_values, changed_by) tuples, the same fields as log_audit().
+    """
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
+    cursor = conn.cursor()
+    
+    cursor.executemany("""
+        INSERT INTO audit_log (table_name, record_id, action, old_values, new_values, changed_by)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, list(entries))
+    
+    if close_conn:
+        conn.commit()
+        conn.close()
 
 def add_chain_of_custody(sample_id, from_person, to_person, location, purpose, condition, notes, conn=None):
     """Add chain of custody record"""
@@ -371,6 +919,51 @@ def add_chain_of_custody(sample_id, from_person, to_person, location, purpose, c
         conn.commit()
         conn.close()
 
+def format_sample_id(seq_date, number):
+    """Format a sample ID as S-YYYY-MM-DD-NNN"""
+    return f"S-{seq_date}-{number:03d}"
+
+def allocate_sample_ids(count=1, seq_date=None, conn=None):
+    """Atomically allocate the next sample ID(s) for a day.
+
+    The per-day counter lives in sample_id_sequences, so allocation is a
+    single primary-key upsert regardless of how many samples exist. Called
+    with the connection of an open transaction, the numbers are only
+    consumed if that transaction commits.
+    """
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    if seq_date is None:
+        seq_date = date.today()
+    if not isinstance(seq_date, str):
+        seq_date = seq_date.strftime('%Y-%m-%d')
+    
+    with transaction(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO sample_id_sequences (seq_date, next_value)
+            VALUES (?, 1 + ?)
+            ON CONFLICT(seq_date) DO UPDATE SET next_value = next_value + ?
+        """, (seq_date, count, count))
+        
+        cursor.execute("SELECT next_value FROM sample_id_sequences WHERE seq_date = ?", (seq_date,))
+        last_value = cursor.fetchone()['next_value'] - 1
+    
+    first_value = last_value - count + 1
+    return [format_sample_id(seq_date, n) for n in range(first_value, last_value + 1)]
+
+def reserve_sample_id_block(count, reserved_by, device=None, seq_date=None, conn=None):
+    """Reserve a block of sample IDs for an offline device and record it"""
+    with transaction(conn) as conn:
+        sample_ids = allocate_sample_ids(count, seq_date, conn)
+        first_seq = sample_ids[0][2:12]
+        conn.execute("""
+            INSERT INTO sample_id_reservations (seq_date, first_value, last_value, device, reserved_by)
+            VALUES (?, ?, ?, ?, ?)
+        """, (first_seq, int(sample_ids[0][13:]), int(sample_ids[-1][13:]), device, reserved_by))
+    
+    return sample_ids
+
 if __name__ == "__main__":
     print("🚀 Initializing CE-LIMS Database...")
     init_database()
@@ -4,7 +4,8 @@ Mobile-friendly interface for sample registration
 """
 
 import streamlit as st
-from database import get_connection, log_audit, add_chain_of_custody
+from database import get_connection, log_audit, add_chain_of_custody, run_write, allocate_sample_ids, fetch_page
+from refdata import get_projects
 from auth import get_current_user
 from components import *
 from datetime import datetime, date
@@ -21,17 +22,11 @@ def show_field_tech_dashboard():
     # Main container
     st.markdown('<div style="max-width: 800px; margin: 0 auto;">', unsafe_allow_html=True)
     
-    # Tabs for different views
-    tab1, tab2 = st.tabs([
-        "➕ Register New Sample / تسجيل عينة جديدة",
-        "📋 My Samples / عيناتي"
-    ])
-    
-    with tab1:
-        show_sample_registration_form(user)
-    
-    with tab2:
-        show_my_samples(user)
+    # Sections (only the active one is executed)
+    show_sections([
+        ("➕ Register New Sample / تسجيل عينة جديدة", lambda: show_sample_registration_form(user)),
+        ("📋 My Samples / عيناتي", lambda: show_my_samples(user))
+    ], key="field_tech_section")
     
     st.markdown('</div>', unsafe_allow_html=True)
     show_footer()
@@ -40,12 +35,8 @@ def show_sample_registration_form(user):
     """Show sample registration form"""
     st.markdown("### 📝 New Sample Registration / تسجيل عينة جديدة")
     
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     # Get projects
-    cursor.execute("SELECT id, project_code, project_name, project_name_ar FROM projects WHERE status = 'active' AND is_deleted = 0")
-    projects = cursor.fetchall()
+    projects = get_projects(active_only=True)
     
     with st.form("sample_registration_form"):
         st.markdown("#### 🏗️ Project Information / معلومات المشروع")
@@ -62,12 +53,14 @@ def show_sample_registration_form(user):
             project_id = project_options[selected_project] if selected_project else None
         
         with col2:
-            # Auto-generate sample ID
+            # Sample ID is allocated atomically on submit
             today = date.today()
-            cursor.execute("SELECT COUNT(*) as count FROM samples WHERE DATE(created_at) = ?", (today,))
-            count = cursor.fetchone()['count'] + 1
-            sample_id = f"S-{today.strftime('%Y-%m-%d')}-{count:03d}"
-            st.text_input("Sample ID / معرف العينة", value=sample_id, disabled=True, key="sample_id")
+            st.text_input(
+                "Sample ID / معرف العينة",
+                value=f"S-{today.strftime('%Y-%m-%d')}-### (assigned on submit / يحدد عند التسجيل)",
+                disabled=True,
+                key="sample_id"
+            )
         
         st.markdown("#### 🧪 Sample Details / تفاصيل العينة")
         
@@ -181,82 +174,102 @@ def show_sample_registration_form(user):
         if submitted:
             if project_id and material_type and condition and priority:
                 try:
-                    # Insert sample
-                    cursor.execute("""
-                        INSERT INTO samples (
-                            sample_id, project_id, material_type, material_type_ar,
-                            sample_location, sample_location_ar, quantity, quantity_unit,
-                            collection_date, collection_time, received_date, received_time,
-                            received_by, temperature, condition, condition_ar,
-                            priority, priority_ar, notes, status, created_by
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        sample_id, project_id, material_type_en, material_type_ar,
-                        sample_location, sample_location, quantity, quantity_unit,
-                        collection_date, collection_time, date.today(), datetime.now().time(),
-                        user['id'], temperature, condition_en, condition_ar,
-                        priority_en, priority_ar, notes, 'registered', user['id']
-                    ))
-                    
-                    sample_db_id = cursor.lastrowid
-                    
-                    # Add chain of custody
-                    add_chain_of_custody(
-                        sample_db_id, None, user['id'],
-                        sample_location, "Sample Collection",
-                        condition_en, f"Collected by {user['full_name']}"
-                    )
+                    def register_sample(write_conn):
+                        write_cursor = write_conn.cursor()
+                        
+                        sample_id = allocate_sample_ids(conn=write_conn)[0]
+                        
+                        # Insert sample
+                        write_cursor.execute("""
+                            INSERT INTO samples (
+                                sample_id, project_id, material_type, material_type_ar,
+                                sample_location, sample_location_ar, quantity, quantity_unit,
+                                collection_date, collection_time, received_date, received_time,
+                                received_by, temperature, condition, condition_ar,
+                                priority, priority_ar, notes, status, created_by
+                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """, (
+                            sample_id, project_id, material_type_en, material_type_ar,
+                            sample_location, sample_location, quantity, quantity_unit,
+                            collection_date, collection_time, date.today(), datetime.now().time(),
+                            user['id'], temperature, condition_en, condition_ar,
+                            priority_en, priority_ar, notes, 'registered', user['id']
+                        ))
+                        
+                        sample_db_id = write_cursor.lastrowid
+                        
+                        # Add chain of custody
+                        add_chain_of_custody(
+                            sample_db_id, None, user['id'],
+                            sample_location, "Sample Collection",
+                            condition_en, f"Collected by {user['full_name']}",
+                            write_conn
+                        )
+                        
+                        # Log audit
+                        log_audit(
+                            'samples', sample_db_id, 'INSERT',
+                            None, json.dumps({'sample_id': sample_id, 'status': 'registered'}),
+                            user['id'], write_conn
+                        )
+                        
+                        return sample_id
                     
-                    # Log audit
-                    log_audit(
-                        'samples', sample_db_id, 'INSERT',
-                        None, json.dumps({'sample_id': sample_id, 'status': 'registered'}),
-                        user['id']
-                    )
+                    sample_id = run_write(register_sample)
                     
-                    conn.commit()
                     st.success(f"✅ Sample {sample_id} registered successfully! / تم تسجيل العينة {sample_id} بنجاح!")
                     st.balloons()
                     
                 except Exception as e:
-                    conn.rollback()
                     st.error(f"❌ Error: {str(e)}")
             else:
                 st.warning("⚠️ Please fill all required fields / الرجاء ملء جميع الحقول المطلوبة")
+
+def load_my_samples(conn, user_id, after=None, page_size=20):
+    """Load a page of samples registered by a user (newest first)"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
     
-    conn.close()
+    try:
+        return fetch_page(conn, """
+            SELECT 
+                s.id,
+                s.sample_id,
+                s.material_type,
+                s.material_type_ar,
+                p.project_name,
+                p.project_name_ar,
+                s.collection_date,
+                s.priority,
+                s.priority_ar,
+                s.status,
+                s.created_at
+            FROM samples s
+            JOIN projects p ON s.project_id = p.id
+            WHERE s.created_by = ? AND s.is_deleted = 0
+        """, (user_id,), order_by=('created_at', 'id'), after=after,
+            page_size=page_size, descending=True)
+    finally:
+        if close_conn:
+            conn.close()
 
 def show_my_samples(user):
     """Show samples registered by current user"""
     st.markdown("### 📋 My Registered Samples / العينات المسجلة")
     
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Get samples created by current user
-    cursor.execute("""
-        SELECT 
-            s.sample_id,
-            s.material_type,
-            s.material_type_ar,
-            p.project_name,
-            p.project_name_ar,
-            s.collection_date,
-            s.priority,
-            s.priority_ar,
-            s.status,
-            s.created_at
-        FROM samples s
-        JOIN projects p ON s.project_id = p.id
-        WHERE s.created_by = ? AND s.is_deleted = 0
-        ORDER BY s.created_at DESC
-        LIMIT 20
-    """, (user['id'],))
-    
-    samples = cursor.fetchall()
+    # Get samples created by current user (a connection is only taken on a cache miss)
+    after, page_size = get_page_request("field_tech_my_samples")
+    page = cached_section_data(
+        ("field_tech_my_samples", user['id'], after, page_size),
+        ['samples', 'projects'],
+        lambda: load_my_samples(None, user['id'], after, page_size)
+    )
+    samples = page.rows
     
     if samples:
-        st.markdown(f"**Total Samples: {len(samples)} / إجمالي العينات: {len(samples)}**")
+        st.markdown(f"**Total Samples: {page_total_label(page)} / إجمالي العينات: {page_total_label(page)}**")
         
         for sample in samples:
             with st.expander(f"🧪 {sample['sample_id']} - {sample['material_type']} / {sample['material_type_ar']}"):
@@ -271,7 +284,7 @@ def show_my_samples(user):
                     st.markdown(f"**Priority / الأولوية:**  \n{sample['priority'].title()} / {sample['priority_ar']}")
                     st.markdown(f"**Status / الحالة:**  \n{sample['status'].replace('_', ' ').title()}")
                     st.markdown(f"**Registered / مسجل:**  \n{sample['created_at'][:16]}")
+        
+        show_pager("field_tech_my_samples", page)
     else:
         st.info("ℹ️ No samples registered yet / لا توجد عينات مسجلة بعد")
-    
-    conn.close()
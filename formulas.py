@@ -0,0 +1,288 @@
+"""
+CE-LIMS Formula Module
+Sandboxed, compiled evaluation of test_methods.calculation_formula
+"""
+
+import argparse
+import ast
+import math
+from functools import lru_cache, reduce
+import numpy as np
+from database import configure_database
+from refdata import get_test_methods
+
+# Longest formula text accepted
+FORMULA_MAX_LENGTH = 2000
+
+# Compiled formulas kept (keyed by formula text, so an edited formula
+# compiles afresh while unchanged methods reuse their compiled form)
+FORMULA_CACHE_SIZE = 256
+
+# unit -> (dimension, factor to the dimension's base unit). Variables are
+# declared with a unit as name[unit], e.g. "strength[MPa] = load[kN] * 1000 / area[mm2]";
+# inputs given in another unit of the same dimension are converted.
+UNITS = {
+    'mm': ('length', 1.0), 'cm': ('length', 10.0), 'm': ('length', 1000.0),
+    'mm2': ('area', 1.0), 'cm2': ('area', 100.0), 'm2': ('area', 1e6),
+    'mm3': ('volume', 1.0), 'cm3': ('volume', 1e3), 'm3': ('volume', 1e9),
+    'g': ('mass', 1.0), 'kg': ('mass', 1000.0),
+    'N': ('force', 1.0), 'kN': ('force', 1000.0),
+    'Pa': ('pressure', 1.0), 'kPa': ('pressure', 1e3), 'MPa': ('pressure', 1e6),
+    's': ('time', 1.0), 'min': ('time', 60.0), 'h': ('time', 3600.0),
+    'pct': ('ratio', 0.01),
+}
+
+CONSTANTS = {'pi': math.pi, 'e': math.e}
+
+def _fold(function):
+    """Apply a two-argument function across any number of arguments"""
+    return lambda *args: reduce(function, args)
+
+# name -> (number of arguments (None: two or more), scalar version, array version)
+FUNCTIONS = {
+    'sqrt': (1, math.sqrt, np.sqrt),
+    'exp': (1, math.exp, np.exp),
+    'log': (1, math.log, np.log),
+    'log10': (1, math.log10, np.log10),
+    'abs': (1, abs, np.abs),
+    'sin': (1, math.sin, np.sin),
+    'cos': (1, math.cos, np.cos),
+    'tan': (1, math.tan, np.tan),
+    'radians': (1, math.radians, np.radians),
+    'degrees': (1, math.degrees, np.degrees),
+    'min': (None, min, _fold(np.minimum)),
+    'max': (None, max, _fold(np.maximum)),
+    'where': (3, lambda condition, a, b: a if condition else b, np.where),
+}
+
+_BINARY_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod)
+_UNARY_OPERATORS = (ast.UAdd, ast.USub)
+_COMPARE_OPERATORS = (ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+
+_SCALAR_NAMESPACE = dict(CONSTANTS, **{name: f[1] for name, f in FUNCTIONS.items()})
+_ARRAY_NAMESPACE = dict(CONSTANTS, **{name: f[2] for name, f in FUNCTIONS.items()})
+
+def convert_unit(value, from_unit, to_unit):
+    """Convert a value (or array) between two units of the same dimension"""
+    if from_unit == to_unit:
+        return value
+    for unit in (from_unit, to_unit):
+        if unit not in UNITS:
+            raise ValueError(f"Unknown unit: {unit}")
+    if UNITS[from_unit][0] != UNITS[to_unit][0]:
+        raise ValueError(f"Cannot convert {from_unit} to {to_unit}")
+    return value * (UNITS[from_unit][1] / UNITS[to_unit][1])
+
+class CompiledFormula:
+    """A validated formula compiled to Python code objects.
+
+    A formula is one or more assignments separated by newlines or ';'.
+    Only arithmetic, single comparisons, numeric constants, CONSTANTS and
+    FUNCTIONS are allowed; anything else (attributes, indexing, strings,
+    builtins, ...) is rejected when compiling. Names read before they are
+    assigned are the inputs; every assigned name is an output, the last
+    one being the headline result.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.inputs = []
+        self.outputs = []
+        self.units = {}
+        self._steps = []
+        self._compile(text)
+
+    @property
+    def result(self):
+        """Name of the headline output (the last assignment)"""
+        return self.outputs[-1]
+
+    def _declare(self, name, unit):
+        if unit is None:
+            return
+        if unit not in UNITS:
+            raise ValueError(f"Unknown unit: {unit}")
+        if self.units.setdefault(name, unit) != unit:
+            raise ValueError(f"{name} is declared as both {self.units[name]} and {unit}")
+
+    def _variable(self, node):
+        """Name and declared unit of a name or name[unit] node"""
+        unit = None
+        if isinstance(node, ast.Subscript):
+            if not (isinstance(node.slice, ast.Name) and isinstance(node.value, ast.Name)):
+                raise ValueError("Units are written as name[unit]")
+            unit = node.slice.id
+            node = node.value
+        if not isinstance(node, ast.Name):
+            raise ValueError("Only plain names can be assigned")
+        if node.id.startswith('_') or node.id in _SCALAR_NAMESPACE:
+            raise ValueError(f"Reserved name: {node.id}")
+        return node.id, unit
+
+    def _check(self, node):
+        """Validate an expression and return it with units stripped and numbers as floats"""
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise ValueError(f"Not a number: {node.value!r}")
+            return ast.copy_location(ast.Constant(float(node.value)), node)
+
+        if isinstance(node, ast.Name) and node.id in CONSTANTS:
+            return node
+
+        if isinstance(node, (ast.Name, ast.Subscript)):
+            name, unit = self._variable(node)
+            self._declare(name, unit)
+            if name not in self.outputs and name not in self.inputs:
+                self.inputs.append(name)
+            return ast.copy_location(ast.Name(name, ast.Load()), node)
+
+        if isinstance(node, ast.BinOp) and isinstance(node.op, _BINARY_OPERATORS):
+            node.left, node.right = self._check(node.left), self._check(node.right)
+            return node
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, _UNARY_OPERATORS):
+            node.operand = self._check(node.operand)
+            return node
+
+        if isinstance(node, ast.Compare):
+            if len(node.ops) != 1 or not isinstance(node.ops[0], _COMPARE_OPERATORS):
+                raise ValueError("Only single comparisons (a < b) are allowed")
+            node.left, node.comparators = self._check(node.left), [self._check(node.comparators[0])]
+            return node
+
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+                raise ValueError(f"Unknown function: {ast.unparse(node.func)}")
+            arity = FUNCTIONS[node.func.id][0]
+            if node.keywords or (arity is None and len(node.args) < 2) or (arity and len(node.args) != arity):
+                raise ValueError(f"Wrong arguments for {node.func.id}()")
+            node.args = [self._check(arg) for arg in node.args]
+            return node
+
+        raise ValueError(f"Not allowed in a formula: {ast.unparse(node)}")
+
+    def _compile(self, text):
+        if not text or not text.strip():
+            raise ValueError("Formula is empty")
+        if len(text) > FORMULA_MAX_LENGTH:
+            raise ValueError(f"Formula is longer than {FORMULA_MAX_LENGTH} characters")
+        try:
+            tree = ast.parse(text, mode='exec')
+        except SyntaxError as e:
+            raise ValueError(f"Formula syntax error: {e.msg}") from None
+
+        for statement in tree.body:
+            if not isinstance(statement, ast.Assign) or len(statement.targets) != 1:
+                raise ValueError("Every line of a formula must be one assignment: name = expression")
+            expression = self._check(statement.value)
+            name, unit = self._variable(statement.targets[0])
+            if name in self.inputs:
+                raise ValueError(f"{name} is used before it is assigned")
+            self._declare(name, unit)
+            if name not in self.outputs:
+                self.outputs.append(name)
+            code = compile(ast.fix_missing_locations(ast.Expression(expression)), '<formula>', 'eval')
+            self._steps.append((name, code))
+
+    def _inputs(self, values):
+        """Input values in their declared units; a value may be given as (value, unit)"""
+        prepared = {}
+        for name in self.inputs:
+            if name not in values or values[name] is None:
+                raise ValueError(f"Missing input: {name}")
+            value = values[name]
+            if isinstance(value, tuple):
+                value, unit = value
+                value = convert_unit(value, unit, self.units.get(name, unit))
+            prepared[name] = value
+        return prepared
+
+    def evaluate(self, values):
+        """Evaluate for one specimen; returns {output: value}.
+
+        Raises ValueError for a missing input or a failed calculation
+        (division by zero, log of a negative number, ...).
+        """
+        namespace = dict(_SCALAR_NAMESPACE)
+        namespace.update({name: float(value) for name, value in self._inputs(values).items()})
+        for name, code in self._steps:
+            try:
+                namespace[name] = eval(code, {'__builtins__': {}}, namespace)
+            except (ArithmeticError, ValueError) as e:
+                raise ValueError(f"Cannot calculate {name}: {e}") from None
+        return {name: namespace[name] for name in self.outputs}
+
+    def evaluate_batch(self, columns):
+        """Evaluate over columns of many specimens with NumPy.
+
+        columns maps input names to arrays (or (array, unit) tuples), e.g.
+        a DataFrame. Returns ({output: array}, error mask); a row is an
+        error where any output is NaN or infinite.
+        """
+        inputs = self._inputs(columns)
+        namespace = dict(_ARRAY_NAMESPACE)
+        namespace.update({name: np.asarray(value, dtype=float) for name, value in inputs.items()})
+        size = max((v.size for v in namespace.values() if isinstance(v, np.ndarray)), default=1)
+
+        with np.errstate(all='ignore'):
+            for name, code in self._steps:
+                namespace[name] = eval(code, {'__builtins__': {}}, namespace)
+
+        outputs = {name: np.broadcast_to(namespace[name], (size,)) for name in self.outputs}
+        error = np.zeros(size, dtype=bool)
+        for values in outputs.values():
+            error |= ~np.isfinite(values.astype(float))
+        return outputs, error
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def compile_formula(text):
+    """Compile formula text (cached); raises ValueError if it is not allowed"""
+    return CompiledFormula(text)
+
+def get_formula_stats():
+    """Get compiled formula cache statistics"""
+    info = compile_formula.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}
+
+def get_method_formula(method_id):
+    """Get the compiled formula of an active test method (None if it has none).
+
+    Methods come from the reference data cache, which reloads them when
+    test_methods is written, so an edited formula takes effect immediately.
+    """
+    for method in get_test_methods():
+        if method['id'] == method_id:
+            if not (method['calculation_formula'] or '').strip():
+                return None
+            return compile_formula(method['calculation_formula'])
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check or evaluate CE-LIMS calculation formulas")
+    parser.add_argument("formula", nargs="?", help="Formula to evaluate, e.g. 'PI = LL - PL'")
+    parser.add_argument("values", nargs="*", help="Input values as name=value")
+    parser.add_argument("--db", help="Database file (defaults to CE_LIMS_DB_PATH or ce_lims.db)")
+    parser.add_argument("--check", action="store_true", help="Compile every active test method's formula")
+    args = parser.parse_args()
+
+    if args.db:
+        configure_database(args.db)
+
+    if args.check:
+        for method in get_test_methods():
+            try:
+                formula = get_method_formula(method['id'])
+            except ValueError as e:
+                print(f"  ❌ {method['standard']} {method['test_name']}: {e}")
+                continue
+            if formula is None:
+                print(f"  ➖ {method['standard']} {method['test_name']}: no formula")
+            else:
+                print(f"  ✅ {method['standard']} {method['test_name']}: inputs {', '.join(formula.inputs)}")
+
+    if args.formula:
+        formula = compile_formula(args.formula)
+        values = dict(item.split("=", 1) for item in args.values)
+        for name, value in formula.evaluate(values).items():
+            unit = formula.units.get(name, '')
+            print(f"{name} = {value} {unit}".rstrip())
@@ -4,12 +4,68 @@ Interface for test execution and data entry (matching mockup design)
 """
 
 import streamlit as st
-from database import get_connection, log_audit
+from database import get_connection, log_audit, run_write, fetch_page
+from workflow import move_assignments, check_transition, get_sample_progress
+from formulas import get_method_formula
+from blobstore import put_blob, blob_key
+from machine import MACHINE_FIELDS, submit_export, export_inputs
+from curves import stage_curve, record_curve, publish_curve, discard_curve
+from plots import downsample, submit_pyramid
+from schemas import ParameterSchema, get_method_schema, get_standard_schema
+from calculations import CALCULATORS, RESULT_VALUE_KEYS, auto_calculate
 from auth import get_current_user
 from components import *
 from datetime import datetime
 import json
-import os
+
+def load_worklist(conn, user_id, after=None, page_size=20):
+    """Load a page of open assignments for a lab tech (most urgent first)"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
+    try:
+        return fetch_page(conn, """
+            SELECT 
+                ta.id as assignment_id,
+                s.id as sample_id,
+                s.sample_id as sample_code,
+                s.material_type,
+                s.material_type_ar,
+                p.project_name,
+                p.project_name_ar,
+                tm.id as test_method_id,
+                tm.test_name,
+                tm.test_name_ar,
+                tm.standard,
+                tm.parameters,
+                s.received_date,
+                s.priority,
+                s.priority_ar,
+                s.notes,
+                s.tests_total,
+                s.tests_completed,
+                ta.status,
+                ta.due_date,
+                CASE s.priority
+                    WHEN 'urgent' THEN 1
+                    WHEN 'high' THEN 2
+                    WHEN 'normal' THEN 3
+                    WHEN 'low' THEN 4
+                    ELSE 5
+                END as priority_rank,
+                COALESCE(ta.due_date, '9999-12-31') as due_sort
+            FROM test_assignments ta
+            JOIN samples s ON ta.sample_id = s.id
+            JOIN projects p ON s.project_id = p.id
+            JOIN test_methods tm ON ta.test_method_id = tm.id
+            WHERE ta.assigned_to = ? AND ta.is_deleted = 0 AND ta.status IN ('assigned', 'in_progress')
+        """, (user_id,), order_by=('priority_rank', 'due_sort', 'assignment_id'),
+            after=after, page_size=page_size)
+    finally:
+        if close_conn:
+            conn.close()
 
 def show_lab_tech_dashboard():
     """Display Lab Tech dashboard"""
@@ -19,46 +75,14 @@ def show_lab_tech_dashboard():
     
     user = get_current_user()
     
-    # Get assigned tests
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT 
-            ta.id as assignment_id,
-            s.id as sample_id,
-            s.sample_id as sample_code,
-            s.material_type,
-            s.material_type_ar,
-            p.project_name,
-            p.project_name_ar,
-            tm.id as test_method_id,
-            tm.test_name,
-            tm.test_name_ar,
-            tm.standard,
-            tm.parameters,
-            s.received_date,
-            s.priority,
-            s.priority_ar,
-            s.notes,
-            ta.status,
-            ta.due_date
-        FROM test_assignments ta
-        JOIN samples s ON ta.sample_id = s.id
-        JOIN projects p ON s.project_id = p.id
-        JOIN test_methods tm ON ta.test_method_id = tm.id
-        WHERE ta.assigned_to = ? AND ta.is_deleted = 0 AND ta.status IN ('assigned', 'in_progress')
-        ORDER BY 
-            CASE s.priority
-                WHEN 'urgent' THEN 1
-                WHEN 'high' THEN 2
-                WHEN 'normal' THEN 3
-                WHEN 'low' THEN 4
-            END,
-            ta.due_date ASC
-    """, (user['id'],))
-    
-    assignments = cursor.fetchall()
+    # Get assigned tests (a connection is only taken on a cache miss)
+    after, page_size = get_page_request("lab_tech_worklist")
+    page = cached_section_data(
+        ("lab_tech_worklist", user['id'], after, page_size),
+        ['test_assignments', 'samples', 'projects', 'test_methods'],
+        lambda: load_worklist(None, user['id'], after, page_size)
+    )
+    assignments = page.rows
     
     if assignments:
         # Select test to work on
@@ -73,35 +97,115 @@ def show_lab_tech_dashboard():
             key="test_selector"
         )
         
+        show_pager("lab_tech_worklist", page)
+        
         if selected_test:
             assignment_id = test_options[selected_test]
             assignment = next(a for a in assignments if a['assignment_id'] == assignment_id)
             
-            show_test_execution_interface(user, assignment, conn)
+            show_test_execution_interface(user, assignment)
     else:
         st.info("ℹ️ No tests assigned to you / لا توجد اختبارات معينة لك")
         st.markdown("Please wait for your supervisor to assign tests. / يرجى الانتظار حتى يقوم المشرف بتعيين الاختبارات.")
     
-    conn.close()
     show_footer()
 
-def show_test_execution_interface(user, assignment, conn):
-    """Show test execution interface matching the mockup design"""
+@st.fragment(run_every=1)
+def wait_for_export(job):
+    """Show a parsing job as pending; reruns the page once it has finished"""
+    if job['future'].done():
+        st.rerun()
+    st.info(f"⏳ Reading {job['file_name']}... / جاري قراءة الملف...")
+
+def show_machine_import(assignment):
+    """Upload a testing machine export and pre-fill the test form from it.
+
+    The export is stored and parsed in the machine worker pool, so large
+    curve files do not block the page. Returns the job once its export has
+    been parsed (None otherwise).
+    """
+    assignment_id = assignment['assignment_id']
+    jobs = st.session_state.setdefault('machine_exports', {})
+    
+    uploaded = st.file_uploader(
+        "📈 Machine Export / ملف جهاز الاختبار",
+        type=['csv', 'xlsx'],
+        help="Load-displacement export of the testing machine / ملف الحمل والإزاحة من جهاز الاختبار",
+        key=f"machine_file_{assignment_id}"
+    )
+    if uploaded is None:
+        jobs.pop(assignment_id, None)
+        return None
+    
+    job = jobs.get(assignment_id)
+    if job is None or job['upload'] != (uploaded.name, uploaded.size):
+        uploaded.seek(0)
+        digest, size, _ = put_blob(uploaded)
+        job = {
+            'upload': (uploaded.name, uploaded.size),
+            'file_name': uploaded.name,
+            'file_type': uploaded.type or 'text/csv',
+            'digest': digest,
+            'size': size,
+            'future': submit_export(digest, uploaded.name),
+            'parsed': None,
+        }
+        jobs[assignment_id] = job
+    
+    if not job['future'].done():
+        wait_for_export(job)
+        return None
     
-    # Calculate progress
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT COUNT(*) as total FROM test_assignments WHERE sample_id = ? AND is_deleted = 0
-    """, (assignment['sample_id'],))
-    total_tests = cursor.fetchone()['total']
+    try:
+        parsed = job['future'].result()
+    except (ValueError, OSError) as e:
+        st.warning(f"⚠️ Export cannot be read / تعذر قراءة الملف: {e}")
+        return None
     
-    cursor.execute("""
-        SELECT COUNT(*) as completed FROM test_assignments 
-        WHERE sample_id = ? AND status IN ('completed', 'approved') AND is_deleted = 0
-    """, (assignment['sample_id'],))
-    completed_tests = cursor.fetchone()['completed']
+    if job['parsed'] is None:
+        # Pre-fill the form inputs once; the tech can still correct them
+        for field, value in export_inputs(assignment['standard'], parsed).items():
+            st.session_state[f"param_{field}_{assignment_id}"] = value
+        job['parsed'] = parsed
     
-    progress = int((completed_tests / total_tests * 100)) if total_tests > 0 else 0
+    summary = f"📈 {parsed['points']} points / نقطة · Max Load / الحمل الأقصى: {parsed['max_load']} kN"
+    if parsed['deformation_at_peak'] is not None:
+        summary += f" · Deformation / التشوه: {parsed['deformation_at_peak']} mm"
+    st.success(summary)
+    
+    if 'preview' not in job:
+        try:
+            job['preview'] = downsample(parsed['curve'])
+        except ValueError:
+            # Load readings only: nothing to plot them against
+            job['preview'] = None
+    if job['preview'] is not None:
+        show_curve_chart(job['preview'])
+    return job
+
+def load_test_result(conn, assignment_id):
+    """Load the current test result of an assignment (None if there is none)"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
+    try:
+        row = conn.execute("""
+            SELECT id, test_parameters, raw_data, result_value, result_unit, observations, status
+            FROM test_results
+            WHERE assignment_id = ? AND is_deleted = 0
+        """, (assignment_id,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        if close_conn:
+            conn.close()
+
+def show_test_execution_interface(user, assignment):
+    """Show test execution interface matching the mockup design"""
+    
+    # Progress from the sample's test counters
+    completed_tests, total_tests, progress = get_sample_progress(assignment)
     
     # Two-column layout matching mockup
     col_left, col_right = st.columns([4, 8])
@@ -154,108 +258,71 @@ def show_test_execution_interface(user, assignment, conn):
         st.markdown("<h3 style='font-weight: bold; color: #1f2937; margin-top: 1rem;'>Test Parameters <span class='separator'>/</span> <span class='arabic-text'>معلومات الاختبار</span></h3>", unsafe_allow_html=True)
         
         # Check if test result already exists
-        cursor.execute("""
-            SELECT id, test_parameters, raw_data, result_value, result_unit, observations, status
-            FROM test_results
-            WHERE assignment_id = ? AND is_deleted = 0
-        """, (assignment['assignment_id'],))
+        existing_result = cached_section_data(
+            ("lab_tech_result", user['id'], assignment['assignment_id']),
+            ['test_results'],
+            lambda: load_test_result(None, assignment['assignment_id'])
+        )
         
-        existing_result = cursor.fetchone()
+        machine_job = None
+        if assignment['standard'] in MACHINE_FIELDS:
+            machine_job = show_machine_import(assignment)
         
         with st.form(f"test_execution_form_{assignment['assignment_id']}"):
-            # Parse test parameters
+            # Form generated from the method's compiled parameter schema
             try:
-                params = json.loads(assignment['parameters']) if assignment['parameters'] else {}
-            except:
-                params = {}
+                schema = get_method_schema(assignment['test_method_id'])
+            except ValueError as e:
+                st.warning(f"⚠️ Test parameters cannot be used / لا يمكن استخدام معاملات الاختبار: {e}")
+                schema = ParameterSchema([])
             
-            # Dynamic form based on test type
-            test_data = {}
+            formula = None
+            if assignment['standard'] in CALCULATORS:
+                # Make sure every input of the built-in calculator is asked for
+                schema = schema.extend(get_standard_schema(assignment['standard']))
+            else:
+                try:
+                    formula = get_method_formula(assignment['test_method_id'])
+                except ValueError as e:
+                    st.warning(f"⚠️ Calculation formula cannot be used / لا يمكن استخدام صيغة الحساب: {e}")
+                if formula:
+                    # One input per variable of the method's calculation formula
+                    st.caption(f"🧮 {formula.text}")
+                    schema = schema.with_inputs(formula.inputs, formula.units)
             
-            if assignment['standard'] == 'ASTM D5':  # Penetration Test
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    temperature = st.number_input(
-                        "Temperature / درجة الحرارة (°C):",
-                        min_value=0.0,
-                        max_value=100.0,
-                        value=25.0,
-                        step=0.1,
-                        key=f"temp_{assignment['assignment_id']}"
-                    )
-                    test_data['temperature'] = temperature
-                
-                with col2:
-                    needle_load = st.number_input(
-                        "Needle Load / حمل الإبرة (g):",
-                        min_value=0.0,
-                        max_value=200.0,
-                        value=100.0,
-                        step=1.0,
-                        key=f"load_{assignment['assignment_id']}"
-                    )
-                    test_data['needle_load'] = needle_load
-                
-                st.markdown("#### Penetration Readings / قراءات الاختراق")
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    reading1 = st.number_input("Reading 1 (0.1mm)", min_value=0.0, step=0.1, key=f"r1_{assignment['assignment_id']}")
-                with col2:
-                    reading2 = st.number_input("Reading 2 (0.1mm)", min_value=0.0, step=0.1, key=f"r2_{assignment['assignment_id']}")
-                with col3:
-                    reading3 = st.number_input("Reading 3 (0.1mm)", min_value=0.0, step=0.1, key=f"r3_{assignment['assignment_id']}")
-                
-                test_data['readings'] = [reading1, reading2, reading3]
-                
-                # Auto-calculate average
-                if reading1 > 0 or reading2 > 0 or reading3 > 0:
-                    avg_penetration = sum([reading1, reading2, reading3]) / 3
-                    st.info(f"📊 Average Penetration: {avg_penetration:.1f} (0.1mm) / متوسط الاختراق: {avg_penetration:.1f}")
-                    test_data['result_value'] = avg_penetration
-                    test_data['result_unit'] = '0.1mm'
+            test_data = show_parameter_form(schema, assignment['assignment_id'])
+            values, field_errors = schema.validate(test_data)
+            entered = test_data != schema.defaults()
             
-            elif assignment['standard'] == 'ASTM C39':  # Compressive Strength
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    diameter = st.number_input(
-                        "Diameter / القطر (mm):",
-                        min_value=0.0,
-                        value=150.0,
-                        step=1.0,
-                        key=f"dia_{assignment['assignment_id']}"
-                    )
-                    test_data['diameter'] = diameter
-                
-                with col2:
-                    height = st.number_input(
-                        "Height / الارتفاع (mm):",
-                        min_value=0.0,
-                        value=300.0,
-                        step=1.0,
-                        key=f"height_{assignment['assignment_id']}"
-                    )
-                    test_data['height'] = height
-                
-                max_load = st.number_input(
-                    "Maximum Load / الحمل الأقصى (kN):",
-                    min_value=0.0,
-                    step=0.1,
-                    key=f"load_{assignment['assignment_id']}"
-                )
-                test_data['max_load'] = max_load
-                
-                # Auto-calculate compressive strength
-                if diameter > 0 and max_load > 0:
-                    area = 3.14159 * (diameter/2)**2  # mm²
-                    strength = (max_load * 1000) / area  # MPa
-                    st.info(f"📊 Compressive Strength: {strength:.2f} MPa / مقاومة الضغط: {strength:.2f}")
-                    test_data['result_value'] = strength
-                    test_data['result_unit'] = 'MPa'
+            if assignment['standard'] in CALCULATORS:
+                if not field_errors:
+                    try:
+                        calculated = auto_calculate(assignment['standard'], values)
+                    except (ValueError, ZeroDivisionError) as e:
+                        calculated = {'error': str(e)}
+                    result_value = calculated.get(RESULT_VALUE_KEYS[assignment['standard']])
+                    if 'error' not in calculated and result_value:
+                        test_data['calculated'] = calculated
+                        test_data['result_value'] = result_value
+                        test_data['result_unit'] = calculated.get('unit', '')
+                        st.info(f"📊 {RESULT_VALUE_KEYS[assignment['standard']].replace('_', ' ').title()}: "
+                                f"{result_value} {test_data['result_unit']}")
+                    elif 'error' in calculated and entered:
+                        st.warning(f"⚠️ Cannot calculate result / تعذر حساب النتيجة: {calculated['error']}")
             
-            else:  # Generic test
+            elif formula:
+                if not field_errors and any(values[name] for name in formula.inputs):
+                    try:
+                        outputs = formula.evaluate(values)
+                    except ValueError as e:
+                        st.warning(f"⚠️ {e}")
+                    else:
+                        test_data['calculated'] = outputs
+                        test_data['result_value'] = outputs[formula.result]
+                        test_data['result_unit'] = formula.units.get(formula.result, '')
+                        st.info(f"📊 {formula.result}: {outputs[formula.result]:.3f} {test_data['result_unit']}")
+            
+            else:  # No calculation available: enter the result directly
                 result_value = st.number_input(
                     "Result Value / قيمة النتيجة:",
                     min_value=0.0,
@@ -334,112 +401,140 @@ def show_test_execution_interface(user, assignment, conn):
                 )
             
             if start_btn:
-                # Update assignment status to in_progress
-                cursor.execute("""
-                    UPDATE test_assignments
-                    SET status = 'in_progress'
-                    WHERE id = ?
-                """, (assignment['assignment_id'],))
+                def start_test(write_conn):
+                    write_cursor = write_conn.cursor()
+                    
+                    if existing_result:
+                        check_transition('result', existing_result['status'], 'draft')
+                    
+                    # Update assignment (and sample) status to in_progress
+                    move_assignments(write_conn, [assignment['assignment_id']], 'in_progress')
+                    
+                    # Create or update test result
+                    write_cursor.execute("""
+                        INSERT OR REPLACE INTO test_results (
+                            assignment_id, tested_by, test_started_at, status
+                        ) VALUES (?, ?, CURRENT_TIMESTAMP, 'draft')
+                    """, (assignment['assignment_id'], user['id']))
                 
-                # Create or update test result
-                cursor.execute("""
-                    INSERT OR REPLACE INTO test_results (
-                        assignment_id, tested_by, test_started_at, status
-                    ) VALUES (?, ?, CURRENT_TIMESTAMP, 'draft')
-                """, (assignment['assignment_id'], user['id']))
+                run_write(start_test)
                 
-                conn.commit()
                 st.success("✅ Test started! / بدأ الاختبار!")
                 st.rerun()
             
             if finish_btn:
-                if 'result_value' in test_data and test_data['result_value'] > 0:
+                if field_errors:
+                    for message in field_errors.values():
+                        st.error(f"❌ {message}")
+                elif 'result_value' in test_data and test_data['result_value'] > 0:
+                    test_data.update(values)
                     try:
-                        # Save uploaded files
-                        file_ids = []
-                        if uploaded_files:
-                            upload_dir = f"/home/ubuntu/ce-lims/uploads/{assignment['sample_code']}"
-                            os.makedirs(upload_dir, exist_ok=True)
-                            
-                            for uploaded_file in uploaded_files:
-                                file_path = os.path.join(upload_dir, uploaded_file.name)
-                                with open(file_path, "wb") as f:
-                                    f.write(uploaded_file.getbuffer())
-                                
-                                # Save to database
-                                if existing_result:
-                                    cursor.execute("""
-                                        INSERT INTO raw_files (test_result_id, file_name, file_path, file_type, file_size, uploaded_by)
-                                        VALUES (?, ?, ?, ?, ?, ?)
-                                    """, (
-                                        existing_result['id'], uploaded_file.name, file_path,
-                                        uploaded_file.type, uploaded_file.size, user['id']
-                                    ))
-                                    file_ids.append(cursor.lastrowid)
+                        # Stream uploaded files into the blob store before taking the write lock
+                        saved_files = []
+                        for uploaded_file in uploaded_files or []:
+                            uploaded_file.seek(0)
+                            digest, size, _ = put_blob(uploaded_file)
+                            saved_files.append((uploaded_file.name, uploaded_file.type, digest, size))
                         
-                        # Insert or update test result
-                        if existing_result:
-                            cursor.execute("""
-                                UPDATE test_results
-                                SET test_completed_at = CURRENT_TIMESTAMP,
-                                    test_parameters = ?,
-                                    raw_data = ?,
-                                    result_value = ?,
-                                    result_unit = ?,
-                                    observations = ?,
-                                    status = 'submitted',
-                                    updated_at = CURRENT_TIMESTAMP,
-                                    updated_by = ?
-                                WHERE id = ?
-                            """, (
-                                json.dumps(test_data), json.dumps(test_data),
-                                test_data.get('result_value', 0), test_data.get('result_unit', ''),
-                                observations, user['id'], existing_result['id']
-                            ))
-                            result_id = existing_result['id']
-                        else:
-                            cursor.execute("""
-                                INSERT INTO test_results (
-                                    assignment_id, tested_by, test_started_at, test_completed_at,
-                                    test_parameters, raw_data, result_value, result_unit,
-                                    observations, status, created_by
-                                ) VALUES (?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, 'submitted', ?)
-                            """, (
-                                assignment['assignment_id'], user['id'],
-                                json.dumps(test_data), json.dumps(test_data),
-                                test_data.get('result_value', 0), test_data.get('result_unit', ''),
-                                observations, user['id']
-                            ))
-                            result_id = cursor.lastrowid
+                        # The machine export is already stored; keep its summary with the result
+                        if machine_job:
+                            parsed = machine_job['parsed']
+                            test_data['machine_export'] = {
+                                'file_name': machine_job['file_name'],
+                                'content_hash': machine_job['digest'],
+                                'points': parsed['points'],
+                                'max_load': parsed['max_load'],
+                                'deformation_at_peak': parsed['deformation_at_peak'],
+                                'columns': parsed['columns'],
+                            }
+                            saved_files.append((machine_job['file_name'], machine_job['file_type'],
+                                                machine_job['digest'], machine_job['size']))
                         
-                        # Update assignment status
-                        cursor.execute("""
-                            UPDATE test_assignments
-                            SET status = 'completed'
-                            WHERE id = ?
-                        """, (assignment['assignment_id'],))
+                        # Write the curve file before taking the write lock; it is
+                        # moved into place only once the result is committed
+                        staged_curve = stage_curve(machine_job['parsed']['curve']) if machine_job else None
                         
-                        # Update sample status
-                        cursor.execute("""
-                            UPDATE samples
-                            SET status = 'completed'
-                            WHERE id = ?
-                        """, (assignment['sample_id'],))
+                        def submit_result(write_conn):
+                            write_cursor = write_conn.cursor()
+                            
+                            if existing_result:
+                                check_transition('result', existing_result['status'], 'submitted')
+                            
+                            # Insert or update test result
+                            if existing_result:
+                                write_cursor.execute("""
+                                    UPDATE test_results
+                                    SET test_completed_at = CURRENT_TIMESTAMP,
+                                        test_parameters = ?,
+                                        raw_data = ?,
+                                        result_value = ?,
+                                        result_unit = ?,
+                                        observations = ?,
+                                        status = 'submitted',
+                                        updated_at = CURRENT_TIMESTAMP,
+                                        updated_by = ?
+                                    WHERE id = ?
+                                """, (
+                                    json.dumps(test_data), json.dumps(test_data),
+                                    test_data.get('result_value', 0), test_data.get('result_unit', ''),
+                                    observations, user['id'], existing_result['id']
+                                ))
+                                result_id = existing_result['id']
+                            else:
+                                write_cursor.execute("""
+                                    INSERT INTO test_results (
+                                        assignment_id, tested_by, test_started_at, test_completed_at,
+                                        test_parameters, raw_data, result_value, result_unit,
+                                        observations, status, created_by
+                                    ) VALUES (?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, 'submitted', ?)
+                                """, (
+                                    assignment['assignment_id'], user['id'],
+                                    json.dumps(test_data), json.dumps(test_data),
+                                    test_data.get('result_value', 0), test_data.get('result_unit', ''),
+                                    observations, user['id']
+                                ))
+                                result_id = write_cursor.lastrowid
+                            
+                            # Attach the uploaded files to the result
+                            write_cursor.executemany("""
+                                INSERT INTO raw_files (test_result_id, file_name, file_path, file_type, file_size,
+                                                       content_hash, uploaded_by)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)
+                            """, [
+                                (result_id, file_name, blob_key(digest), file_type, size, digest, user['id'])
+                                for file_name, file_type, digest, size in saved_files
+                            ])
+                            
+                            # List the export's full curve in the curve store
+                            if staged_curve:
+                                record_curve(write_conn, result_id, staged_curve)
+                            
+                            # Update assignment status and roll up to the sample
+                            move_assignments(write_conn, [assignment['assignment_id']], 'completed')
+                            
+                            # Log audit
+                            log_audit(
+                                'test_results', result_id, 'INSERT',
+                                None, json.dumps({'assignment_id': assignment['assignment_id'], 'status': 'submitted'}),
+                                user['id'], write_conn
+                            )
+                            return result_id
                         
-                        # Log audit
-                        log_audit(
-                            'test_results', result_id, 'INSERT',
-                            None, json.dumps({'assignment_id': assignment['assignment_id'], 'status': 'submitted'}),
-                            user['id']
-                        )
+                        try:
+                            result_id = run_write(submit_result)
+                        except BaseException:
+                            discard_curve(staged_curve)
+                            raise
+                        if staged_curve:
+                            publish_curve(result_id, staged_curve)
+                            # Plots use the full curve until its pyramid is built
+                            submit_pyramid(result_id)
                         
-                        conn.commit()
                         st.success("✅ Test completed successfully! / تم إكمال الاختبار بنجاح!")
                         st.balloons()
                         st.rerun()
                         
                     except Exception as e:
-                        conn.rollback()
                         st.error(f"❌ Error: {str(e)}")
                 else:
                     st.warning("⚠️ Please enter test results / الرجاء إدخال نتائج الاختبار")
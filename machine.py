@@ -0,0 +1,260 @@
+"""
+CE-LIMS Machine Export Module
+Streaming parser for load-displacement exports of testing machines
+"""
+
+import argparse
+import csv
+import io
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from blobstore import BLOB_ROOT, open_blob, put_blob
+
+try:
+    import openpyxl
+except ImportError:  # optional: only needed for XLSX exports
+    openpyxl = None
+
+# Rows parsed per chunk (memory stays bounded by the chunk, not the file)
+PARSE_CHUNK_ROWS = 100000
+
+# Lines searched for the column header (exports often start with a preamble)
+HEADER_SEARCH_LINES = 100
+
+# Worker processes parsing exports, so a large file never blocks a session
+PARSE_WORKERS = 2
+
+# Column name keywords, checked in order (English and Arabic)
+COLUMN_KEYWORDS = {
+    'load': ('load', 'force', 'الحمل', 'القوة'),
+    'displacement': ('displacement', 'deformation', 'penetration', 'extension', 'stroke',
+                     'position', 'disp', 'الإزاحة', 'التشوه', 'الاختراق'),
+    'time': ('time', 'الزمن', 'الوقت'),
+}
+
+# Units recognised in a header such as "Load (kN)" or "Force [N]", as factors
+# to the curve's units: kN for load, mm for displacement, s for time. Units are
+# matched lowercased, so "mN" and "MN" are left out (unknown rather than wrong)
+UNIT_FACTORS = {
+    'load': {'kn': 1.0, 'n': 0.001, 'kgf': 0.00980665, 'lbf': 0.00444822, 'kip': 4.44822},
+    'displacement': {'mm': 1.0, 'cm': 10.0, 'm': 1000.0, 'um': 0.001, 'µm': 0.001, 'in': 25.4,
+                     '0.1mm': 0.1},
+    'time': {'s': 1.0, 'sec': 1.0, 'ms': 0.001, 'min': 60.0},
+}
+
+CURVE_UNITS = {'load': 'kN', 'displacement': 'mm', 'time': 's'}
+
+# Calculator inputs each standard can take from a parsed export
+MACHINE_FIELDS = {
+    'ASTM C39': {'max_load': 'max_load'},
+    'ASTM D2166': {'max_load': 'max_load', 'deformation': 'deformation_at_peak'},
+}
+
+_UNIT_PATTERN = re.compile(r"[\(\[]\s*([^\)\]]+?)\s*[\)\]]")
+
+def _match_columns(header):
+    """Map curve columns to (index, unit factor) for a header row, or None"""
+    columns = {}
+    for index, cell in enumerate(header):
+        name = str(cell or '').strip().lower()
+        if not name:
+            continue
+        for column, keywords in COLUMN_KEYWORDS.items():
+            if column in columns or not any(k in name for k in keywords):
+                continue
+            unit = _UNIT_PATTERN.search(name)
+            unit = unit.group(1).replace(' ', '') if unit else CURVE_UNITS[column].lower()
+            if unit not in UNIT_FACTORS[column]:
+                raise ValueError(f"Unknown {column} unit in column '{cell}': {unit}")
+            columns[column] = (index, UNIT_FACTORS[column][unit], str(cell).strip())
+            break
+    return columns if 'load' in columns else None
+
+def _to_number(value, decimal):
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip().replace(decimal, '.'))
+    except ValueError:
+        return None
+
+def _numeric(values, decimal):
+    """Float array of a parsed column; cells that are not numbers become NaN"""
+    if not pd.api.types.is_numeric_dtype(values):
+        # Some cell was not a number, so pandas left the column as text
+        if decimal != '.':
+            values = values.str.replace(decimal, '.', regex=False)
+        values = pd.to_numeric(values, errors='coerce')
+    return values.to_numpy(dtype=float)
+
+class _CurveBuilder:
+    """Accumulates parsed chunks into float32 curve arrays"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.chunks = {column: [] for column in columns}
+        self.points = 0
+
+    def add(self, values):
+        """Add a chunk: {column: float array}; rows with a missing load are dropped"""
+        keep = np.isfinite(values['load'])
+        for column in self.columns:
+            self.chunks[column].append(np.asarray(values[column][keep], dtype=np.float32))
+        self.points += int(keep.sum())
+
+    def result(self):
+        if not self.points:
+            raise ValueError("No load readings found in the export")
+        curve = {column: np.concatenate(chunks) for column, chunks in self.chunks.items()}
+        if curve['load'].max() <= 0:
+            # Compression recorded as negative load
+            curve['load'] = -curve['load']
+        peak = int(np.argmax(curve['load']))
+        deformation = None
+        if 'displacement' in curve:
+            # Relative to the first reading: position and stroke columns
+            # record the crosshead position, which does not start at zero
+            finite = curve['displacement'][np.isfinite(curve['displacement'])]
+            if len(finite) and np.isfinite(curve['displacement'][peak]):
+                deformation = round(abs(float(curve['displacement'][peak]) - float(finite[0])), 3)
+        return {
+            'points': self.points,
+            'max_load': round(float(curve['load'][peak]), 3),
+            'deformation_at_peak': deformation,
+            'columns': {column: source for column, (_, _, source) in self.columns.items()},
+            'units': {column: CURVE_UNITS[column] for column in curve},
+            'curve': curve,
+        }
+
+def _find_csv_header(lines):
+    """(header line index, delimiter, decimal mark, columns) from the first lines of a CSV"""
+    for index, line in enumerate(lines[:-1]):
+        for delimiter in (',', ';', '\t'):
+            header = next(csv.reader([line], delimiter=delimiter))
+            if len(header) < 2:
+                continue
+            columns = _match_columns(header)
+            if not columns:
+                continue
+            first = next(csv.reader([lines[index + 1]], delimiter=delimiter), [])
+            decimal = ',' if delimiter != ',' and any(',' in cell for cell in first) else '.'
+            load_index = columns['load'][0]
+            if load_index < len(first) and _to_number(first[load_index], decimal) is not None:
+                return index, delimiter, decimal, columns
+    raise ValueError("No load column found in the export")
+
+def _parse_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    lines = [text.readline() for _ in range(HEADER_SEARCH_LINES)]
+    header_index, delimiter, decimal, columns = _find_csv_header([l for l in lines if l])
+
+    # Re-read from the header on with pandas, one chunk at a time
+    remainder = io.StringIO(''.join(lines[header_index + 1:]))
+    indexes = sorted(index for index, _, _ in columns.values())
+    builder = _CurveBuilder(columns)
+    for source in (remainder, text):
+        try:
+            reader = pd.read_csv(source, sep=delimiter, decimal=decimal, header=None, usecols=indexes,
+                                 chunksize=PARSE_CHUNK_ROWS, on_bad_lines='skip', skip_blank_lines=True,
+                                 engine='c')
+            for chunk in reader:
+                builder.add({
+                    column: _numeric(chunk[index], decimal) * factor
+                    for column, (index, factor, _) in columns.items()
+                })
+        except pd.errors.EmptyDataError:
+            continue
+    return builder.result()
+
+def _parse_xlsx(stream):
+    if openpyxl is None:
+        raise ValueError("XLSX exports need the openpyxl package")
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        columns = None
+        for _ in range(HEADER_SEARCH_LINES):
+            row = next(rows, None)
+            if row is None:
+                break
+            columns = _match_columns(row)
+            if columns:
+                break
+        if not columns:
+            raise ValueError("No load column found in the export")
+
+        builder = _CurveBuilder(columns)
+        chunk = {column: [] for column in columns}
+
+        def flush():
+            builder.add({column: np.array(values, dtype=float) for column, values in chunk.items()})
+            for values in chunk.values():
+                values.clear()
+
+        for row in rows:
+            for column, (index, factor, _) in columns.items():
+                value = _to_number(row[index], '.') if index < len(row) and row[index] is not None else None
+                chunk[column].append(np.nan if value is None else value * factor)
+            if len(chunk['load']) >= PARSE_CHUNK_ROWS:
+                flush()
+        flush()
+        return builder.result()
+    finally:
+        workbook.close()
+
+def parse_export(digest, file_name, root=None):
+    """Parse a machine export stored in the blob store.
+
+    The file is streamed from the store (decompressing on the fly) and
+    parsed in chunks. Returns a dict with points, max_load (kN),
+    deformation_at_peak (mm from the first displacement reading, None
+    without a displacement column), the source columns, units and curve:
+    {column: float32 array} for load, displacement and time (those
+    present). Raises ValueError if no load column is found.
+    """
+    with open_blob(digest, root) as stream:
+        if file_name.lower().endswith('.xlsx'):
+            # The XLSX container needs random access
+            return _parse_xlsx(io.BytesIO(stream.read()))
+        return _parse_csv(stream)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_parser_pool():
+    """Process pool shared by all sessions for parsing exports"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(PARSE_WORKERS)
+        return _pool
+
+def submit_export(digest, file_name, root=None):
+    """Parse a stored export in the worker pool; returns a Future of parse_export()"""
+    return get_parser_pool().submit(parse_export, digest, file_name, root or BLOB_ROOT)
+
+def export_inputs(standard, parsed):
+    """Calculator inputs of a standard taken from a parsed export"""
+    return {
+        field: parsed[key]
+        for field, key in MACHINE_FIELDS.get(standard, {}).items()
+        if parsed.get(key) is not None
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse a testing machine load-displacement export")
+    parser.add_argument("file", help="CSV or XLSX export")
+    parser.add_argument("--root", help="Blob store root (defaults to CE_LIMS_BLOB_ROOT or uploads)")
+    args = parser.parse_args()
+
+    with open(args.file, "rb") as f:
+        digest, _, _ = put_blob(f, args.root)
+    parsed = parse_export(digest, os.path.basename(args.file), args.root)
+    print(f"📈 {parsed['points']} points ({', '.join(f'{c} [{u}]' for c, u in parsed['units'].items())})")
+    print(f"  Max load / الحمل الأقصى: {parsed['max_load']} kN")
+    if parsed['deformation_at_peak'] is not None:
+        print(f"  Deformation at peak / التشوه عند الحمل الأقصى: {parsed['deformation_at_peak']} mm")
@@ -4,11 +4,21 @@ Interface for approval, archiving, and reporting
 """
 
 import streamlit as st
-from database import get_connection, log_audit
+from database import get_connection, log_audit, log_audit_many, run_write, prefetch_related, fetch_page
+from workflow import move_assignments, set_sample_status, can_transition
+from counters import get_counters
+from refdata import get_projects
+from reports import get_report_summary, get_report_preview, export_report, get_export_formats, take_report
+from analytics import results_per_month, result_distribution
+from tat import schedule_tat_refresh, get_tat_trend
+from blobstore import read_raw_file, raw_file_parts
+from curves import get_curve_info
+from plots import curve_series, overlay_series, curve_x_range, get_project_curves
 from auth import get_current_user
 from components import *
 from datetime import datetime, date
 import json
+import os
 import pandas as pd
 
 def show_manager_dashboard():
@@ -19,66 +29,280 @@ def show_manager_dashboard():
     
     user = get_current_user()
     
-    # Tabs
-    tab1, tab2, tab3, tab4 = st.tabs([
-        "✅ Pending Approval / في انتظار الاعتماد",
-        "📊 Reports / التقارير",
-        "🗄️ Archive / الأرشيف",
-        "📈 Analytics / التحليلات"
-    ])
+    # Sections (only the active one is executed)
+    show_sections([
+        ("✅ Pending Approval / في انتظار الاعتماد", lambda: show_pending_approvals(user)),
+        ("📊 Reports / التقارير", lambda: show_reports(user)),
+        ("🗄️ Archive / الأرشيف", lambda: show_archive(user)),
+        ("📈 Analytics / التحليلات", lambda: show_analytics(user))
+    ], key="manager_section")
     
-    with tab1:
-        show_pending_approvals(user)
+    show_footer()
+
+def load_pending_approvals(conn, after=None, page_size=20):
+    """Load a page of completed test results awaiting approval"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
+    try:
+        page = fetch_page(conn, """
+            SELECT 
+                tr.id as result_id,
+                s.sample_id,
+                s.material_type,
+                p.project_name,
+                tm.test_name,
+                tm.test_name_ar,
+                tm.standard,
+                tr.result_value,
+                tr.result_unit,
+                COALESCE(tr.test_completed_at, '') as test_completed_at,
+                u.full_name as tested_by_name,
+                tr.observations,
+                tr.status,
+                ta.id as assignment_id
+            FROM test_results tr
+            JOIN test_assignments ta ON tr.assignment_id = ta.id
+            JOIN samples s ON ta.sample_id = s.id
+            JOIN projects p ON s.project_id = p.id
+            JOIN test_methods tm ON ta.test_method_id = tm.id
+            JOIN users u ON tr.tested_by = u.id
+            WHERE tr.status = 'submitted' AND tr.is_deleted = 0
+        """, order_by=('test_completed_at', 'result_id'), after=after,
+            page_size=page_size, descending=True)
+        results = page.rows
+        
+        # Attachments for every pending result in one query
+        files = prefetch_related(conn, """
+            SELECT id, test_result_id, file_name, file_path, file_type, file_size, content_hash, uploaded_at
+            FROM raw_files
+            WHERE test_result_id IN ({keys}) AND is_deleted = 0
+        """, [r['result_id'] for r in results], 'test_result_id')
+        
+        curves = get_curve_info([r['result_id'] for r in results], conn)
+        
+        for result in results:
+            result['files'] = files[result['result_id']]
+            result['curve'] = curves.get(result['result_id'])
+        
+        return page
+    finally:
+        if close_conn:
+            conn.close()
+
+def review_results(conn, result_ids, decision, notes, user_id, chunk_size=500):
+    """Approve or reject many submitted test results in one transaction.
+
+    decision is 'approve' or 'reject'. Results that are missing, deleted or
+    no longer 'submitted' are skipped. Assignment and sample status changes
+    go through the workflow engine and audit rows are written with
+    executemany.
+    Returns one outcome dict per requested result id, in request order.
+    """
+    result_ids = list(dict.fromkeys(result_ids))
+    cursor = conn.cursor()
+    
+    current = prefetch_related(conn, """
+        SELECT tr.id as result_id, tr.status, tr.is_deleted,
+               ta.id as assignment_id, ta.status as assignment_status,
+               ta.sample_id, s.sample_id as sample_code
+        FROM test_results tr
+        JOIN test_assignments ta ON tr.assignment_id = ta.id
+        JOIN samples s ON ta.sample_id = s.id
+        WHERE tr.id IN ({keys})
+    """, result_ids, 'result_id', chunk_size)
+    
+    approving = decision == 'approve'
+    outcomes = {}
+    eligible = []
+    for result_id in result_ids:
+        rows = current[result_id]
+        if not rows:
+            outcomes[result_id] = {'result_id': result_id, 'sample_id': None,
+                                   'outcome': 'skipped', 'message': 'Result not found'}
+        elif rows[0]['is_deleted'] or rows[0]['status'] != 'submitted':
+            outcomes[result_id] = {'result_id': result_id, 'sample_id': rows[0]['sample_code'],
+                                   'outcome': 'skipped',
+                                   'message': f"Result is {rows[0]['status']}"}
+        elif not can_transition('assignment', rows[0]['assignment_status'],
+                                'approved' if approving else 'in_progress'):
+            outcomes[result_id] = {'result_id': result_id, 'sample_id': rows[0]['sample_code'],
+                                   'outcome': 'skipped',
+                                   'message': f"Assignment is {rows[0]['assignment_status']}"}
+        else:
+            eligible.append(rows[0])
     
-    with tab2:
-        show_reports(user)
+    approved_samples = set()
     
-    with tab3:
-        show_archive(user)
+    for start in range(0, len(eligible), chunk_size):
+        chunk = eligible[start:start + chunk_size]
+        placeholders = ", ".join("?" for _ in chunk)
+        ids = [r['result_id'] for r in chunk]
+        assignment_ids = [r['assignment_id'] for r in chunk]
+        
+        if approving:
+            cursor.execute(f"""
+                UPDATE test_results
+                SET status = 'approved',
+                    approved_by = ?,
+                    approved_at = CURRENT_TIMESTAMP,
+                    updated_at = CURRENT_TIMESTAMP,
+                    updated_by = ?
+                WHERE id IN ({placeholders}) AND status = 'submitted'
+            """, [user_id, user_id] + ids)
+            
+            # A sample is approved once all of its tests are approved
+            sample_status = move_assignments(conn, assignment_ids, 'approved')
+            approved_samples.update(
+                sample_id for sample_id, status in sample_status.items() if status == 'approved'
+            )
+        else:
+            cursor.execute(f"""
+                UPDATE test_results
+                SET status = 'rejected',
+                    rejection_reason = ?,
+                    updated_at = CURRENT_TIMESTAMP,
+                    updated_by = ?
+                WHERE id IN ({placeholders}) AND status = 'submitted'
+            """, [notes, user_id] + ids)
+            
+            # Send the assignments back to the lab tech
+            move_assignments(conn, assignment_ids, 'in_progress')
     
-    with tab4:
-        show_analytics(user)
+    if approving:
+        new_values = json.dumps({'status': 'approved', 'notes': notes})
+    else:
+        new_values = json.dumps({'status': 'rejected', 'reason': notes})
+    old_values = json.dumps({'status': 'submitted'})
+    
+    log_audit_many([
+        ('test_results', r['result_id'], 'APPROVE' if approving else 'REJECT',
+         old_values, new_values, user_id)
+        for r in eligible
+    ], conn)
+    
+    for r in eligible:
+        if approving:
+            message = "Sample fully approved" if r['sample_id'] in approved_samples else "Approved"
+        else:
+            message = "Returned to lab tech"
+        outcomes[r['result_id']] = {'result_id': r['result_id'], 'sample_id': r['sample_code'],
+                                    'outcome': 'approved' if approving else 'rejected',
+                                    'message': message}
     
-    show_footer()
+    return [outcomes[result_id] for result_id in result_ids]
+
+def show_review_outcomes(outcomes):
+    """Show the per-result outcome of the last review"""
+    done = [o for o in outcomes if o['outcome'] != 'skipped']
+    skipped = len(outcomes) - len(done)
+    
+    if done:
+        st.success(f"✅ {len(done)} result(s) processed / تمت معالجة {len(done)} نتيجة")
+    if skipped:
+        st.warning(f"⚠️ {skipped} result(s) skipped / تم تخطي {skipped} نتيجة")
+    
+    st.dataframe(
+        pd.DataFrame(outcomes).rename(columns={
+            'result_id': 'Result ID',
+            'sample_id': 'Sample ID',
+            'outcome': 'Outcome',
+            'message': 'Details'
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+
+def show_bulk_review(user, results, page_key):
+    """Show a multi-select table for approving or rejecting a page of results"""
+    st.markdown("#### 🗂️ Bulk Review / مراجعة جماعية")
+    
+    select_all = st.checkbox("Select all on this page / تحديد الكل في هذه الصفحة", key=f"bulk_select_all_{page_key}")
+    
+    table = pd.DataFrame([{
+        'Select': select_all,
+        'Result ID': r['result_id'],
+        'Sample ID': r['sample_id'],
+        'Test': f"{r['standard']} - {r['test_name']}",
+        'Result': f"{r['result_value']} {r['result_unit']}",
+        'Tested By': r['tested_by_name'],
+        'Completed At': r['test_completed_at'][:16]
+    } for r in results])
+    
+    with st.form(f"bulk_review_form_{page_key}"):
+        edited = st.data_editor(
+            table,
+            key=f"bulk_review_table_{page_key}_{select_all}",
+            hide_index=True,
+            use_container_width=True,
+            disabled=[c for c in table.columns if c != 'Select'],
+            column_config={'Select': st.column_config.CheckboxColumn("Select / تحديد")}
+        )
+        
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            decision = st.radio(
+                "Decision / القرار",
+                options=["Approve / اعتماد", "Reject / رفض"],
+                key=f"bulk_decision_{page_key}"
+            )
+        with col2:
+            bulk_notes = st.text_area(
+                "Notes / ملاحظات",
+                placeholder="Applied to every selected result...\nتطبق على جميع النتائج المحددة...",
+                key=f"bulk_notes_{page_key}"
+            )
+        
+        submit_btn = st.form_submit_button(
+            "✅ Apply to Selected / تطبيق على المحدد",
+            use_container_width=True,
+            type="primary"
+        )
+    
+    if submit_btn:
+        selected = edited.loc[edited['Select'], 'Result ID'].tolist()
+        if not selected:
+            st.warning("⚠️ Select at least one result / حدد نتيجة واحدة على الأقل")
+            return
+        
+        action = 'approve' if decision.startswith("Approve") else 'reject'
+        try:
+            outcomes = run_write(
+                lambda write_conn: review_results(write_conn, selected, action, bulk_notes, user['id'])
+            )
+        except Exception as e:
+            st.error(f"❌ Error: {str(e)}")
+            return
+        
+        st.session_state['review_outcomes'] = outcomes
+        st.rerun()
 
 def show_pending_approvals(user):
     """Show test results pending approval"""
     st.markdown("### ✅ Test Results Pending Approval / نتائج الاختبارات في انتظار الاعتماد")
     
-    conn = get_connection()
-    cursor = conn.cursor()
+    # Outcome of the decision submitted before the last rerun
+    if st.session_state.get('review_outcomes'):
+        show_review_outcomes(st.session_state.pop('review_outcomes'))
     
-    # Get completed test results awaiting approval
-    cursor.execute("""
-        SELECT 
-            tr.id as result_id,
-            s.sample_id,
-            s.material_type,
-            p.project_name,
-            tm.test_name,
-            tm.test_name_ar,
-            tm.standard,
-            tr.result_value,
-            tr.result_unit,
-            tr.test_completed_at,
-            u.full_name as tested_by_name,
-            tr.observations,
-            tr.status,
-            ta.id as assignment_id
-        FROM test_results tr
-        JOIN test_assignments ta ON tr.assignment_id = ta.id
-        JOIN samples s ON ta.sample_id = s.id
-        JOIN projects p ON s.project_id = p.id
-        JOIN test_methods tm ON ta.test_method_id = tm.id
-        JOIN users u ON tr.tested_by = u.id
-        WHERE tr.status = 'submitted' AND tr.is_deleted = 0
-        ORDER BY tr.test_completed_at DESC
-    """)
-    
-    pending_results = cursor.fetchall()
+    # Get completed test results awaiting approval (a connection is only taken on a cache miss)
+    after, page_size = get_page_request("manager_pending_approvals")
+    page = cached_section_data(
+        ("manager_pending_approvals", after, page_size),
+        ['test_results', 'test_assignments', 'samples', 'projects', 'test_methods', 'users', 'raw_files'],
+        lambda: load_pending_approvals(None, after, page_size)
+    )
+    pending_results = page.rows
     
     if pending_results:
-        st.markdown(f"**Total Pending: {len(pending_results)} / إجمالي المعلقة: {len(pending_results)}**")
+        st.markdown(f"**Total Pending: {page_total_label(page)} / إجمالي المعلقة: {page_total_label(page)}**")
+        
+        show_bulk_review(user, pending_results, "_".join(str(v) for v in (after or ('first',))))
+        
+        st.markdown("---")
+        st.markdown("#### 🔍 Review Individually / مراجعة فردية")
         
         for result in pending_results:
             with st.expander(
@@ -101,18 +325,36 @@ def show_pending_approvals(user):
                         st.markdown(f"**Observations / الملاحظات:**")
                         st.info(result['observations'])
                     
-                    # Check for uploaded files
-                    cursor.execute("""
-                        SELECT file_name, file_path, file_type, uploaded_at
-                        FROM raw_files
-                        WHERE test_result_id = ? AND is_deleted = 0
-                    """, (result['result_id'],))
-                    
-                    files = cursor.fetchall()
+                    # Uploaded files (prefetched with the results)
+                    files = result['files']
                     if files:
                         st.markdown("**Attached Files / الملفات المرفقة:**")
                         for file in files:
-                            st.markdown(f"- 📎 {file['file_name']} ({file['file_type']}) - {file['uploaded_at'][:16]}")
+                            label = f"📎 {file['file_name']} ({file['file_type']}) - {file['uploaded_at'][:16]}"
+                            parts = raw_file_parts(file)
+                            if len(parts) > 1:
+                                st.caption(f"{label} · {len(parts)} parts, join them after download / "
+                                           f"{len(parts)} أجزاء، تُدمج بعد التنزيل")
+                            # Each button reads only its byte range, and only when clicked
+                            for n, (start, end) in enumerate(parts, start=1):
+                                st.download_button(
+                                    label if len(parts) == 1 else f"⬇️ Part {n}/{len(parts)} / الجزء {n}",
+                                    lambda file=file, start=start, end=end: read_raw_file(file, start=start, end=end),
+                                    file['file_name'] if len(parts) == 1 else f"{file['file_name']}.part{n:03d}",
+                                    file['file_type'] if len(parts) == 1 else "application/octet-stream",
+                                    key=f"raw_file_{file['id']}_{n}"
+                                )
+                    
+                    # Machine curve, downsampled from its stored pyramid
+                    if result['curve']:
+                        st.markdown(f"**Test Curve / منحنى الاختبار** ({result['curve'].points} points / نقطة)")
+                        try:
+                            series = curve_series(result['result_id'], info=result['curve'])
+                        except ValueError as e:
+                            st.info(f"ℹ️ {e}")
+                        else:
+                            if series is not None:
+                                show_curve_chart(series)
                 
                 with col2:
                     st.markdown(get_status_badge(result['status']), unsafe_allow_html=True)
@@ -142,109 +384,48 @@ def show_pending_approvals(user):
                         )
                     
                     if submit_btn:
+                        action = 'approve' if decision.startswith("Approve") else 'reject'
                         try:
-                            if decision.startswith("Approve"):
-                                # Approve result
-                                cursor.execute("""
-                                    UPDATE test_results
-                                    SET status = 'approved',
-                                        approved_by = ?,
-                                        approved_at = CURRENT_TIMESTAMP,
-                                        updated_at = CURRENT_TIMESTAMP,
-                                        updated_by = ?
-                                    WHERE id = ?
-                                """, (user['id'], user['id'], result['result_id']))
-                                
-                                # Update assignment status
-                                cursor.execute("""
-                                    UPDATE test_assignments
-                                    SET status = 'approved'
-                                    WHERE id = ?
-                                """, (result['assignment_id'],))
-                                
-                                # Check if all tests for this sample are approved
-                                cursor.execute("""
-                                    SELECT COUNT(*) as total FROM test_assignments 
-                                    WHERE sample_id = (SELECT sample_id FROM test_assignments WHERE id = ?)
-                                """, (result['assignment_id'],))
-                                total = cursor.fetchone()['total']
-                                
-                                cursor.execute("""
-                                    SELECT COUNT(*) as approved FROM test_assignments 
-                                    WHERE sample_id = (SELECT sample_id FROM test_assignments WHERE id = ?) 
-                                    AND status = 'approved'
-                                """, (result['assignment_id'],))
-                                approved = cursor.fetchone()['approved']
-                                
-                                if total == approved:
-                                    # Update sample status to approved
-                                    cursor.execute("""
-                                        UPDATE samples
-                                        SET status = 'approved'
-                                        WHERE id = (SELECT sample_id FROM test_assignments WHERE id = ?)
-                                    """, (result['assignment_id'],))
-                                
-                                log_audit(
-                                    'test_results', result['result_id'], 'APPROVE',
-                                    json.dumps({'status': 'submitted'}),
-                                    json.dumps({'status': 'approved', 'notes': approval_notes}),
-                                    user['id']
+                            outcomes = run_write(
+                                lambda write_conn: review_results(
+                                    write_conn, [result['result_id']], action, approval_notes, user['id']
                                 )
-                                
-                                conn.commit()
-                                st.success("✅ Test result approved! / تم اعتماد نتيجة الاختبار!")
-                                st.rerun()
-                            else:
-                                # Reject result
-                                cursor.execute("""
-                                    UPDATE test_results
-                                    SET status = 'rejected',
-                                        rejection_reason = ?,
-                                        updated_at = CURRENT_TIMESTAMP,
-                                        updated_by = ?
-                                    WHERE id = ?
-                                """, (approval_notes, user['id'], result['result_id']))
-                                
-                                # Update assignment status back to in_progress
-                                cursor.execute("""
-                                    UPDATE test_assignments
-                                    SET status = 'in_progress'
-                                    WHERE id = ?
-                                """, (result['assignment_id'],))
-                                
-                                log_audit(
-                                    'test_results', result['result_id'], 'REJECT',
-                                    json.dumps({'status': 'submitted'}),
-                                    json.dumps({'status': 'rejected', 'reason': approval_notes}),
-                                    user['id']
-                                )
-                                
-                                conn.commit()
-                                st.warning("⚠️ Test result rejected. / تم رفض نتيجة الاختبار.")
-                                st.rerun()
-                        
+                            )
                         except Exception as e:
-                            conn.rollback()
                             st.error(f"❌ Error: {str(e)}")
+                        else:
+                            st.session_state['review_outcomes'] = outcomes
+                            st.rerun()
+        
+        show_pager("manager_pending_approvals", page)
     else:
         st.info("ℹ️ No test results pending approval / لا توجد نتائج في انتظار الاعتماد")
-    
-    conn.close()
+
+def load_report(conn, start_date, end_date, project_id=None):
+    """Load a report's summary and, when it has rows, its preview"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
+    try:
+        summary = get_report_summary(conn, start_date, end_date, project_id)
+        preview = get_report_preview(conn, start_date, end_date, project_id) if summary['total'] else []
+        return summary, preview
+    finally:
+        if close_conn:
+            conn.close()
 
 def show_reports(user):
     """Show reports generation interface"""
     st.markdown("### 📊 Generate Reports / إنشاء التقارير")
     
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     # Report filters
     col1, col2, col3 = st.columns(3)
     
     with col1:
         # Get projects
-        cursor.execute("SELECT id, project_code, project_name FROM projects WHERE is_deleted = 0")
-        projects = cursor.fetchall()
+        projects = get_projects()
         project_options = ["All / الكل"] + [f"{p['project_code']} - {p['project_name']}" for p in projects]
         selected_project = st.selectbox("Project / المشروع", options=project_options)
     
@@ -255,105 +436,137 @@ def show_reports(user):
         end_date = st.date_input("End Date / تاريخ النهاية", value=date.today())
     
     if st.button("📊 Generate Report / إنشاء التقرير", type="primary"):
-        # Build query
-        query = """
-            SELECT 
-                s.sample_id,
-                p.project_name,
-                s.material_type,
-                tm.test_name,
-                tm.standard,
-                tr.result_value,
-                tr.result_unit,
-                tr.test_completed_at,
-                tr.status,
-                u1.full_name as tested_by,
-                u2.full_name as approved_by
-            FROM test_results tr
-            JOIN test_assignments ta ON tr.assignment_id = ta.id
-            JOIN samples s ON ta.sample_id = s.id
-            JOIN projects p ON s.project_id = p.id
-            JOIN test_methods tm ON ta.test_method_id = tm.id
-            JOIN users u1 ON tr.tested_by = u1.id
-            LEFT JOIN users u2 ON tr.approved_by = u2.id
-            WHERE DATE(tr.test_completed_at) BETWEEN ? AND ?
-        """
-        
-        params = [start_date, end_date]
-        
+        project_id = None
         if selected_project != "All / الكل":
-            project_code = selected_project.split(" - ")[0]
-            query += " AND p.project_code = ?"
-            params.append(project_code)
+            project_id = projects[project_options.index(selected_project) - 1]['id']
+        st.session_state['report_request'] = (start_date, end_date, project_id)
+        st.session_state.pop('report_file', None)
+    
+    request = st.session_state.get('report_request')
+    if request:
+        # Preview only; the full report is streamed to a file
+        summary, preview = load_report(None, *request)
         
-        query += " ORDER BY tr.test_completed_at DESC"
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        
-        if results:
-            # Convert to DataFrame
-            df = pd.DataFrame([dict(r) for r in results])
-            
-            st.markdown(f"**Total Results: {len(results)} / إجمالي النتائج: {len(results)}**")
+        if summary['total']:
+            st.markdown(f"**Total Results: {summary['total']} / إجمالي النتائج: {summary['total']}**")
             
-            # Display table
             st.dataframe(
-                df,
+                pd.DataFrame(preview),
                 use_container_width=True,
                 hide_index=True
             )
+            if summary['total'] > len(preview):
+                st.caption(f"Showing the {len(preview)} most recent of {summary['total']} rows / عرض أحدث {len(preview)} من {summary['total']} صف")
             
             # Download options
             col1, col2 = st.columns(2)
             
             with col1:
-                csv = df.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    "📥 Download CSV / تحميل CSV",
-                    csv,
-                    f"report_{start_date}_{end_date}.csv",
-                    "text/csv",
-                    use_container_width=True
+                fmt = st.radio(
+                    "Format / الصيغة",
+                    options=get_export_formats(),
+                    format_func=str.upper,
+                    horizontal=True,
+                    key="report_format"
                 )
+                
+                if st.button("📦 Export Report / تصدير التقرير", use_container_width=True):
+                    try:
+                        with st.spinner("Exporting... / جاري التصدير..."):
+                            st.session_state['report_file'] = export_report(*request, fmt=fmt)
+                    except Exception as e:
+                        st.error(f"❌ Error: {str(e)}")
+                
+                report_file = st.session_state.get('report_file')
+                if report_file:
+                    path, count = report_file
+                    if not os.path.exists(path):
+                        # Already downloaded, or expired
+                        st.session_state.pop('report_file', None)
+                        st.warning("⚠️ Export no longer available, export again / الملف لم يعد متاحًا، أعد التصدير")
+                    else:
+                        # Read (and deleted) only when clicked; callable data needs Streamlit 1.52
+                        st.download_button(
+                            f"📥 Download {os.path.basename(path)} ({count} rows) / تحميل",
+                            lambda path=path: take_report(path),
+                            os.path.basename(path),
+                            "text/csv" if path.endswith(".csv") else "application/octet-stream",
+                            on_click=lambda: st.session_state.pop('report_file', None),
+                            use_container_width=True
+                        )
             
             with col2:
                 # Summary statistics
-                st.metric("Approved / معتمد", len(df[df['status'] == 'approved']))
+                st.metric("Approved / معتمد", summary['approved'])
         else:
             st.info("ℹ️ No results found for the selected criteria / لا توجد نتائج للمعايير المحددة")
-    
-    conn.close()
+
+def load_archivable_samples(conn, after=None, page_size=20):
+    """Load a page of approved samples that can be archived"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
+    try:
+        return fetch_page(conn, """
+            SELECT 
+                s.id,
+                s.sample_id,
+                p.project_name,
+                s.material_type,
+                s.status,
+                s.tests_total as total_tests,
+                s.collection_date,
+                COALESCE(s.collection_date, '') as collection_sort
+            FROM samples s
+            JOIN projects p ON s.project_id = p.id
+            WHERE s.status = 'approved' AND s.is_deleted = 0
+        """, order_by=('collection_sort', 'id'), after=after,
+            page_size=page_size, descending=True)
+    finally:
+        if close_conn:
+            conn.close()
+
+def load_archived_samples(conn, after=None, page_size=20):
+    """Load a page of archived samples (most recently archived first)"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
+    try:
+        return fetch_page(conn, """
+            SELECT 
+                s.id,
+                s.sample_id,
+                p.project_name,
+                s.material_type,
+                COALESCE(s.updated_at, '') as archived_at
+            FROM samples s
+            JOIN projects p ON s.project_id = p.id
+            WHERE s.status = 'archived' AND s.is_deleted = 0
+        """, order_by=('archived_at', 'id'), after=after,
+            page_size=page_size, descending=True)
+    finally:
+        if close_conn:
+            conn.close()
 
 def show_archive(user):
     """Show archived samples and tests"""
     st.markdown("### 🗄️ Archive Management / إدارة الأرشيف")
     
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Get approved samples that can be archived
-    cursor.execute("""
-        SELECT 
-            s.id,
-            s.sample_id,
-            p.project_name,
-            s.material_type,
-            s.status,
-            COUNT(ta.id) as total_tests,
-            s.collection_date
-        FROM samples s
-        JOIN projects p ON s.project_id = p.id
-        LEFT JOIN test_assignments ta ON s.id = ta.sample_id
-        WHERE s.status = 'approved' AND s.is_deleted = 0
-        GROUP BY s.id
-        ORDER BY s.collection_date DESC
-    """)
-    
-    approved_samples = cursor.fetchall()
+    # Get approved samples that can be archived (a connection is only taken on a cache miss)
+    after, page_size = get_page_request("manager_archivable_samples")
+    page = cached_section_data(
+        ("manager_archivable_samples", after, page_size),
+        ['samples', 'projects', 'test_assignments'],
+        lambda: load_archivable_samples(None, after, page_size)
+    )
+    approved_samples = page.rows
     
     if approved_samples:
-        st.markdown(f"**Samples Ready for Archiving: {len(approved_samples)} / العينات الجاهزة للأرشفة: {len(approved_samples)}**")
+        st.markdown(f"**Samples Ready for Archiving: {page_total_label(page)} / العينات الجاهزة للأرشفة: {page_total_label(page)}**")
         
         for sample in approved_samples:
             col1, col2, col3 = st.columns([3, 1, 1])
@@ -367,60 +580,134 @@ def show_archive(user):
             
             with col3:
                 if st.button(f"🗄️ Archive", key=f"archive_{sample['id']}"):
-                    # Archive sample (soft delete)
-                    cursor.execute("""
-                        UPDATE samples
-                        SET status = 'archived', updated_at = CURRENT_TIMESTAMP, updated_by = ?
-                        WHERE id = ?
-                    """, (user['id'], sample['id']))
+                    def archive_sample(write_conn):
+                        # Archive sample (soft delete)
+                        set_sample_status(write_conn, [sample['id']], 'archived', user['id'])
+                        
+                        log_audit(
+                            'samples', sample['id'], 'UPDATE',
+                            json.dumps({'status': 'approved'}),
+                            json.dumps({'status': 'archived'}),
+                            user['id'], write_conn
+                        )
                     
-                    log_audit(
-                        'samples', sample['id'], 'UPDATE',
-                        json.dumps({'status': 'approved'}),
-                        json.dumps({'status': 'archived'}),
-                        user['id']
-                    )
+                    run_write(archive_sample)
                     
-                    conn.commit()
                     st.success(f"✅ {sample['sample_id']} archived!")
                     st.rerun()
             
             st.markdown("---")
+        
+        show_pager("manager_archivable_samples", page)
     else:
         st.info("ℹ️ No samples ready for archiving / لا توجد عينات جاهزة للأرشفة")
     
     # Show archived samples
     st.markdown("### 📦 Archived Samples / العينات المؤرشفة")
     
-    cursor.execute("""
-        SELECT 
-            s.sample_id,
-            p.project_name,
-            s.material_type,
-            s.updated_at as archived_at
-        FROM samples s
-        JOIN projects p ON s.project_id = p.id
-        WHERE s.status = 'archived' AND s.is_deleted = 0
-        ORDER BY s.updated_at DESC
-        LIMIT 20
-    """)
-    
-    archived = cursor.fetchall()
+    after, page_size = get_page_request("manager_archived_samples")
+    archived_page = cached_section_data(
+        ("manager_archived_samples", after, page_size),
+        ['samples', 'projects'],
+        lambda: load_archived_samples(None, after, page_size)
+    )
+    archived = archived_page.rows
     
     if archived:
         for item in archived:
             st.markdown(f"- **{item['sample_id']}** - {item['project_name']} ({item['material_type']}) - Archived: {item['archived_at'][:16]}")
+        
+        show_pager("manager_archived_samples", archived_page)
     else:
         st.info("ℹ️ No archived samples / لا توجد عينات مؤرشفة")
+
+def load_analytics(conn):
+    """Load analytics counters and breakdowns"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
+    try:
+        samples = get_counters(conn, 'samples_by_status')
+        assignments = get_counters(conn, 'assignments_by_status')
+        materials = get_counters(conn, 'assignments_by_material')
+        projects = get_counters(conn, 'samples_by_project')
+        project_names = {str(p['id']): p['project_name'] for p in get_projects()}
+        
+        return {
+            'total_samples': sum(samples.values()),
+            'total_tests': sum(assignments.values()),
+            'approved_results': get_counters(conn, 'results_by_status').get('approved', 0),
+            'archived_samples': samples.get('archived', 0),
+            'material_stats': [
+                {'material_type': material, 'count': count}
+                for material, count in sorted(materials.items(), key=lambda m: m[1], reverse=True)
+            ],
+            'status_stats': [
+                {'status': status, 'count': count}
+                for status, count in sorted(assignments.items())
+            ],
+            'project_stats': [
+                {'project_name': project_names.get(project_id, project_id), 'count': count}
+                for project_id, count in sorted(projects.items(), key=lambda p: p[1], reverse=True)
+            ]
+        }
+    finally:
+        if close_conn:
+            conn.close()
+
+def show_project_curves(project_id):
+    """Overlay the stored test curves of one project's specimens"""
+    st.markdown("#### 📈 Test Curves / منحنيات الاختبار")
+    
+    if project_id is None:
+        st.info("ℹ️ Select a project to compare its test curves / اختر مشروعًا لمقارنة منحنيات اختباراته")
+        return
+    
+    curves = get_project_curves(project_id)
+    if not curves:
+        st.info("ℹ️ No stored test curves in this project / لا توجد منحنيات اختبار في هذا المشروع")
+        return
     
-    conn.close()
+    standards = list(dict.fromkeys(f"{c['standard']} - {c['test_name']}" for c in curves))
+    col1, col2 = st.columns(2)
+    with col1:
+        selected = st.selectbox("Test Method / طريقة الاختبار", options=standards,
+                                key=f"curves_method_{project_id}")
+    selected = [c for c in curves if f"{c['standard']} - {c['test_name']}" == selected]
+    axes = [x for x in ('displacement', 'time') if any(x in c['columns'] for c in selected)]
+    if not axes:
+        st.info("ℹ️ These curves have no displacement or time readings / لا توجد قراءات إزاحة أو زمن")
+        return
+    with col2:
+        x = st.selectbox("X Axis / المحور الأفقي", options=axes,
+                         format_func=lambda column: CURVE_AXIS_LABELS[column],
+                         key=f"curves_axis_{project_id}")
+    
+    specimens = {f"{c['sample_code']} #{c['result_id']}": c['result_id'] for c in selected}
+    conn = get_connection()
+    try:
+        bounds = curve_x_range(specimens.values(), x, conn)
+        x_range = show_curve_zoom(bounds, f"curves_zoom_{project_id}_{x}") if bounds else None
+        series = overlay_series(specimens, x, x_range=x_range, conn=conn)
+    finally:
+        conn.close()
+    if series.empty:
+        st.info("ℹ️ No curve points in this range / لا توجد نقاط في هذا النطاق")
+        return
+    st.caption(f"{len(specimens)} specimen(s) / عينة")
+    show_curve_chart(series, color='specimen')
 
 def show_analytics(user):
     """Show analytics and statistics"""
     st.markdown("### 📈 Analytics & Statistics / التحليلات والإحصائيات")
     
-    conn = get_connection()
-    cursor = conn.cursor()
+    stats = cached_section_data(
+        "manager_analytics",
+        ['samples', 'test_assignments', 'test_results', 'projects'],
+        lambda: load_analytics(None)
+    )
     
     # Overall statistics
     st.markdown("#### 📊 Overall Statistics / الإحصائيات العامة")
@@ -428,61 +715,149 @@ def show_analytics(user):
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        cursor.execute("SELECT COUNT(*) as count FROM samples WHERE is_deleted = 0")
-        total_samples = cursor.fetchone()['count']
-        st.metric("Total Samples / إجمالي العينات", total_samples)
+        st.metric("Total Samples / إجمالي العينات", stats['total_samples'])
     
     with col2:
-        cursor.execute("SELECT COUNT(*) as count FROM test_assignments WHERE is_deleted = 0")
-        total_tests = cursor.fetchone()['count']
-        st.metric("Total Tests / إجمالي الاختبارات", total_tests)
+        st.metric("Total Tests / إجمالي الاختبارات", stats['total_tests'])
     
     with col3:
-        cursor.execute("SELECT COUNT(*) as count FROM test_results WHERE status = 'approved'")
-        approved_results = cursor.fetchone()['count']
-        st.metric("Approved Results / النتائج المعتمدة", approved_results)
+        st.metric("Approved Results / النتائج المعتمدة", stats['approved_results'])
     
     with col4:
-        cursor.execute("SELECT COUNT(*) as count FROM samples WHERE status = 'archived'")
-        archived_samples = cursor.fetchone()['count']
-        st.metric("Archived / المؤرشف", archived_samples)
+        st.metric("Archived / المؤرشف", stats['archived_samples'])
     
     st.markdown("---")
     
     # Tests by material type
     st.markdown("#### 🧪 Tests by Material Type / الاختبارات حسب نوع المادة")
     
-    cursor.execute("""
-        SELECT s.material_type, COUNT(ta.id) as count
-        FROM test_assignments ta
-        JOIN samples s ON ta.sample_id = s.id
-        WHERE ta.is_deleted = 0
-        GROUP BY s.material_type
-        ORDER BY count DESC
-    """)
-    
-    material_stats = cursor.fetchall()
+    material_stats = stats['material_stats']
     
     if material_stats:
-        df_materials = pd.DataFrame([dict(r) for r in material_stats])
+        df_materials = pd.DataFrame(material_stats)
         st.bar_chart(df_materials.set_index('material_type'))
     
     st.markdown("---")
     
+    # Samples by project
+    st.markdown("#### 🏗️ Samples by Project / العينات حسب المشروع")
+    
+    project_stats = stats['project_stats']
+    
+    if project_stats:
+        df_projects = pd.DataFrame(project_stats)
+        st.bar_chart(df_projects.set_index('project_name'))
+    
+    st.markdown("---")
+    
     # Tests by status
     st.markdown("#### 📋 Tests by Status / الاختبارات حسب الحالة")
     
-    cursor.execute("""
-        SELECT status, COUNT(*) as count
-        FROM test_assignments
-        WHERE is_deleted = 0
-        GROUP BY status
-    """)
-    
-    status_stats = cursor.fetchall()
+    status_stats = stats['status_stats']
     
     if status_stats:
         for stat in status_stats:
             st.markdown(f"- **{stat['status'].replace('_', ' ').title()}**: {stat['count']}")
     
-    conn.close()
+    st.markdown("---")
+    
+    # Trends from the columnar analytics store
+    st.markdown("#### 📅 Results per Month / النتائج الشهرية")
+    
+    projects = get_projects()
+    project_options = ["All / الكل"] + [f"{p['project_code']} - {p['project_name']}" for p in projects]
+    selected_project = st.selectbox("Project / المشروع", options=project_options, key="analytics_project")
+    project_id = None
+    if selected_project != "All / الكل":
+        project_id = projects[project_options.index(selected_project) - 1]['id']
+    
+    trends = cached_section_data(
+        ("manager_analytics_trends", project_id),
+        ['test_results', 'test_assignments', 'samples', 'projects', 'test_methods', 'users'],
+        lambda: {
+            'monthly': results_per_month(project_id),
+            'distribution': result_distribution()
+        }
+    )
+    
+    monthly = trends['monthly']
+    if not monthly.empty:
+        st.line_chart(monthly.pivot_table(index='month', columns='test_name', values='results', aggfunc='sum'))
+    else:
+        st.info("ℹ️ No completed tests yet / لا توجد اختبارات مكتملة بعد")
+    
+    st.markdown("#### 📐 Approved Result Distribution / توزيع النتائج المعتمدة")
+    
+    distribution = trends['distribution']
+    if not distribution.empty:
+        st.dataframe(
+            distribution.round(2).rename(columns={
+                'standard': 'Standard',
+                'test_name': 'Test',
+                'count': 'Results',
+                'mean': 'Mean'
+            }),
+            use_container_width=True,
+            hide_index=True
+        )
+    
+    show_project_curves(project_id)
+    
+    st.markdown("---")
+    
+    # Turnaround time from the incremental rollups
+    st.markdown("#### ⏱️ Turnaround Time / زمن الإنجاز")
+    
+    stage_labels = {
+        'collection_to_received': "Collection → Received / الجمع ← الاستلام",
+        'received_to_assigned': "Received → Assigned / الاستلام ← التعيين",
+        'assigned_to_completed': "Assigned → Completed / التعيين ← الإكمال",
+        'completed_to_approved': "Completed → Approved / الإكمال ← الاعتماد",
+        'received_to_approved': "Received → Approved / الاستلام ← الاعتماد",
+        'collection_to_approved': "Collection → Approved / الجمع ← الاعتماد",
+    }
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        stage = st.selectbox(
+            "Stage / المرحلة",
+            options=list(stage_labels),
+            index=4,
+            format_func=lambda s: stage_labels[s],
+            key="tat_stage"
+        )
+    
+    with col2:
+        grain = st.radio(
+            "Period / الفترة",
+            options=['month', 'day'],
+            format_func=lambda g: "Monthly / شهري" if g == 'month' else "Daily / يومي",
+            horizontal=True,
+            key="tat_grain"
+        )
+    
+    # The page only reads the rollups; a stale rollup is brought up to date
+    # by the writer thread and shows up on a later render
+    conn = get_connection()
+    try:
+        schedule_tat_refresh(conn)
+        trend = get_tat_trend(conn, stage, grain, project_id=project_id)
+    finally:
+        conn.close()
+    
+    if trend:
+        df_tat = pd.DataFrame(trend).set_index('period')
+        st.line_chart(df_tat[['p50_hours', 'p90_hours', 'p99_hours']])
+        st.dataframe(
+            df_tat[['count', 'mean_hours', 'p50_hours', 'p90_hours', 'p99_hours']].round(1).rename(columns={
+                'count': 'Results',
+                'mean_hours': 'Mean (h)',
+                'p50_hours': 'P50 (h)',
+                'p90_hours': 'P90 (h)',
+                'p99_hours': 'P99 (h)'
+            }),
+            use_container_width=True
+        )
+    else:
+        st.info("ℹ️ No approved results yet / لا توجد نتائج معتمدة بعد")
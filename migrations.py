@@ -0,0 +1,381 @@
+"""
+CE-LIMS Schema Migrations
+Versioned, ordered schema changes applied on top of init_database()
+"""
+
+import argparse
+import json
+import time
+from database import get_connection, transaction, configure_database
+from search import search_index_schema, search_index_rebuild_sql
+from schemas import STANDARD_SCHEMAS
+
+# Tables whose writes bump table_versions (used to invalidate read caches)
+VERSIONED_TABLES = [
+    'users', 'projects', 'samples', 'test_methods', 'test_assignments',
+    'test_results', 'equipment', 'raw_files', 'chain_of_custody',
+]
+
+def _bump_counter(metric, dim1, dim2, delta, when):
+    """SQL that adds delta to one dashboard_counters cell when the condition holds"""
+    return f"""INSERT INTO dashboard_counters (metric, dim1, dim2, count)
+                SELECT '{metric}', COALESCE({dim1}, ''), COALESCE({dim2}, ''), {delta} WHERE {when}
+                ON CONFLICT(metric, dim1, dim2) DO UPDATE SET count = count + excluded.count;"""
+
+# Parameters the built-in test methods were seeded with before typed schemas
+SEED_PARAMETERS = {
+    'ASTM D5': '{"temperature": 25, "load": 100, "time": 5}',
+    'ASTM C39': '{"diameter": 150, "height": 300}',
+    'ASTM D1557': '{"layers": 5, "blows": 25}',
+    'ASTM D2166': '{"strain_rate": 1}',
+    'ASTM D4318': '{}',
+}
+
+def _typed_parameters(standard):
+    """SQL giving a built-in method its typed schema if it still has its seed parameters"""
+    schema = json.dumps(STANDARD_SCHEMAS[standard], ensure_ascii=False).replace("'", "''")
+    return f"""UPDATE test_methods SET parameters = '{schema}'
+               WHERE standard = '{standard}' AND parameters = '{SEED_PARAMETERS[standard]}'"""
+
+def _counter_triggers(table, counters, watched):
+    """AFTER INSERT/UPDATE/DELETE triggers keeping dashboard counters for a table.
+
+    counters is a list of (metric, dim1, dim2) expressions written against
+    a row alias ROW; only rows with is_deleted = 0 are counted.
+    """
+    def bumps(row, delta):
+        return "\n                ".join(
+            _bump_counter(metric, dim1.replace('ROW', row), dim2.replace('ROW', row),
+                          delta, f"{row}.is_deleted = 0")
+            for metric, dim1, dim2 in counters
+        )
+
+    changed = " OR ".join(f"OLD.{col} IS NOT NEW.{col}" for col in watched)
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_counters_insert
+            AFTER INSERT ON {table}
+            BEGIN
+                {bumps('NEW', 1)}
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_counters_update
+            AFTER UPDATE ON {table}
+            WHEN {changed}
+            BEGIN
+                {bumps('OLD', -1)}
+                {bumps('NEW', 1)}
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_counters_delete
+            AFTER DELETE ON {table}
+            BEGIN
+                {bumps('OLD', -1)}
+            END""",
+    ]
+
+# Ordered list of (version, description, statements). Versions are applied
+# in ascending order and recorded in schema_version; never edit a migration
+# that has shipped, append a new one instead.
+MIGRATIONS = [
+    (1, "Indexes for worklist, approval queue and audit lookups", [
+        # Lab tech worklist: assigned_to = ? AND is_deleted = 0 AND status IN (...)
+        """CREATE INDEX IF NOT EXISTS idx_test_assignments_worklist
+           ON test_assignments(assigned_to, status, due_date)
+           WHERE is_deleted = 0""",
+        # Progress bar / approval rollup counts per sample
+        """CREATE INDEX IF NOT EXISTS idx_test_assignments_sample
+           ON test_assignments(sample_id, status)""",
+        # Supervisor assigned tests and overview counters
+        """CREATE INDEX IF NOT EXISTS idx_test_assignments_assigned_by
+           ON test_assignments(assigned_by, status, assigned_date)""",
+        # Existing result lookup and joins from assignments
+        """CREATE INDEX IF NOT EXISTS idx_test_results_assignment
+           ON test_results(assignment_id)""",
+        # Manager approval queue: status = 'submitted' AND is_deleted = 0
+        """CREATE INDEX IF NOT EXISTS idx_test_results_queue
+           ON test_results(status, test_completed_at)
+           WHERE is_deleted = 0""",
+        # Report date ranges
+        """CREATE INDEX IF NOT EXISTS idx_test_results_completed
+           ON test_results(test_completed_at)""",
+        """CREATE INDEX IF NOT EXISTS idx_raw_files_result
+           ON raw_files(test_result_id)
+           WHERE is_deleted = 0""",
+        # Pending samples, archive view and status counters
+        """CREATE INDEX IF NOT EXISTS idx_samples_status
+           ON samples(status, collection_date)""",
+        # Field tech "my samples"
+        """CREATE INDEX IF NOT EXISTS idx_samples_created_by
+           ON samples(created_by, created_at)
+           WHERE is_deleted = 0""",
+        """CREATE INDEX IF NOT EXISTS idx_audit_log_record
+           ON audit_log(table_name, record_id)""",
+        """CREATE INDEX IF NOT EXISTS idx_chain_of_custody_sample
+           ON chain_of_custody(sample_id)""",
+    ]),
+    (2, "Per-day sample ID sequences and reserved blocks", [
+        """CREATE TABLE IF NOT EXISTS sample_id_sequences (
+            seq_date TEXT PRIMARY KEY,
+            next_value INTEGER NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS sample_id_reservations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            seq_date TEXT NOT NULL,
+            first_value INTEGER NOT NULL,
+            last_value INTEGER NOT NULL,
+            device TEXT,
+            reserved_by INTEGER NOT NULL,
+            reserved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (reserved_by) REFERENCES users(id)
+        )""",
+        # Continue numbering after the highest S-YYYY-MM-DD-NNN already issued
+        """INSERT OR IGNORE INTO sample_id_sequences (seq_date, next_value)
+           SELECT substr(sample_id, 3, 10), MAX(CAST(substr(sample_id, 14) AS INTEGER)) + 1
+           FROM samples
+           WHERE sample_id GLOB 'S-[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]-[0-9]*'
+           GROUP BY substr(sample_id, 3, 10)""",
+    ]),
+    (3, "Per-table write version counters", [
+        """CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )""",
+    ] + [
+        f"INSERT OR IGNORE INTO table_versions (table_name, version) VALUES ('{table}', 0)"
+        for table in VERSIONED_TABLES
+    ] + [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+            END"""
+        for table in VERSIONED_TABLES
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ]),
+    (4, "Per-sample test counters maintained by the workflow engine", [
+        "ALTER TABLE samples ADD COLUMN tests_total INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE samples ADD COLUMN tests_completed INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE samples ADD COLUMN tests_approved INTEGER NOT NULL DEFAULT 0",
+        """UPDATE samples SET
+            tests_total = (
+                SELECT COUNT(*) FROM test_assignments ta
+                WHERE ta.sample_id = samples.id AND ta.is_deleted = 0
+            ),
+            tests_completed = (
+                SELECT COUNT(*) FROM test_assignments ta
+                WHERE ta.sample_id = samples.id AND ta.is_deleted = 0
+                AND ta.status IN ('completed', 'approved')
+            ),
+            tests_approved = (
+                SELECT COUNT(*) FROM test_assignments ta
+                WHERE ta.sample_id = samples.id AND ta.is_deleted = 0
+                AND ta.status = 'approved'
+            )""",
+    ]),
+    (5, "Dashboard counters maintained by triggers", [
+        """CREATE TABLE IF NOT EXISTS dashboard_counters (
+            metric TEXT NOT NULL,
+            dim1 TEXT NOT NULL DEFAULT '',
+            dim2 TEXT NOT NULL DEFAULT '',
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (metric, dim1, dim2)
+        ) WITHOUT ROWID""",
+    ] + _counter_triggers('samples', [
+        ('samples_by_status', 'ROW.status', "''"),
+        ('samples_by_project', 'ROW.project_id', 'ROW.status'),
+    ], ['status', 'project_id', 'is_deleted']) + _counter_triggers('test_assignments', [
+        ('assignments_by_status', 'ROW.status', "''"),
+        ('assignments_by_supervisor', 'ROW.assigned_by', 'ROW.status'),
+        ('assignments_by_material',
+         '(SELECT material_type FROM samples WHERE id = ROW.sample_id)', "''"),
+    ], ['status', 'assigned_by', 'sample_id', 'is_deleted']) + _counter_triggers('test_results', [
+        ('results_by_status', 'ROW.status', "''"),
+    ], ['status', 'is_deleted']) + [
+        # Moving a sample to another material type moves its assignments too
+        f"""CREATE TRIGGER IF NOT EXISTS trg_samples_counters_material
+            AFTER UPDATE OF material_type ON samples
+            WHEN OLD.material_type IS NOT NEW.material_type
+            BEGIN
+                {_bump_counter('assignments_by_material', 'OLD.material_type', "''",
+                               "-(SELECT COUNT(*) FROM test_assignments WHERE sample_id = OLD.id AND is_deleted = 0)",
+                               '1')}
+                {_bump_counter('assignments_by_material', 'NEW.material_type', "''",
+                               "(SELECT COUNT(*) FROM test_assignments WHERE sample_id = NEW.id AND is_deleted = 0)",
+                               '1')}
+            END""",
+        # Populated from scratch by the same queries as counters.py
+        "DELETE FROM dashboard_counters",
+        """INSERT INTO dashboard_counters (metric, dim1, dim2, count)
+           SELECT 'samples_by_status', status, '', COUNT(*)
+           FROM samples WHERE is_deleted = 0 GROUP BY status""",
+        """INSERT INTO dashboard_counters (metric, dim1, dim2, count)
+           SELECT 'samples_by_project', project_id, status, COUNT(*)
+           FROM samples WHERE is_deleted = 0 GROUP BY project_id, status""",
+        """INSERT INTO dashboard_counters (metric, dim1, dim2, count)
+           SELECT 'assignments_by_status', status, '', COUNT(*)
+           FROM test_assignments WHERE is_deleted = 0 GROUP BY status""",
+        """INSERT INTO dashboard_counters (metric, dim1, dim2, count)
+           SELECT 'assignments_by_supervisor', assigned_by, status, COUNT(*)
+           FROM test_assignments WHERE is_deleted = 0 GROUP BY assigned_by, status""",
+        """INSERT INTO dashboard_counters (metric, dim1, dim2, count)
+           SELECT 'assignments_by_material', s.material_type, '', COUNT(*)
+           FROM test_assignments ta JOIN samples s ON ta.sample_id = s.id
+           WHERE ta.is_deleted = 0 GROUP BY s.material_type""",
+        """INSERT INTO dashboard_counters (metric, dim1, dim2, count)
+           SELECT 'results_by_status', status, '', COUNT(*)
+           FROM test_results WHERE is_deleted = 0 GROUP BY status""",
+    ]),
+    (6, "FTS5 bilingual search index kept in sync by triggers",
+        search_index_schema() + search_index_rebuild_sql()),
+    (7, "Index for incremental analytics refresh", [
+        # Results changed since the analytics store's last refresh
+        """CREATE INDEX IF NOT EXISTS idx_test_results_updated
+           ON test_results(updated_at)""",
+    ]),
+    (8, "Incremental turnaround-time rollups", [
+        # Watermarks of incremental rollup jobs
+        """CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            updated_mark TEXT NOT NULL DEFAULT '',
+            refreshed_at TIMESTAMP
+        )""",
+        # Stage durations (hours) each approved result contributed, so a
+        # changed result can be taken out of the rollups again
+        """CREATE TABLE IF NOT EXISTS tat_contributions (
+            result_id INTEGER PRIMARY KEY,
+            day TEXT NOT NULL,
+            project_id INTEGER NOT NULL,
+            method_id INTEGER NOT NULL,
+            collection_to_received REAL,
+            received_to_assigned REAL,
+            assigned_to_completed REAL,
+            completed_to_approved REAL,
+            received_to_approved REAL,
+            collection_to_approved REAL
+        )""",
+        # Per day/month, project, method and stage: count, sum and a
+        # mergeable quantile sketch of durations
+        """CREATE TABLE IF NOT EXISTS tat_rollup (
+            grain TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            period TEXT NOT NULL,
+            project_id INTEGER NOT NULL,
+            method_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            total_hours REAL NOT NULL,
+            sketch TEXT NOT NULL,
+            PRIMARY KEY (grain, stage, period, project_id, method_id)
+        ) WITHOUT ROWID""",
+        # Samples changed since the last rollup run
+        """CREATE INDEX IF NOT EXISTS idx_samples_updated
+           ON samples(updated_at)""",
+    ]),
+    (9, "Typed parameter schemas for the built-in test methods",
+        [_typed_parameters(standard) for standard in SEED_PARAMETERS]),
+    (10, "Content hashes of raw files in the blob store", [
+        # SHA-256 of the stored payload (NULL for files uploaded before the store)
+        "ALTER TABLE raw_files ADD COLUMN content_hash TEXT",
+        # Rows sharing a stored blob
+        """CREATE INDEX IF NOT EXISTS idx_raw_files_hash
+           ON raw_files(content_hash)""",
+    ]),
+    (11, "Stored raw test curves", [
+        # One float32 curve file per result (see curves.py)
+        """CREATE TABLE IF NOT EXISTS test_curves (
+            result_id INTEGER PRIMARY KEY,
+            columns TEXT NOT NULL,
+            points INTEGER NOT NULL,
+            encoding TEXT NOT NULL DEFAULT 'raw',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (result_id) REFERENCES test_results(id)
+        )""",
+    ]),
+]
+
+def ensure_version_table(conn):
+    """Create the schema_version table if it does not exist"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            duration_ms REAL
+        )
+    """)
+    conn.commit()
+
+def get_schema_version(conn):
+    """Get the highest applied migration version (0 if none)"""
+    ensure_version_table(conn)
+    row = conn.execute("SELECT MAX(version) as version FROM schema_version").fetchone()
+    return row['version'] or 0
+
+def get_pending_migrations(conn):
+    """Get migrations newer than the database's schema version"""
+    current = get_schema_version(conn)
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m[0]) if m[0] > current]
+
+def apply_migrations(conn=None, dry_run=False, verbose=True):
+    """Apply pending migrations in order, one transaction per migration.
+
+    With dry_run=True the pending steps and their SQL are printed but
+    nothing is executed. Returns the list of versions applied (or that
+    would be applied).
+    """
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    try:
+        pending = get_pending_migrations(conn)
+        if verbose:
+            current = get_schema_version(conn)
+            if pending:
+                print(f"📋 Schema version {current}, {len(pending)} migration(s) pending")
+            else:
+                print(f"✅ Schema is up to date (version {current})")
+
+        applied = []
+        for version, description, statements in pending:
+            if dry_run:
+                if verbose:
+                    print(f"  [dry-run] {version:03d} {description}")
+                    for sql in statements:
+                        print("      " + " ".join(sql.split()))
+                applied.append(version)
+                continue
+
+            started = time.perf_counter()
+            with transaction(conn):
+                for sql in statements:
+                    conn.execute(sql)
+                duration_ms = (time.perf_counter() - started) * 1000
+                conn.execute("""
+                    INSERT INTO schema_version (version, description, duration_ms)
+                    VALUES (?, ?, ?)
+                """, (version, description, duration_ms))
+
+            applied.append(version)
+            if verbose:
+                print(f"  ✅ {version:03d} {description} ({duration_ms:.1f} ms)")
+
+        if applied and not dry_run:
+            # Refresh planner statistics for the new indexes
+            conn.execute("PRAGMA optimize")
+
+        return applied
+    finally:
+        if close_conn:
+            conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply CE-LIMS schema migrations")
+    parser.add_argument("--db", help="Database file (defaults to CE_LIMS_DB_PATH or ce_lims.db)")
+    parser.add_argument("--dry-run", action="store_true", help="Show pending migrations without applying them")
+    args = parser.parse_args()
+
+    if args.db:
+        configure_database(args.db)
+
+    print("🚀 Running CE-LIMS schema migrations...")
+    apply_migrations(dry_run=args.dry_run)
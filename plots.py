@@ -0,0 +1,375 @@
+"""
+CE-LIMS Plotting Module
+Downsampled series of stored test curves, served from per-curve pyramid levels
+"""
+
+import argparse
+import json
+import math
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from database import get_connection, configure_database
+from curves import curve_path, load_curve
+
+# Points per series sent to a chart (about one per horizontal pixel)
+PLOT_POINTS = 800
+
+# Each pyramid level keeps the lowest and highest load of every
+# PYRAMID_BUCKET points of the level below (a quarter of its points)
+PYRAMID_BUCKET = 8
+
+# Levels are added until one has at most this many points
+PYRAMID_MIN_POINTS = 4096
+
+# Background threads building pyramids of newly stored curves
+PYRAMID_WORKERS = 1
+
+# Curves whose pyramid is kept open in this process
+PYRAMID_CACHE_SIZE = 256
+
+# Columns used for the horizontal axis, in order of preference
+PLOT_X_COLUMNS = ('displacement', 'time')
+
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+
+# Average LTTB bucket width below which buckets are scanned in plain Python
+LTTB_LOOP_POINTS = 32
+
+_pyramids = OrderedDict()
+_pyramids_lock = threading.Lock()
+
+def lttb_indices(x, y, points):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept; every bucket in between
+    keeps the point forming the largest triangle with the point kept
+    before it and the average of the next bucket.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    edges = (np.arange(points - 1) * ((n - 2) / (points - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    starts, ends = edges[1:-1], edges[2:]
+    # Average of the bucket after each bucket (the last point for the last one)
+    next_x = np.append((sum_x[ends] - sum_x[starts]) / (ends - starts), x[-1])
+    next_y = np.append((sum_y[ends] - sum_y[starts]) / (ends - starts), y[-1])
+
+    keep = [0] * points
+    keep[-1] = n - 1
+    a = 0
+    if n < LTTB_LOOP_POINTS * points:
+        # Narrow buckets: a plain loop beats a numpy call per bucket
+        xs, ys = x.tolist(), y.tolist()
+        edges, next_x, next_y = edges.tolist(), next_x.tolist(), next_y.tolist()
+        for i in range(points - 2):
+            ax, ay, bx, by = xs[a], ys[a], next_x[i], next_y[i]
+            best = -1.0
+            for j in range(edges[i], edges[i + 1]):
+                area = abs((ax - bx) * (ys[j] - ay) - (ax - xs[j]) * (by - ay))
+                if area > best:
+                    best, a = area, j
+            keep[i + 1] = a
+    else:
+        for i in range(points - 2):
+            start, end = edges[i], edges[i + 1]
+            area = np.abs((x[a] - next_x[i]) * (y[start:end] - y[a])
+                          - (x[a] - x[start:end]) * (next_y[i] - y[a]))
+            a = start + int(np.argmax(area))
+            keep[i + 1] = a
+    return np.array(keep)
+
+def minmax_indices(y, bucket):
+    """Indices of the lowest and highest value of every bucket of points, in order"""
+    n = len(y)
+    whole = n // bucket * bucket
+    if bucket < 2 or not whole:
+        return np.arange(n)
+    body = np.asarray(y[:whole]).reshape(-1, bucket)
+    offsets = np.arange(0, whole, bucket)
+    pairs = [np.column_stack((body.argmin(axis=1) + offsets, body.argmax(axis=1) + offsets))]
+    if whole < n:
+        tail = np.asarray(y[whole:])
+        pairs.append([[whole + int(tail.argmin()), whole + int(tail.argmax())]])
+    return np.unique(np.concatenate(pairs).ravel())
+
+def _pick_x(curve, x):
+    if x is None:
+        x = next((column for column in PLOT_X_COLUMNS if column in curve), None)
+    if x not in curve:
+        raise ValueError(f"Curve has no {x or ' / '.join(PLOT_X_COLUMNS)} column")
+    return x
+
+def downsample(curve, x=None, y='load', points=PLOT_POINTS, x_range=None, method='lttb'):
+    """DataFrame of a curve's x and y columns reduced to at most about points rows.
+
+    curve maps column names to arrays (as load_curve() returns). x defaults
+    to the first of PLOT_X_COLUMNS the curve has. With x_range=(low, high)
+    only the points in that range are kept (a zoomed chart). method is
+    'lttb' (keeps the shape of the line) or 'minmax' (keeps every peak of
+    y; up to two points per bucket).
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    x = _pick_x(curve, x)
+    if y not in curve:
+        raise ValueError(f"Curve has no {y} column")
+    xs, ys = np.asarray(curve[x]), np.asarray(curve[y])
+
+    keep = np.isfinite(xs) & np.isfinite(ys)
+    if x_range is not None:
+        keep &= (xs >= x_range[0]) & (xs <= x_range[1])
+    if not keep.all():
+        xs, ys = xs[keep], ys[keep]
+
+    if method == 'lttb':
+        selected = lttb_indices(xs, ys, points)
+    else:
+        selected = minmax_indices(ys, math.ceil(len(ys) / max(points // 2, 1)))
+    return pd.DataFrame({x: xs[selected], y: ys[selected]})
+
+def _level_path(result_id, level, root=None):
+    return curve_path(result_id, root)[:-len(".npy")] + f".L{level}.npy"
+
+def _save_level(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def build_pyramid(result_id, conn=None, root=None):
+    """Write the pyramid levels of a stored curve; returns their point counts.
+
+    Level k+1 keeps the lowest and highest load of every PYRAMID_BUCKET
+    points of level k (level 0 is the curve itself), so load peaks
+    survive at every level. Levels are stored beside the curve file as
+    float32 arrays with the curve's row layout.
+    """
+    curve = load_curve(result_id, conn, root)
+    if curve is None:
+        return []
+    columns = list(curve)
+    peak_column = 'load' if 'load' in curve else columns[0]
+    level = np.vstack([curve[column] for column in columns])
+
+    counts = []
+    while level.shape[1] > PYRAMID_MIN_POINTS:
+        level = level[:, minmax_indices(level[columns.index(peak_column)], PYRAMID_BUCKET)]
+        counts.append(level.shape[1])
+        _save_level(_level_path(result_id, len(counts), root), level)
+
+    # Remove levels left over from a longer curve stored earlier
+    stale = len(counts) + 1
+    while os.path.exists(_level_path(result_id, stale, root)):
+        os.remove(_level_path(result_id, stale, root))
+        stale += 1
+    return counts
+
+_builds = {}
+_builds_lock = threading.Lock()
+_build_pool = None
+
+def submit_pyramid(result_id, root=None):
+    """Build a curve's pyramid in the background; returns the Future of build_pyramid().
+
+    A build already queued or running for the curve is reused.
+    """
+    global _build_pool
+    key = (result_id, root)
+    with _builds_lock:
+        future = _builds.get(key)
+        if future is not None and not future.done():
+            return future
+        if _build_pool is None:
+            _build_pool = ThreadPoolExecutor(PYRAMID_WORKERS, thread_name_prefix="ce-lims-pyramid")
+        future = _build_pool.submit(build_pyramid, result_id, None, root)
+        _builds[key] = future
+        future.add_done_callback(lambda f: _builds.pop(key, None) if _builds.get(key) is f else None)
+        return future
+
+def _load_pyramid(result_id, conn, root, info):
+    """(curve file mtime, levels, complete); complete is False while a build is pending"""
+    curve = load_curve(result_id, conn, root, info)
+    if curve is None:
+        return None
+    columns = list(curve)
+    modified = os.path.getmtime(curve_path(result_id, root))
+    first = _level_path(result_id, 1, root)
+    if os.path.exists(first):
+        outdated = os.path.getmtime(first) < modified
+    else:
+        outdated = len(next(iter(curve.values()))) > PYRAMID_MIN_POINTS
+    if outdated:
+        # Plot from the curve itself until the levels are built
+        submit_pyramid(result_id, root)
+        return modified, [curve], False
+
+    levels = [curve]
+    while os.path.exists(_level_path(result_id, len(levels), root)):
+        data = np.load(_level_path(result_id, len(levels), root), mmap_mode='r')
+        levels.append({column: data[i] for i, column in enumerate(columns)})
+    return modified, levels, True
+
+def get_pyramid(result_id, conn=None, root=None, info=None):
+    """Levels of a stored curve, finest (the curve itself) first (None if it has none).
+
+    Missing or outdated levels are built in the background; until then only
+    the curve itself is returned. Complete pyramids stay open in a
+    per-process cache until their curve file changes. info is passed on
+    to load_curve().
+    """
+    key = (result_id, root)
+    path = curve_path(result_id, root)
+    with _pyramids_lock:
+        cached = _pyramids.get(key)
+        if cached is not None and os.path.exists(path) and os.path.getmtime(path) == cached[0]:
+            _pyramids.move_to_end(key)
+            return cached[1]
+
+    loaded = _load_pyramid(result_id, conn, root, info)
+    if loaded is None:
+        return None
+    modified, levels, complete = loaded
+    if complete:
+        with _pyramids_lock:
+            _pyramids[key] = (modified, levels)
+            _pyramids.move_to_end(key)
+            while len(_pyramids) > PYRAMID_CACHE_SIZE:
+                _pyramids.popitem(last=False)
+    return levels
+
+def _pick_level(levels, x, x_range, points):
+    """Coarsest level that still has twice the points wanted (in range)"""
+    for level in reversed(levels[1:]):
+        xs = level[x]
+        count = len(xs) if x_range is None else int(np.count_nonzero(
+            (xs >= x_range[0]) & (xs <= x_range[1])))
+        if count >= 2 * points:
+            return level
+    return levels[0]
+
+def curve_series(result_id, x=None, y='load', points=PLOT_POINTS, x_range=None, method='lttb',
+                 conn=None, root=None, info=None):
+    """Downsampled series of a stored curve at a chart's resolution (None if it has none).
+
+    The series is taken from the coarsest pyramid level that still holds
+    enough points for the chart (within x_range when zoomed), so only
+    zooming in deep reads the full curve. Pass the result's CurveInfo as
+    info when it was prefetched, so no query is run per curve.
+    """
+    levels = get_pyramid(result_id, conn, root, info)
+    if levels is None:
+        return None
+    x = _pick_x(levels[0], x)
+    return downsample(_pick_level(levels, x, x_range, points), x, y, points, x_range, method)
+
+def overlay_series(curves, x='displacement', y='load', points=PLOT_POINTS, x_range=None,
+                   method='lttb', conn=None, root=None):
+    """Long DataFrame (specimen, x, y) overlaying several stored curves.
+
+    curves maps specimen labels to result ids. Curves that are missing or
+    lack the x or y column are left out.
+    """
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    try:
+        frames = []
+        for label, result_id in curves.items():
+            try:
+                series = curve_series(result_id, x, y, points, x_range, method, conn, root)
+            except ValueError:
+                continue
+            if series is not None:
+                frames.append(series.assign(specimen=label))
+    finally:
+        if close_conn:
+            conn.close()
+
+    if not frames:
+        return pd.DataFrame(columns=['specimen', x, y])
+    return pd.concat(frames, ignore_index=True)[['specimen', x, y]]
+
+def curve_x_range(result_ids, x='displacement', conn=None, root=None):
+    """(min, max) of x over several stored curves (None if none has it).
+
+    Taken from the coarsest pyramid level of each curve, so it is cheap
+    but may miss an x extreme that fell between the load peaks kept.
+    """
+    low, high = [], []
+    for result_id in result_ids:
+        levels = get_pyramid(result_id, conn, root)
+        if levels is None or x not in levels[0]:
+            continue
+        xs = np.asarray(levels[-1][x])
+        xs = xs[np.isfinite(xs)]
+        if len(xs):
+            low.append(float(xs.min()))
+            high.append(float(xs.max()))
+    return (min(low), max(high)) if low else None
+
+def get_project_curves(project_id, conn=None):
+    """Results of a project with a stored curve (newest first)"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    try:
+        rows = conn.execute("""
+            SELECT tc.result_id, tc.columns, tc.points, s.sample_id as sample_code,
+                   tm.standard, tm.test_name, tr.status
+            FROM test_curves tc
+            JOIN test_results tr ON tr.id = tc.result_id
+            JOIN test_assignments ta ON tr.assignment_id = ta.id
+            JOIN samples s ON ta.sample_id = s.id
+            JOIN test_methods tm ON ta.test_method_id = tm.id
+            WHERE s.project_id = ? AND tr.is_deleted = 0
+            ORDER BY tc.result_id DESC
+        """, (project_id,)).fetchall()
+        return [dict(row, columns=json.loads(row['columns'])) for row in rows]
+    finally:
+        if close_conn:
+            conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build pyramid levels of stored CE-LIMS test curves")
+    parser.add_argument("result_id", nargs="*", type=int, help="Results whose pyramid to build")
+    parser.add_argument("--db", help="Database file (defaults to CE_LIMS_DB_PATH or ce_lims.db)")
+    parser.add_argument("--all", action="store_true", help="Build the pyramid of every stored curve")
+    args = parser.parse_args()
+
+    if args.db:
+        configure_database(args.db)
+
+    result_ids = list(args.result_id)
+    if args.all:
+        conn = get_connection()
+        result_ids += [row['result_id'] for row in
+                       conn.execute("SELECT result_id FROM test_curves ORDER BY result_id").fetchall()]
+        conn.close()
+
+    for result_id in dict.fromkeys(result_ids):
+        try:
+            counts = build_pyramid(result_id)
+        except ValueError as e:
+            print(f"  ❌ Result {result_id}: {e}")
+            continue
+        print(f"📈 Result {result_id}: {len(counts)} level(s) {counts}")
@@ -0,0 +1,299 @@
+"""
+CE-LIMS Recalculation Module
+Bulk recalculation of stored test results after a calculator or its limits change
+"""
+
+import argparse
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+from calculations import (
+    BATCH_CALCULATORS, RESULT_VALUE_KEYS, auto_calculate, auto_calculate_batch, iter_batch_results
+)
+from database import get_connection, transaction, configure_database, log_audit_many
+from reports import REPORT_DIR
+
+# Results read, calculated and written back per chunk
+RECALC_CHUNK_SIZE = 2000
+
+# Worker processes calculating chunks (1 calculates in this process)
+RECALC_WORKERS = os.cpu_count() or 1
+
+# Stored fields a recalculation may change
+RECALC_FIELDS = ['calculated_results', 'result_value', 'result_unit', 'pass_fail']
+
+RESULTS_QUERY = """
+    SELECT tr.id, tm.standard, tr.raw_data,
+           tr.calculated_results, tr.result_value, tr.result_unit, tr.pass_fail
+    FROM test_results tr
+    CROSS JOIN test_assignments ta ON tr.assignment_id = ta.id
+    JOIN test_methods tm ON ta.test_method_id = tm.id
+    WHERE tr.id > ? AND tr.is_deleted = 0 AND tm.standard IN ({standards})
+    ORDER BY tr.id
+    LIMIT ?
+"""
+
+REPORT_COLUMNS = [
+    'result_id', 'standard', 'outcome', 'changed_fields',
+    'old_result_value', 'new_result_value', 'old_pass_fail', 'new_pass_fail', 'error',
+]
+
+def _calculate(standard, rows):
+    """Calculate one standard's rows from their stored raw data"""
+    inputs, unreadable = [], set()
+    for i, row in enumerate(rows):
+        try:
+            data = json.loads(row['raw_data'] or '')
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            unreadable.add(i)
+            data = {}
+        inputs.append(data)
+
+    try:
+        results = list(iter_batch_results(auto_calculate_batch(standard, pd.DataFrame(inputs))))
+    except (TypeError, ValueError):
+        # Some value in the chunk is not numeric: fall back to row by row
+        results = []
+        for data in inputs:
+            try:
+                results.append(auto_calculate(standard, data))
+            except (TypeError, ValueError, ZeroDivisionError) as e:
+                results.append({'error': str(e)})
+
+    return [
+        {'error': 'Unreadable raw data'} if i in unreadable else result
+        for i, result in enumerate(results)
+    ]
+
+def _compare(row, standard, result):
+    """Compare a recalculated result with the stored one"""
+    outcome = {'result_id': row['id'], 'standard': standard, 'error': None, 'old': {}, 'new': {}}
+    if 'error' in result:
+        outcome.update(outcome='error', error=result['error'])
+        return outcome
+
+    new = {
+        'calculated_results': json.dumps(result),
+        'result_value': result[RESULT_VALUE_KEYS[standard]],
+        'result_unit': result.get('unit', row['result_unit']),
+        'pass_fail': result.get('pass_fail', row['pass_fail']),
+    }
+    changed = [field for field in RECALC_FIELDS if row[field] != new[field]]
+    outcome['old'] = {field: row[field] for field in changed}
+    outcome['new'] = new
+    outcome['outcome'] = 'changed' if changed else 'unchanged'
+    return outcome
+
+def recalculate_chunk(rows):
+    """Recalculate a chunk of stored results (runs in a worker process).
+
+    rows are dicts from RESULTS_QUERY. Returns one outcome per row, in
+    order: a dict with result_id, standard, outcome ('changed',
+    'unchanged' or 'error'), error, old (the changed fields' stored
+    values) and new (every recalculated field).
+    """
+    by_standard = {}
+    for row in rows:
+        by_standard.setdefault(row['standard'], []).append(row)
+
+    outcomes = {}
+    for standard, group in by_standard.items():
+        for row, result in zip(group, _calculate(standard, group)):
+            outcomes[row['id']] = _compare(row, standard, result)
+    return [outcomes[row['id']] for row in rows]
+
+def _checkpoint_name(standards):
+    return "recalculate:" + ",".join(standards)
+
+def _iter_chunks(conn, standards, after_id, chunk_size):
+    """Yield stored results of the standards in id order, chunk_size at a time"""
+    sql = RESULTS_QUERY.format(standards=", ".join("?" for _ in standards))
+    while True:
+        rows = [dict(r) for r in conn.execute(sql, [after_id] + standards + [chunk_size])]
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1]['id']
+
+def _write_changes(conn, outcomes, user_id, checkpoint, last_id):
+    """Write one chunk's changes, audit rows and checkpoint in one transaction"""
+    changed = [o for o in outcomes if o['outcome'] == 'changed']
+    with transaction(conn):
+        conn.executemany("""
+            UPDATE test_results
+            SET calculated_results = ?, result_value = ?, result_unit = ?, pass_fail = ?,
+                updated_at = CURRENT_TIMESTAMP, updated_by = ?
+            WHERE id = ?
+        """, [
+            tuple(o['new'][field] for field in RECALC_FIELDS) + (user_id, o['result_id'])
+            for o in changed
+        ])
+        log_audit_many([
+            ('test_results', o['result_id'], 'UPDATE',
+             json.dumps(o['old']),
+             json.dumps({field: o['new'][field] for field in o['old']}),
+             user_id)
+            for o in changed
+        ], conn)
+        conn.execute("""
+            INSERT OR REPLACE INTO rollup_state (name, last_id, updated_mark, refreshed_at)
+            VALUES (?, ?, '', CURRENT_TIMESTAMP)
+        """, (checkpoint, last_id))
+
+def recalculate_results(standards=None, dry_run=False, user_id=None, workers=RECALC_WORKERS,
+                        chunk_size=RECALC_CHUNK_SIZE, restart=False, report_path=None,
+                        progress=None):
+    """Recalculate stored test results with the current calculators.
+
+    Results of the given standards (every standard with a calculator by
+    default) are streamed in id order, calculated chunk by chunk across
+    a process pool and compared with what is stored. Changed results are
+    written back with an audit row each, one transaction per chunk; each
+    transaction also stores the last result id handled, so an interrupted
+    run resumes from there (restart=True starts over). The checkpoint is
+    cleared when a run completes. With dry_run=True nothing is written.
+
+    Every changed or failed result is listed in a CSV report. progress is
+    called with the running summary after each chunk. Returns the summary.
+    """
+    standards = sorted(set(standards or BATCH_CALCULATORS))
+    unknown = [s for s in standards if s not in BATCH_CALCULATORS]
+    if unknown:
+        raise ValueError(f"No calculator available for {', '.join(unknown)}")
+    if not dry_run and user_id is None:
+        raise ValueError("A user is required to recalculate results")
+
+    checkpoint = _checkpoint_name(standards)
+    if report_path is None:
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        report_path = os.path.join(REPORT_DIR, f"recalculation_{stamp}{'_dry_run' if dry_run else ''}.csv")
+
+    conn = get_connection()
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        after_id = 0
+        if not dry_run and not restart:
+            row = conn.execute(
+                "SELECT last_id FROM rollup_state WHERE name = ?", (checkpoint,)
+            ).fetchone()
+            after_id = row['last_id'] if row else 0
+
+        summary = {
+            'standards': standards,
+            'resumed_after': after_id,
+            'scanned': 0,
+            'changed': 0,
+            'unchanged': 0,
+            'error': 0,
+            'by_standard': {},
+            'report': report_path,
+        }
+
+        with open(report_path, "w", newline="", encoding="utf-8-sig") as f:
+            report = csv.writer(f)
+            report.writerow(REPORT_COLUMNS)
+
+            def finish(last_id, outcomes):
+                for o in outcomes:
+                    counts = summary['by_standard'].setdefault(
+                        o['standard'], {'changed': 0, 'unchanged': 0, 'error': 0}
+                    )
+                    counts[o['outcome']] += 1
+                    summary[o['outcome']] += 1
+                    if o['outcome'] != 'unchanged':
+                        report.writerow([
+                            o['result_id'], o['standard'], o['outcome'], " ".join(o['old']),
+                            o['old'].get('result_value', o['new'].get('result_value')),
+                            o['new'].get('result_value'),
+                            o['old'].get('pass_fail', o['new'].get('pass_fail')),
+                            o['new'].get('pass_fail'),
+                            o['error'] or '',
+                        ])
+                summary['scanned'] += len(outcomes)
+                if not dry_run:
+                    _write_changes(conn, outcomes, user_id, checkpoint, last_id)
+                if progress:
+                    progress(summary)
+
+            # Keep a few chunks in flight; finish them in order so the
+            # checkpoint only ever moves past fully written chunks
+            pending = deque()
+            for rows in _iter_chunks(conn, standards, after_id, chunk_size):
+                if pool is None:
+                    finish(rows[-1]['id'], recalculate_chunk(rows))
+                    continue
+                pending.append((rows[-1]['id'], pool.submit(recalculate_chunk, rows)))
+                if len(pending) >= workers * 2:
+                    last_id, future = pending.popleft()
+                    finish(last_id, future.result())
+            while pending:
+                last_id, future = pending.popleft()
+                finish(last_id, future.result())
+
+        if not dry_run:
+            with transaction(conn):
+                conn.execute("DELETE FROM rollup_state WHERE name = ?", (checkpoint,))
+
+        return summary
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalculate stored CE-LIMS test results")
+    parser.add_argument("--db", help="Database file (defaults to CE_LIMS_DB_PATH or ce_lims.db)")
+    parser.add_argument("--standard", action="append",
+                        help="Only results of this standard, e.g. 'ASTM C39' (repeatable; default: all)")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    parser.add_argument("--user", help="Username the changes are recorded under (required unless --dry-run)")
+    parser.add_argument("--workers", type=int, default=RECALC_WORKERS, help="Worker processes")
+    parser.add_argument("--chunk-size", type=int, default=RECALC_CHUNK_SIZE, help="Results per chunk")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint of an interrupted run")
+    parser.add_argument("--report", help="CSV report path (default: a new file in the reports directory)")
+    args = parser.parse_args()
+
+    if args.db:
+        configure_database(args.db)
+
+    user_id = None
+    if args.user:
+        conn = get_connection()
+        row = conn.execute("SELECT id FROM users WHERE username = ?", (args.user,)).fetchone()
+        conn.close()
+        if row is None:
+            parser.error(f"Unknown user: {args.user}")
+        user_id = row['id']
+    elif not args.dry_run:
+        parser.error("--user is required unless --dry-run is given")
+
+    def show_progress(summary):
+        print(f"  ... {summary['scanned']} scanned, {summary['changed']} changed, {summary['error']} error(s)",
+              end="\r", flush=True)
+
+    print(f"🔄 Recalculating test results{' (dry run)' if args.dry_run else ''}...")
+    summary = recalculate_results(
+        standards=args.standard,
+        dry_run=args.dry_run,
+        user_id=user_id,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        restart=args.restart,
+        report_path=args.report,
+        progress=show_progress,
+    )
+    print()
+    if summary['resumed_after']:
+        print(f"  ↪️ Resumed after result {summary['resumed_after']}")
+    for standard, counts in sorted(summary['by_standard'].items()):
+        print(f"  {standard}: {counts['changed']} changed, {counts['unchanged']} unchanged, {counts['error']} error(s)")
+    verb = "would change" if args.dry_run else "changed"
+    print(f"✅ {summary['scanned']} result(s) checked, {summary['changed']} {verb}, {summary['error']} error(s)")
+    print(f"📄 Report: {summary['report']}")
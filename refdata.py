@@ -0,0 +1,178 @@
+"""
+CE-LIMS Reference Data Module
+Process-wide cache for projects, test methods, lab technicians and equipment
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from database import get_connection, get_db_path, add_write_listener
+
+# Maximum number of cached lookups kept (least recently used are evicted)
+REFDATA_CACHE_SIZE = int(os.environ.get("CE_LIMS_REFDATA_CACHE_SIZE", "128"))
+
+# How often table_versions is re-read to notice writes made by other
+# processes; commits made in this process are noticed immediately.
+REFDATA_CHECK_SECONDS = float(os.environ.get("CE_LIMS_REFDATA_CHECK_SECONDS", "2"))
+
+class VersionedCache:
+    """LRU cache of query results, valid until one of their tables is written.
+
+    Each entry remembers the table_versions counters it was loaded under.
+    The counters themselves are read at most once per check_interval (or
+    right after a local commit), so a hit costs no database access at all.
+    Cached values are shared between sessions and must not be modified.
+    """
+
+    def __init__(self, maxsize=REFDATA_CACHE_SIZE, check_interval=REFDATA_CHECK_SECONDS):
+        self.maxsize = maxsize
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._versions = None
+        self._db_path = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'version_checks': 0,
+        }
+
+    def _current_versions(self):
+        now = time.monotonic()
+        if self._db_path != get_db_path():
+            # Pointed at another database: nothing cached is valid
+            self._entries.clear()
+            self._versions = None
+            self._db_path = get_db_path()
+
+        if self._versions is None or now - self._checked_at >= self.check_interval:
+            conn = get_connection()
+            try:
+                rows = conn.execute("SELECT table_name, version FROM table_versions").fetchall()
+            finally:
+                conn.close()
+            self._versions = {row['table_name']: row['version'] for row in rows}
+            self._checked_at = now
+            self._stats['version_checks'] += 1
+        return self._versions
+
+    def get(self, key, tables, loader):
+        """Return the cached value for key, calling loader() on a miss"""
+        tables = tuple(tables)
+        with self._lock:
+            current = self._current_versions()
+            versions = tuple(current.get(table, 0) for table in tables)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == versions:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[2]
+            self._stats['misses'] += 1
+
+        value = loader()
+
+        with self._lock:
+            self._entries[key] = (tables, versions, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return value
+
+    def mark_stale(self):
+        """Re-read the version counters on the next lookup"""
+        with self._lock:
+            self._versions = None
+
+    def invalidate(self, tables=None):
+        """Drop cached entries that depend on any of tables (all entries if None)"""
+        with self._lock:
+            if tables is None:
+                dropped = list(self._entries)
+            else:
+                tables = set(tables)
+                dropped = [key for key, entry in self._entries.items() if tables & set(entry[0])]
+            for key in dropped:
+                del self._entries[key]
+            self._versions = None
+            self._stats['invalidations'] += len(dropped)
+
+    def stats(self):
+        """Snapshot of cache counters for monitoring"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['size'] = len(self._entries)
+        lookups = snapshot['hits'] + snapshot['misses']
+        snapshot['hit_rate'] = snapshot['hits'] / lookups if lookups else 0.0
+        return snapshot
+
+_cache = VersionedCache()
+add_write_listener(_cache.mark_stale)
+
+def get_refdata_stats():
+    """Get reference data cache statistics"""
+    return _cache.stats()
+
+def invalidate_refdata(tables=None):
+    """Drop cached reference data for tables (everything if None)"""
+    _cache.invalidate(tables)
+
+def _query(sql, params=()):
+    conn = get_connection()
+    try:
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+    finally:
+        conn.close()
+
+def get_projects(active_only=False):
+    """Get projects (only status 'active' ones with active_only)"""
+    sql = """
+        SELECT id, project_code, project_name, project_name_ar, status
+        FROM projects
+        WHERE is_deleted = 0
+    """
+    if active_only:
+        sql += " AND status = 'active'"
+    return _cache.get(('projects', active_only), ['projects'], lambda: _query(sql))
+
+def get_test_methods():
+    """Get all active test methods"""
+    return _cache.get(('test_methods',), ['test_methods'], lambda: _query("""
+        SELECT id, test_code, test_name, test_name_ar, standard, material_type,
+               parameters, calculation_formula, typical_duration
+        FROM test_methods
+        WHERE is_active = 1
+    """))
+
+def get_test_methods_by_material():
+    """Get active test methods grouped by material type"""
+    def load():
+        grouped = {}
+        for method in get_test_methods():
+            grouped.setdefault(method['material_type'], []).append(method)
+        return grouped
+    return _cache.get(('test_methods_by_material',), ['test_methods'], load)
+
+def get_lab_techs():
+    """Get active lab technicians"""
+    return _cache.get(('lab_techs',), ['users'], lambda: _query("""
+        SELECT id, full_name, full_name_ar
+        FROM users
+        WHERE role = 'lab_tech' AND is_active = 1
+    """))
+
+def get_equipment(active_only=True):
+    """Get laboratory equipment (only status 'active' ones with active_only)"""
+    sql = """
+        SELECT id, equipment_code, equipment_name, equipment_name_ar,
+               calibration_due_date, status, location
+        FROM equipment
+        WHERE is_deleted = 0
+    """
+    if active_only:
+        sql += " AND status = 'active'"
+    return _cache.get(('equipment', active_only), ['equipment'], lambda: _query(sql))
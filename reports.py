@@ -0,0 +1,204 @@
+"""
+CE-LIMS Reports Module
+Date-range test result reports streamed to CSV or Parquet files on disk
+"""
+
+import csv
+import os
+from datetime import datetime, timedelta
+from database import get_connection
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Where exported report files are written
+REPORT_DIR = os.environ.get("CE_LIMS_REPORT_DIR", "reports")
+
+# Exported report files older than this are deleted by the next export
+REPORT_MAX_AGE_HOURS = float(os.environ.get("CE_LIMS_REPORT_MAX_AGE_HOURS", "24"))
+
+# Rows fetched from SQLite and written per chunk
+REPORT_CHUNK_SIZE = 5000
+
+# Rows shown on screen before exporting
+PREVIEW_ROWS = 100
+
+REPORT_COLUMNS = [
+    'sample_id', 'project_name', 'material_type', 'test_name', 'standard',
+    'result_value', 'result_unit', 'test_completed_at', 'status',
+    'tested_by', 'approved_by',
+]
+
+REPORT_QUERY = """
+    SELECT
+        s.sample_id,
+        p.project_name,
+        s.material_type,
+        tm.test_name,
+        tm.standard,
+        tr.result_value,
+        tr.result_unit,
+        tr.test_completed_at,
+        tr.status,
+        u1.full_name as tested_by,
+        u2.full_name as approved_by
+    FROM test_results tr
+    CROSS JOIN test_assignments ta ON tr.assignment_id = ta.id
+    JOIN samples s ON ta.sample_id = s.id
+    JOIN projects p ON s.project_id = p.id
+    JOIN test_methods tm ON ta.test_method_id = tm.id
+    JOIN users u1 ON tr.tested_by = u1.id
+    LEFT JOIN users u2 ON tr.approved_by = u2.id
+    WHERE {where}
+"""
+
+def get_export_formats():
+    """Get the export formats available in this installation"""
+    return ['csv', 'parquet'] if pa is not None else ['csv']
+
+def report_filter(start_date, end_date, project_id=None):
+    """Build the WHERE clause and parameters for a report.
+
+    The date range is applied to the raw timestamp as the half-open range
+    [start_date, end_date + 1 day), so idx_test_results_completed is used
+    instead of evaluating DATE() on every row. The report queries CROSS
+    JOIN from test_results so SQLite always drives them from that range,
+    even with stale planner statistics.
+    """
+    where = "tr.test_completed_at >= ? AND tr.test_completed_at < ?"
+    params = [start_date.isoformat(), (end_date + timedelta(days=1)).isoformat()]
+
+    if project_id is not None:
+        where += " AND s.project_id = ?"
+        params.append(project_id)
+
+    return where, params
+
+def get_report_summary(conn, start_date, end_date, project_id=None):
+    """Count the rows a report would contain (total and approved)"""
+    where, params = report_filter(start_date, end_date, project_id)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT COUNT(*) as total,
+               COALESCE(SUM(tr.status = 'approved'), 0) as approved
+        FROM test_results tr
+        CROSS JOIN test_assignments ta ON tr.assignment_id = ta.id
+        JOIN samples s ON ta.sample_id = s.id
+        WHERE {where}
+    """, params)
+    return dict(cursor.fetchone())
+
+def get_report_preview(conn, start_date, end_date, project_id=None, limit=PREVIEW_ROWS):
+    """Load the first rows of a report (most recent first)"""
+    where, params = report_filter(start_date, end_date, project_id)
+    cursor = conn.cursor()
+    cursor.execute(
+        REPORT_QUERY.format(where=where) + " ORDER BY tr.test_completed_at DESC LIMIT ?",
+        params + [limit]
+    )
+    return [dict(r) for r in cursor.fetchall()]
+
+def iter_report_chunks(conn, start_date, end_date, project_id=None, chunk_size=REPORT_CHUNK_SIZE):
+    """Yield report rows as lists of tuples, chunk_size rows at a time"""
+    where, params = report_filter(start_date, end_date, project_id)
+    cursor = conn.cursor()
+    cursor.execute(REPORT_QUERY.format(where=where) + " ORDER BY tr.test_completed_at DESC", params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield [tuple(r) for r in rows]
+
+def _write_csv(path, chunks):
+    count = 0
+    # utf-8-sig so spreadsheet programs detect the Arabic text correctly
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_COLUMNS)
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+def _write_parquet(path, chunks):
+    schema = pa.schema([
+        (name, pa.float64() if name == 'result_value' else pa.string())
+        for name in REPORT_COLUMNS
+    ])
+    count = 0
+    with pq.ParquetWriter(path, schema, compression="snappy") as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            count += len(rows)
+    return count
+
+def expire_reports(report_dir=None, max_age_hours=None):
+    """Delete exported report files older than max_age_hours; returns how many.
+
+    Only report_* exports are touched, not recalculation or scrub reports.
+    """
+    report_dir = report_dir or REPORT_DIR
+    max_age_hours = REPORT_MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+    if not os.path.isdir(report_dir):
+        return 0
+    cutoff = datetime.now().timestamp() - max_age_hours * 3600
+    removed = 0
+    for name in os.listdir(report_dir):
+        path = os.path.join(report_dir, name)
+        if not name.startswith("report_"):
+            continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            # Downloaded and deleted meanwhile
+            continue
+    return removed
+
+def take_report(path):
+    """Read an exported report and delete it (it is served once)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    os.remove(path)
+    return data
+
+def export_report(start_date, end_date, project_id=None, fmt='csv',
+                  report_dir=None, chunk_size=REPORT_CHUNK_SIZE):
+    """Stream a report to a file and return (path, row count).
+
+    Rows go from the cursor to the file chunk_size at a time, so memory use
+    does not grow with the size of the report.
+    """
+    if fmt not in get_export_formats():
+        raise ValueError(f"Unsupported report format: {fmt}")
+
+    report_dir = report_dir or REPORT_DIR
+    os.makedirs(report_dir, exist_ok=True)
+    expire_reports(report_dir)
+    scope = f"project{project_id}" if project_id is not None else "all"
+    stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    path = os.path.join(report_dir, f"report_{start_date}_{end_date}_{scope}_{stamp}.{fmt}")
+
+    conn = get_connection()
+    try:
+        chunks = iter_report_chunks(conn, start_date, end_date, project_id, chunk_size)
+        if fmt == 'parquet':
+            count = _write_parquet(path, chunks)
+        else:
+            count = _write_csv(path, chunks)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    finally:
+        conn.close()
+
+    return path, count
@@ -0,0 +1,286 @@
+"""
+CE-LIMS Parameter Schemas Module
+Typed, compiled parameter schemas for test_methods.parameters
+"""
+
+import json
+from collections import namedtuple
+from functools import lru_cache
+from refdata import get_test_methods
+
+# Compiled schemas kept (keyed by the parameters text, so an edited method
+# compiles afresh while unchanged methods reuse their compiled form)
+SCHEMA_CACHE_SIZE = 256
+
+FIELD_TYPES = ('number', 'integer', 'choice', 'text', 'readings')
+
+Field = namedtuple('Field', [
+    'name', 'type', 'label', 'label_ar', 'unit', 'min', 'max', 'step',
+    'default', 'required', 'options', 'count',
+])
+
+# Parameter schemas of the built-in ASTM methods; their keys are the
+# inputs of the matching calculator in calculations.py
+STANDARD_SCHEMAS = {
+    'ASTM D5': {'fields': [
+        {'name': 'temperature', 'label': 'Temperature', 'label_ar': 'درجة الحرارة', 'unit': '°C',
+         'min': 0, 'max': 100, 'default': 25, 'step': 0.1},
+        {'name': 'needle_load', 'label': 'Needle Load', 'label_ar': 'حمل الإبرة', 'unit': 'g',
+         'min': 0, 'max': 200, 'default': 100, 'step': 1},
+        {'name': 'readings', 'type': 'readings', 'count': 3, 'label': 'Penetration Readings',
+         'label_ar': 'قراءات الاختراق', 'unit': '0.1mm', 'min': 0, 'step': 0.1},
+    ]},
+    'ASTM C39': {'fields': [
+        {'name': 'diameter', 'label': 'Diameter', 'label_ar': 'القطر', 'unit': 'mm',
+         'min': 0, 'default': 150, 'step': 1},
+        {'name': 'height', 'label': 'Height', 'label_ar': 'الارتفاع', 'unit': 'mm',
+         'min': 0, 'default': 300, 'step': 1},
+        {'name': 'max_load', 'label': 'Maximum Load', 'label_ar': 'الحمل الأقصى', 'unit': 'kN',
+         'min': 0, 'step': 0.1},
+        {'name': 'age', 'type': 'choice', 'label': 'Age', 'label_ar': 'العمر', 'unit': 'days',
+         'options': [7, 14, 28], 'default': 28},
+    ]},
+    'ASTM D1557': {'fields': [
+        {'name': 'mold_volume', 'label': 'Mold Volume', 'label_ar': 'حجم القالب', 'unit': 'cm³',
+         'min': 0, 'default': 944, 'step': 1},
+        {'name': 'mold_mass', 'label': 'Mold Mass', 'label_ar': 'كتلة القالب', 'unit': 'g',
+         'min': 0, 'step': 0.1},
+        {'name': 'wet_mass', 'label': 'Wet Soil + Mold Mass', 'label_ar': 'كتلة التربة الرطبة مع القالب',
+         'unit': 'g', 'min': 0, 'step': 0.1},
+        {'name': 'water_content', 'label': 'Water Content', 'label_ar': 'المحتوى المائي', 'unit': '%',
+         'min': 0, 'max': 100, 'step': 0.1},
+    ]},
+    'ASTM D2166': {'fields': [
+        {'name': 'diameter', 'label': 'Diameter', 'label_ar': 'القطر', 'unit': 'mm',
+         'min': 0, 'default': 38, 'step': 0.1},
+        {'name': 'height', 'label': 'Initial Height', 'label_ar': 'الارتفاع الابتدائي', 'unit': 'mm',
+         'min': 0, 'default': 76, 'step': 0.1},
+        {'name': 'max_load', 'label': 'Maximum Load', 'label_ar': 'الحمل الأقصى', 'unit': 'kN',
+         'min': 0, 'step': 0.01},
+        {'name': 'deformation', 'label': 'Deformation at Failure', 'label_ar': 'التشوه عند الانهيار',
+         'unit': 'mm', 'min': 0, 'step': 0.01},
+    ]},
+    'ASTM D4318': {'fields': [
+        {'name': 'liquid_limit', 'label': 'Liquid Limit', 'label_ar': 'حد السيولة', 'unit': '%',
+         'min': 0, 'max': 200, 'step': 0.1},
+        {'name': 'plastic_limit', 'label': 'Plastic Limit', 'label_ar': 'حد اللدونة', 'unit': '%',
+         'min': 0, 'max': 200, 'step': 0.1},
+        {'name': 'clay_fraction', 'label': 'Clay Fraction', 'label_ar': 'نسبة الطين', 'unit': '%',
+         'min': 0, 'max': 100, 'step': 0.1, 'required': False},
+    ]},
+    'ASTM D1883': {'fields': [
+        {'name': 'load_2_5mm', 'label': 'Load at 2.5 mm', 'label_ar': 'الحمل عند 2.5 مم', 'unit': 'kN',
+         'min': 0, 'step': 0.01},
+        {'name': 'load_5mm', 'label': 'Load at 5 mm', 'label_ar': 'الحمل عند 5 مم', 'unit': 'kN',
+         'min': 0, 'step': 0.01},
+    ]},
+}
+
+def _number(spec, key):
+    value = spec.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{spec.get('name')}: {key} must be a number")
+    return float(value)
+
+def _compile_field(spec):
+    """Check one field spec and return it as a Field"""
+    if not isinstance(spec, dict):
+        raise ValueError("Every field must be an object")
+    name = spec.get('name')
+    if not isinstance(name, str) or not name.isidentifier():
+        raise ValueError(f"Invalid field name: {name!r}")
+    field_type = spec.get('type', 'number')
+    if field_type not in FIELD_TYPES:
+        raise ValueError(f"{name}: unknown type {field_type!r}")
+
+    minimum, maximum, step = _number(spec, 'min'), _number(spec, 'max'), _number(spec, 'step')
+    if minimum is not None and maximum is not None and minimum > maximum:
+        raise ValueError(f"{name}: min is greater than max")
+
+    default = spec.get('default')
+    options = None
+    count = None
+    if field_type == 'choice':
+        options = tuple(spec.get('options') or ())
+        if not options:
+            raise ValueError(f"{name}: a choice needs options")
+        if default not in options:
+            default = options[0]
+    elif field_type == 'text':
+        default = str(default) if default is not None else ''
+    else:
+        default = _number(spec, 'default')
+        if default is None:
+            default = minimum if minimum is not None and minimum > 0 else 0.0
+        if field_type == 'integer':
+            default = int(default)
+            step = step or 1.0
+        if (minimum is not None and default < minimum) or (maximum is not None and default > maximum):
+            raise ValueError(f"{name}: default is out of range")
+        if field_type == 'readings':
+            count = spec.get('count', 3)
+            if not isinstance(count, int) or count < 1:
+                raise ValueError(f"{name}: count must be a positive integer")
+
+    label = spec.get('label') or name[0].upper() + name[1:].replace('_', ' ')
+    return Field(
+        name=name,
+        type=field_type,
+        label=label,
+        label_ar=spec.get('label_ar') or label,
+        unit=spec.get('unit') or '',
+        min=minimum,
+        max=maximum,
+        step=step,
+        default=default,
+        required=bool(spec.get('required', True)),
+        options=options,
+        count=count,
+    )
+
+def _range_check(field, value):
+    if field.min is not None and value < field.min:
+        raise ValueError(f"{field.label}: must be at least {field.min:g} / يجب ألا يقل عن {field.min:g}")
+    if field.max is not None and value > field.max:
+        raise ValueError(f"{field.label}: must be at most {field.max:g} / يجب ألا يزيد عن {field.max:g}")
+    return value
+
+def _validator(field):
+    """Build the function that checks and converts one field's value"""
+    def to_number(value):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{field.label}: must be a number / يجب أن يكون رقمًا") from None
+        if number != number:
+            raise ValueError(f"{field.label}: must be a number / يجب أن يكون رقمًا")
+        return _range_check(field, number)
+
+    if field.type == 'number':
+        return to_number
+    if field.type == 'integer':
+        def to_integer(value):
+            number = to_number(value)
+            if number != int(number):
+                raise ValueError(f"{field.label}: must be a whole number / يجب أن يكون عددًا صحيحًا")
+            return int(number)
+        return to_integer
+    if field.type == 'choice':
+        by_text = {str(option): option for option in field.options}
+        def to_choice(value):
+            if str(value) not in by_text:
+                raise ValueError(f"{field.label}: not an allowed value / قيمة غير مسموح بها")
+            return by_text[str(value)]
+        return to_choice
+    if field.type == 'text':
+        return lambda value: str(value).strip()
+
+    def to_readings(value):
+        if not isinstance(value, (list, tuple)) or len(value) != field.count:
+            raise ValueError(f"{field.label}: {field.count} readings required / مطلوب {field.count} قراءات")
+        return [to_number(v) for v in value]
+    return to_readings
+
+class ParameterSchema:
+    """Compiled parameter schema of a test method.
+
+    fields lists the inputs in form order; validate() checks a submitted
+    dict against them with the per-field validators built at compile
+    time. Legacy parameters (a flat {name: default} object) compile to one
+    number or text field per key.
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        names = [f.name for f in self.fields]
+        if len(set(names)) != len(names):
+            raise ValueError("Field names must be unique")
+        self.names = frozenset(names)
+        self._validators = [(f, _validator(f)) for f in self.fields]
+
+    def defaults(self):
+        """Default value of every field"""
+        return {
+            f.name: [f.default] * f.count if f.type == 'readings' else f.default
+            for f in self.fields
+        }
+
+    def extend(self, other):
+        """Schema with other's fields added after those it lacks"""
+        extra = [f for f in other.fields if f.name not in self.names]
+        return ParameterSchema(self.fields + tuple(extra)) if extra else self
+
+    def with_inputs(self, names, units=None):
+        """Schema with a number field added for every name it lacks (e.g. formula inputs)"""
+        units = units or {}
+        extra = [
+            _compile_field({'name': name, 'unit': units.get(name)})
+            for name in names if name not in self.names
+        ]
+        return ParameterSchema(self.fields + tuple(extra)) if extra else self
+
+    def validate(self, values):
+        """Check submitted values; returns (clean values, {field name: error message})"""
+        clean, errors = {}, {}
+        for field, check in self._validators:
+            value = values.get(field.name)
+            if value is None or value == '':
+                if field.required:
+                    errors[field.name] = f"{field.label}: required / مطلوب"
+                continue
+            try:
+                clean[field.name] = check(value)
+            except ValueError as e:
+                errors[field.name] = str(e)
+        return clean, errors
+
+@lru_cache(maxsize=SCHEMA_CACHE_SIZE)
+def compile_schema(parameters):
+    """Compile parameters JSON text (cached); raises ValueError if it is invalid"""
+    if not (parameters or '').strip():
+        return ParameterSchema([])
+    try:
+        spec = json.loads(parameters)
+    except ValueError as e:
+        raise ValueError(f"Parameters are not valid JSON: {e}") from None
+    if not isinstance(spec, dict):
+        raise ValueError("Parameters must be a JSON object")
+
+    if 'fields' in spec:
+        if not isinstance(spec['fields'], list):
+            raise ValueError("fields must be a list")
+        return ParameterSchema([_compile_field(f) for f in spec['fields']])
+
+    # Legacy {name: default} parameters
+    return ParameterSchema([
+        _compile_field({
+            'name': name,
+            'type': 'number' if isinstance(default, (int, float)) and not isinstance(default, bool) else 'text',
+            'default': default,
+        })
+        for name, default in spec.items()
+    ])
+
+def get_standard_schema(standard):
+    """Compiled built-in schema of a standard (None if it has none)"""
+    if standard not in STANDARD_SCHEMAS:
+        return None
+    return compile_schema(json.dumps(STANDARD_SCHEMAS[standard], ensure_ascii=False))
+
+def get_schema_stats():
+    """Get compiled schema cache statistics"""
+    info = compile_schema.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}
+
+def get_method_schema(method_id):
+    """Get the compiled parameter schema of an active test method.
+
+    Methods come from the reference data cache, which reloads them when
+    test_methods is written, so an edited schema takes effect immediately.
+    """
+    for method in get_test_methods():
+        if method['id'] == method_id:
+            return compile_schema(method['parameters'])
+    return ParameterSchema([])
@@ -0,0 +1,247 @@
+"""
+CE-LIMS Search Module
+Bilingual full-text search over samples, projects, test methods and result observations
+"""
+
+import argparse
+import re
+from database import get_connection, transaction, configure_database, prefetch_related
+
+# Arabic normalization applied to indexed text and to queries alike:
+# harakat, superscript alef and tatweel are dropped; alef, ya and
+# ta marbuta variants are folded to one form.
+ARABIC_NORMALIZATION = [
+    ('ً', ''), ('ٌ', ''), ('ٍ', ''), ('َ', ''),
+    ('ُ', ''), ('ِ', ''), ('ّ', ''), ('ْ', ''),
+    ('ٰ', ''), ('ـ', ''),
+    ('أ', 'ا'), ('إ', 'ا'), ('آ', 'ا'), ('ٱ', 'ا'),
+    ('ى', 'ي'),
+    ('ة', 'ه'),
+]
+
+# Index rows use rowid = source id * len(SEARCH_KINDS) + kind number, so a
+# trigger can replace a row without scanning the FTS table.
+SEARCH_KINDS = {
+    'sample': 0,
+    'project': 1,
+    'test_method': 2,
+    'test_result': 3,
+}
+
+SEARCH_LIMIT = 20
+
+def normalize_text(text):
+    """Normalize Arabic text the same way the search index does"""
+    text = text or ''
+    for source, target in ARABIC_NORMALIZATION:
+        text = text.replace(source, target)
+    return text
+
+def normalize_sql(expression):
+    """Wrap an SQL text expression in the replace() calls of normalize_text"""
+    for source, target in ARABIC_NORMALIZATION:
+        expression = f"replace({expression}, '{source}', '{target}')"
+    return expression
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query: every term must match as a prefix.
+
+    A term starting with the Arabic article ال also matches without it.
+    """
+    clauses = []
+    for term in re.split(r"\s+", normalize_text(text)):
+        if not term:
+            continue
+        forms = [term]
+        if term.startswith('ال') and len(term) > 3:
+            forms.append(term[2:])
+        clauses.append("(" + " OR ".join('"' + f.replace('"', '""') + '"*' for f in forms) + ")")
+    return " AND ".join(clauses)
+
+# Display label and detail line for each kind of search hit
+LABEL_QUERIES = {
+    'sample': """
+        SELECT s.id, s.sample_id as label,
+               p.project_name || ' | ' || s.material_type || ' | ' || s.status as detail
+        FROM samples s JOIN projects p ON s.project_id = p.id
+        WHERE s.id IN ({keys})
+    """,
+    'project': """
+        SELECT id, project_code || ' - ' || project_name as label,
+               COALESCE(client_name, '') || ' | ' || status as detail
+        FROM projects WHERE id IN ({keys})
+    """,
+    'test_method': """
+        SELECT id, standard || ' - ' || test_name as label,
+               test_name_ar || ' | ' || material_type as detail
+        FROM test_methods WHERE id IN ({keys})
+    """,
+    'test_result': """
+        SELECT tr.id, s.sample_id || ' - ' || tm.test_name as label,
+               'Result: ' || COALESCE(tr.result_value, '') || ' ' || COALESCE(tr.result_unit, '')
+               || ' | ' || tr.status as detail
+        FROM test_results tr
+        JOIN test_assignments ta ON tr.assignment_id = ta.id
+        JOIN samples s ON ta.sample_id = s.id
+        JOIN test_methods tm ON ta.test_method_id = tm.id
+        WHERE tr.id IN ({keys})
+    """,
+}
+
+def search(text, limit=SEARCH_LIMIT, conn=None):
+    """Search the index, best matches first.
+
+    Returns a list of dicts with kind, ref_id, label, detail and a
+    highlighted snippet of the matching text.
+    """
+    query = build_match_query(text)
+    if not query:
+        return []
+
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT kind, ref_id,
+                   snippet(search_index, -1, '**', '**', '…', 10) as snippet
+            FROM search_index
+            WHERE search_index MATCH ?
+            ORDER BY bm25(search_index, 0.0, 0.0, 10.0, 1.0)
+            LIMIT ?
+        """, (query, limit))
+        hits = [dict(r) for r in cursor.fetchall()]
+
+        # Display labels from the source rows, one query per kind
+        labels = {}
+        for kind, label_query in LABEL_QUERIES.items():
+            ids = [h['ref_id'] for h in hits if h['kind'] == kind]
+            if ids:
+                for ref_id, rows in prefetch_related(conn, label_query, ids, 'id').items():
+                    if rows:
+                        labels[(kind, ref_id)] = rows[0]
+
+        results = []
+        for hit in hits:
+            row = labels.get((hit['kind'], hit['ref_id']))
+            if row is not None:
+                hit['label'] = row['label']
+                hit['detail'] = row['detail']
+                results.append(hit)
+        return results
+    finally:
+        if close_conn:
+            conn.close()
+
+# (table, kind, title columns, body columns, condition for a row to be indexed)
+INDEXED_SOURCES = [
+    ('samples', 'sample',
+     ['sample_id'],
+     ['material_type', 'material_type_ar', 'sample_location', 'sample_location_ar', 'notes', 'notes_ar'],
+     'is_deleted = 0'),
+    ('projects', 'project',
+     ['project_code', 'project_name', 'project_name_ar'],
+     ['client_name', 'client_name_ar', 'location', 'location_ar', 'notes'],
+     'is_deleted = 0'),
+    ('test_methods', 'test_method',
+     ['test_code', 'test_name', 'test_name_ar', 'standard'],
+     ['material_type', 'description', 'description_ar'],
+     '1'),
+    ('test_results', 'test_result',
+     [],
+     ['observations', 'observations_ar'],
+     'is_deleted = 0'),
+]
+
+def _text_sql(row, columns):
+    if not columns:
+        return "''"
+    return normalize_sql(" || ' ' || ".join(f"COALESCE({row}.{c}, '')" for c in columns))
+
+def _rowid_sql(row, kind):
+    return f"{row}.id * {len(SEARCH_KINDS)} + {SEARCH_KINDS[kind]}"
+
+def _index_insert_sql(table, kind, title, body, condition, row):
+    """INSERT ... SELECT adding one source row (aliased row) to the index"""
+    where = condition.replace('is_deleted', f"{row}.is_deleted") if row != table else condition
+    return f"""INSERT INTO search_index (rowid, kind, ref_id, title, body)
+                SELECT {_rowid_sql(row, kind)}, '{kind}', {row}.id,
+                       {_text_sql(row, title)}, {_text_sql(row, body)}
+                {'FROM ' + table if row == table else ''}
+                WHERE {where}"""
+
+def search_index_schema():
+    """SQL creating the FTS5 index and the triggers that keep it in sync"""
+    statements = ["""CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        kind UNINDEXED,
+        ref_id UNINDEXED,
+        title,
+        body,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )"""]
+
+    for table, kind, title, body, condition in INDEXED_SOURCES:
+        watched = ", ".join(title + body + (['is_deleted'] if 'is_deleted' in condition else []))
+        statements += [
+            f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_search_insert
+                AFTER INSERT ON {table}
+                BEGIN
+                    {_index_insert_sql(table, kind, title, body, condition, 'NEW')};
+                END""",
+            f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_search_update
+                AFTER UPDATE OF {watched} ON {table}
+                BEGIN
+                    DELETE FROM search_index WHERE rowid = {_rowid_sql('OLD', kind)};
+                    {_index_insert_sql(table, kind, title, body, condition, 'NEW')};
+                END""",
+            f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_search_delete
+                AFTER DELETE ON {table}
+                BEGIN
+                    DELETE FROM search_index WHERE rowid = {_rowid_sql('OLD', kind)};
+                END""",
+        ]
+    return statements
+
+def search_index_rebuild_sql():
+    """SQL repopulating the FTS5 index from the source tables"""
+    return ["DELETE FROM search_index"] + [
+        _index_insert_sql(table, kind, title, body, condition, table)
+        for table, kind, title, body, condition in INDEXED_SOURCES
+    ] + ["INSERT INTO search_index (search_index) VALUES ('optimize')"]
+
+def rebuild_search_index(conn=None):
+    """Rebuild the search index from scratch"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    try:
+        with transaction(conn):
+            for sql in search_index_rebuild_sql():
+                conn.execute(sql)
+        return conn.execute("SELECT COUNT(*) as count FROM search_index").fetchone()['count']
+    finally:
+        if close_conn:
+            conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search or rebuild the CE-LIMS search index")
+    parser.add_argument("query", nargs="?", help="Text to search for")
+    parser.add_argument("--db", help="Database file (defaults to CE_LIMS_DB_PATH or ce_lims.db)")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index from the source tables")
+    args = parser.parse_args()
+
+    if args.db:
+        configure_database(args.db)
+
+    if args.rebuild:
+        print(f"✅ Search index rebuilt ({rebuild_search_index()} entries)")
+
+    if args.query:
+        for result in search(args.query):
+            print(f"[{result['kind']}] {result['label']} - {result['detail']}")
+            print(f"    {result['snippet']}")
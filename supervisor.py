@@ -4,7 +4,10 @@ Interface for assigning tests and managing workflow
 """
 
 import streamlit as st
-from database import get_connection, log_audit
+from database import get_connection, log_audit, run_write, fetch_page
+from workflow import add_sample_tests
+from counters import get_counters
+from refdata import get_test_methods_by_material, get_lab_techs
 from auth import get_current_user
 from components import *
 from datetime import datetime, date, timedelta
@@ -18,65 +21,74 @@ def show_supervisor_dashboard():
     
     user = get_current_user()
     
-    # Tabs
-    tab1, tab2, tab3 = st.tabs([
-        "📋 Pending Samples / العينات المعلقة",
-        "✅ Assigned Tests / الاختبارات المعينة",
-        "📊 Overview / نظرة عامة"
-    ])
-    
-    with tab1:
-        show_pending_samples(user)
-    
-    with tab2:
-        show_assigned_tests(user)
-    
-    with tab3:
-        show_overview(user)
+    # Sections (only the active one is executed)
+    show_sections([
+        ("📋 Pending Samples / العينات المعلقة", lambda: show_pending_samples(user)),
+        ("✅ Assigned Tests / الاختبارات المعينة", lambda: show_assigned_tests(user)),
+        ("📊 Overview / نظرة عامة", lambda: show_overview(user))
+    ], key="supervisor_section")
     
     show_footer()
 
+def load_pending_samples(conn):
+    """Load samples that are registered but not yet fully assigned"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT 
+                s.id,
+                s.sample_id,
+                s.material_type,
+                s.material_type_ar,
+                p.project_name,
+                p.project_name_ar,
+                s.collection_date,
+                s.priority,
+                s.priority_ar,
+                s.status,
+                s.notes,
+                u.full_name as collected_by
+            FROM samples s
+            JOIN projects p ON s.project_id = p.id
+            LEFT JOIN users u ON s.created_by = u.id
+            WHERE s.status IN ('registered', 'assigned') AND s.is_deleted = 0
+            ORDER BY 
+                CASE s.priority
+                    WHEN 'urgent' THEN 1
+                    WHEN 'high' THEN 2
+                    WHEN 'normal' THEN 3
+                    WHEN 'low' THEN 4
+                END,
+                s.collection_date DESC
+        """)
+        return [dict(r) for r in cursor.fetchall()]
+    finally:
+        if close_conn:
+            conn.close()
+
 def show_pending_samples(user):
     """Show samples pending test assignment"""
     st.markdown("### 📋 Samples Awaiting Test Assignment / العينات في انتظار تعيين الاختبارات")
     
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Get samples that are registered but not yet assigned
-    cursor.execute("""
-        SELECT 
-            s.id,
-            s.sample_id,
-            s.material_type,
-            s.material_type_ar,
-            p.project_name,
-            p.project_name_ar,
-            s.collection_date,
-            s.priority,
-            s.priority_ar,
-            s.status,
-            s.notes,
-            u.full_name as collected_by
-        FROM samples s
-        JOIN projects p ON s.project_id = p.id
-        LEFT JOIN users u ON s.created_by = u.id
-        WHERE s.status IN ('registered', 'assigned') AND s.is_deleted = 0
-        ORDER BY 
-            CASE s.priority
-                WHEN 'urgent' THEN 1
-                WHEN 'high' THEN 2
-                WHEN 'normal' THEN 3
-                WHEN 'low' THEN 4
-            END,
-            s.collection_date DESC
-    """)
-    
-    samples = cursor.fetchall()
+    # Get samples that are registered but not yet assigned (a connection is only taken on a cache miss)
+    samples = cached_section_data(
+        "supervisor_pending_samples",
+        ['samples', 'projects', 'users'],
+        lambda: load_pending_samples(None)
+    )
     
     if samples:
         st.markdown(f"**Total Pending: {len(samples)} / إجمالي المعلقة: {len(samples)}**")
         
+        # Test methods and technicians from the reference data cache
+        methods_by_material = get_test_methods_by_material()
+        lab_techs = get_lab_techs()
+        
         for sample in samples:
             with st.expander(
                 f"🧪 {sample['sample_id']} - {sample['material_type']} | Priority: {sample['priority'].title()} / الأولوية: {sample['priority_ar']}"
@@ -100,14 +112,8 @@ def show_pending_samples(user):
                 st.markdown("---")
                 st.markdown("#### 🔬 Assign Tests / تعيين الاختبارات")
                 
-                # Get available test methods for this material type
-                cursor.execute("""
-                    SELECT id, test_code, test_name, test_name_ar, standard, typical_duration
-                    FROM test_methods
-                    WHERE material_type = ? AND is_active = 1
-                """, (sample['material_type'],))
-                
-                test_methods = cursor.fetchall()
+                # Available test methods for this material type
+                test_methods = methods_by_material.get(sample['material_type'], [])
                 
                 if test_methods:
                     with st.form(f"assign_form_{sample['id']}"):
@@ -127,14 +133,6 @@ def show_pending_samples(user):
                             )
                         
                         with col2:
-                            # Get lab technicians
-                            cursor.execute("""
-                                SELECT id, full_name, full_name_ar
-                                FROM users
-                                WHERE role = 'lab_tech' AND is_active = 1
-                            """)
-                            lab_techs = cursor.fetchall()
-                            
                             tech_options = {
                                 f"{lt['full_name']} / {lt['full_name_ar']}": lt['id']
                                 for lt in lab_techs
@@ -182,47 +180,46 @@ def show_pending_samples(user):
                                     tech_id = tech_options[assigned_tech]
                                     priority_value = assignment_priority.split(" / ")[0].lower()
                                     
-                                    # Assign each selected test
-                                    for test_key in selected_tests:
-                                        test_id = test_options[test_key]
-                                        
-                                        cursor.execute("""
-                                            INSERT INTO test_assignments (
-                                                sample_id, test_method_id, assigned_to,
-                                                assigned_by, due_date, priority, notes, status
-                                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                                        """, (
-                                            sample['id'], test_id, tech_id,
-                                            user['id'], due_date, priority_value,
-                                            assignment_notes, 'assigned'
-                                        ))
+                                    def assign_tests(write_conn):
+                                        write_cursor = write_conn.cursor()
                                         
-                                        assignment_id = cursor.lastrowid
+                                        # Assign each selected test
+                                        for test_key in selected_tests:
+                                            test_id = test_options[test_key]
+                                            
+                                            write_cursor.execute("""
+                                                INSERT INTO test_assignments (
+                                                    sample_id, test_method_id, assigned_to,
+                                                    assigned_by, due_date, priority, notes, status
+                                                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                                            """, (
+                                                sample['id'], test_id, tech_id,
+                                                user['id'], due_date, priority_value,
+                                                assignment_notes, 'assigned'
+                                            ))
+                                            
+                                            assignment_id = write_cursor.lastrowid
+                                            
+                                            # Log audit
+                                            log_audit(
+                                                'test_assignments', assignment_id, 'INSERT',
+                                                None, json.dumps({
+                                                    'sample_id': sample['sample_id'],
+                                                    'test_id': test_id,
+                                                    'assigned_to': tech_id
+                                                }),
+                                                user['id'], write_conn
+                                            )
                                         
-                                        # Log audit
-                                        log_audit(
-                                            'test_assignments', assignment_id, 'INSERT',
-                                            None, json.dumps({
-                                                'sample_id': sample['sample_id'],
-                                                'test_id': test_id,
-                                                'assigned_to': tech_id
-                                            }),
-                                            user['id']
-                                        )
+                                        # Update sample status and test counters
+                                        add_sample_tests(write_conn, sample['id'], len(selected_tests), user['id'])
                                     
-                                    # Update sample status
-                                    cursor.execute("""
-                                        UPDATE samples
-                                        SET status = 'assigned', updated_at = CURRENT_TIMESTAMP, updated_by = ?
-                                        WHERE id = ?
-                                    """, (user['id'], sample['id']))
+                                    run_write(assign_tests)
                                     
-                                    conn.commit()
                                     st.success(f"✅ Tests assigned successfully for {sample['sample_id']}! / تم تعيين الاختبارات بنجاح!")
                                     st.rerun()
                                     
                                 except Exception as e:
-                                    conn.rollback()
                                     st.error(f"❌ Error: {str(e)}")
                             else:
                                 st.warning("⚠️ Please select tests and technician / الرجاء اختيار الاختبارات والفني")
@@ -230,136 +227,186 @@ def show_pending_samples(user):
                     st.info(f"ℹ️ No test methods available for {sample['material_type']} / لا توجد طرق اختبار متاحة")
     else:
         st.info("ℹ️ No pending samples / لا توجد عينات معلقة")
+
+def load_assigned_tests(conn, user_id, status=None, after=None, page_size=20):
+    """Load a page of test assignments made by a supervisor (newest first)"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
     
-    conn.close()
+    try:
+        query = """
+            SELECT 
+                ta.id,
+                s.sample_id,
+                s.material_type,
+                tm.test_name,
+                tm.test_name_ar,
+                tm.standard,
+                u.full_name as assigned_to_name,
+                u.full_name_ar as assigned_to_name_ar,
+                ta.assigned_date,
+                ta.due_date,
+                ta.priority,
+                ta.status
+            FROM test_assignments ta
+            JOIN samples s ON ta.sample_id = s.id
+            JOIN test_methods tm ON ta.test_method_id = tm.id
+            JOIN users u ON ta.assigned_to = u.id
+            WHERE ta.assigned_by = ? AND ta.is_deleted = 0
+        """
+        params = [user_id]
+        
+        if status:
+            query += " AND ta.status = ?"
+            params.append(status)
+        
+        return fetch_page(conn, query, params, order_by=('assigned_date', 'id'),
+                          after=after, page_size=page_size, descending=True)
+    finally:
+        if close_conn:
+            conn.close()
 
 def show_assigned_tests(user):
     """Show all assigned tests"""
     st.markdown("### ✅ Assigned Tests / الاختبارات المعينة")
     
-    conn = get_connection()
-    cursor = conn.cursor()
+    # Filter by status
+    status_filter = st.selectbox(
+        "Filter by Status / تصفية حسب الحالة",
+        options=["All / الكل", "Assigned / معين", "In Progress / جاري العمل", "Completed / مكتمل", "Approved / معتمد"]
+    )
     
-    # Get all test assignments
-    cursor.execute("""
-        SELECT 
-            ta.id,
-            s.sample_id,
-            s.material_type,
-            tm.test_name,
-            tm.test_name_ar,
-            tm.standard,
-            u.full_name as assigned_to_name,
-            u.full_name_ar as assigned_to_name_ar,
-            ta.assigned_date,
-            ta.due_date,
-            ta.priority,
-            ta.status
-        FROM test_assignments ta
-        JOIN samples s ON ta.sample_id = s.id
-        JOIN test_methods tm ON ta.test_method_id = tm.id
-        JOIN users u ON ta.assigned_to = u.id
-        WHERE ta.assigned_by = ? AND ta.is_deleted = 0
-        ORDER BY ta.assigned_date DESC
-        LIMIT 50
-    """, (user['id'],))
+    status_value = None
+    if status_filter != "All / الكل":
+        status_value = status_filter.split(" / ")[0].lower().replace(" ", "_")
     
-    assignments = cursor.fetchall()
+    # Get test assignments (each filter keeps its own page position)
+    pager_key = f"supervisor_assigned_tests_{status_value or 'all'}"
+    after, page_size = get_page_request(pager_key)
+    page = cached_section_data(
+        (pager_key, user['id'], after, page_size),
+        ['test_assignments', 'samples', 'test_methods', 'users'],
+        lambda: load_assigned_tests(None, user['id'], status_value, after, page_size)
+    )
+    assignments = page.rows
     
     if assignments:
-        # Filter by status
-        status_filter = st.selectbox(
-            "Filter by Status / تصفية حسب الحالة",
-            options=["All / الكل", "Assigned / معين", "In Progress / جاري العمل", "Completed / مكتمل", "Approved / معتمد"]
-        )
-        
-        filtered_assignments = assignments
-        if status_filter != "All / الكل":
-            status_value = status_filter.split(" / ")[0].lower().replace(" ", "_")
-            filtered_assignments = [a for a in assignments if a['status'] == status_value]
-        
-        st.markdown(f"**Total: {len(filtered_assignments)} / الإجمالي: {len(filtered_assignments)}**")
+        st.markdown(f"**Total: {page_total_label(page)} / الإجمالي: {page_total_label(page)}**")
         
         # Display as table
-        if filtered_assignments:
-            for assignment in filtered_assignments:
-                col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
-                
-                with col1:
-                    st.markdown(f"**{assignment['sample_id']}**")
-                    st.caption(assignment['material_type'])
-                
-                with col2:
-                    st.markdown(f"**{assignment['test_name']}**")
-                    st.caption(f"{assignment['standard']}")
-                
-                with col3:
-                    st.markdown(f"**{assignment['assigned_to_name']}**")
-                    st.caption(f"Due: {assignment['due_date']}")
-                
-                with col4:
-                    st.markdown(get_status_badge(assignment['status']), unsafe_allow_html=True)
-                
-                st.markdown("---")
-        else:
-            st.info("ℹ️ No assignments match the filter / لا توجد تعيينات تطابق الفلتر")
+        for assignment in assignments:
+            col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
+            
+            with col1:
+                st.markdown(f"**{assignment['sample_id']}**")
+                st.caption(assignment['material_type'])
+            
+            with col2:
+                st.markdown(f"**{assignment['test_name']}**")
+                st.caption(f"{assignment['standard']}")
+            
+            with col3:
+                st.markdown(f"**{assignment['assigned_to_name']}**")
+                st.caption(f"Due: {assignment['due_date']}")
+            
+            with col4:
+                st.markdown(get_status_badge(assignment['status']), unsafe_allow_html=True)
+            
+            st.markdown("---")
+        
+        show_pager(pager_key, page)
+    elif status_value:
+        st.info("ℹ️ No assignments match the filter / لا توجد تعيينات تطابق الفلتر")
     else:
         st.info("ℹ️ No test assignments yet / لا توجد تعيينات اختبارات بعد")
+
+def load_overview_counts(conn, user_id):
+    """Load supervisor overview counters"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    
+    try:
+        samples = get_counters(conn, 'samples_by_status')
+        assignments = get_counters(conn, 'assignments_by_supervisor', user_id)
+        
+        return {
+            'pending_samples': samples.get('registered', 0),
+            'assigned_tests': assignments.get('assigned', 0),
+            'in_progress': assignments.get('in_progress', 0),
+            'completed': assignments.get('completed', 0)
+        }
+    finally:
+        if close_conn:
+            conn.close()
+
+def load_recent_activity(conn, user_id):
+    """Load a supervisor's most recent assignments"""
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
     
-    conn.close()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT 
+                s.sample_id,
+                tm.test_name,
+                u.full_name,
+                ta.assigned_date,
+                ta.status
+            FROM test_assignments ta
+            JOIN samples s ON ta.sample_id = s.id
+            JOIN test_methods tm ON ta.test_method_id = tm.id
+            JOIN users u ON ta.assigned_to = u.id
+            WHERE ta.assigned_by = ?
+            ORDER BY ta.assigned_date DESC
+            LIMIT 10
+        """, (user_id,))
+        return [dict(r) for r in cursor.fetchall()]
+    finally:
+        if close_conn:
+            conn.close()
 
 def show_overview(user):
     """Show supervisor overview dashboard"""
     st.markdown("### 📊 Supervisor Overview / نظرة عامة للمشرف")
     
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     # Get statistics
+    stats = cached_section_data(
+        ("supervisor_overview_counts", user['id']),
+        ['samples', 'test_assignments'],
+        lambda: load_overview_counts(None, user['id'])
+    )
+    
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        cursor.execute("SELECT COUNT(*) as count FROM samples WHERE status = 'registered' AND is_deleted = 0")
-        pending_samples = cursor.fetchone()['count']
-        st.metric("Pending Samples / العينات المعلقة", pending_samples)
+        st.metric("Pending Samples / العينات المعلقة", stats['pending_samples'])
     
     with col2:
-        cursor.execute("SELECT COUNT(*) as count FROM test_assignments WHERE assigned_by = ? AND status = 'assigned'", (user['id'],))
-        assigned_tests = cursor.fetchone()['count']
-        st.metric("Assigned Tests / الاختبارات المعينة", assigned_tests)
+        st.metric("Assigned Tests / الاختبارات المعينة", stats['assigned_tests'])
     
     with col3:
-        cursor.execute("SELECT COUNT(*) as count FROM test_assignments WHERE assigned_by = ? AND status = 'in_progress'", (user['id'],))
-        in_progress = cursor.fetchone()['count']
-        st.metric("In Progress / جاري العمل", in_progress)
+        st.metric("In Progress / جاري العمل", stats['in_progress'])
     
     with col4:
-        cursor.execute("SELECT COUNT(*) as count FROM test_assignments WHERE assigned_by = ? AND status = 'completed'", (user['id'],))
-        completed = cursor.fetchone()['count']
-        st.metric("Completed / مكتمل", completed)
+        st.metric("Completed / مكتمل", stats['completed'])
     
     st.markdown("---")
     
     # Recent activity
     st.markdown("#### 📅 Recent Activity / النشاط الأخير")
     
-    cursor.execute("""
-        SELECT 
-            s.sample_id,
-            tm.test_name,
-            u.full_name,
-            ta.assigned_date,
-            ta.status
-        FROM test_assignments ta
-        JOIN samples s ON ta.sample_id = s.id
-        JOIN test_methods tm ON ta.test_method_id = tm.id
-        JOIN users u ON ta.assigned_to = u.id
-        WHERE ta.assigned_by = ?
-        ORDER BY ta.assigned_date DESC
-        LIMIT 10
-    """, (user['id'],))
-    
-    recent = cursor.fetchall()
+    recent = cached_section_data(
+        ("supervisor_recent_activity", user['id']),
+        ['test_assignments', 'samples', 'test_methods', 'users'],
+        lambda: load_recent_activity(None, user['id'])
+    )
     
     if recent:
         for item in recent:
@@ -369,5 +416,3 @@ def show_overview(user):
             """, unsafe_allow_html=True)
     else:
         st.info("ℹ️ No recent activity / لا يوجد نشاط حديث")
-    
-    conn.close()
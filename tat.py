@@ -0,0 +1,394 @@
+"""
+CE-LIMS Turnaround Time Module
+Incremental daily and monthly turnaround-time rollups with mergeable quantile sketches
+"""
+
+import argparse
+import json
+import math
+import threading
+from database import get_connection, transaction, configure_database, prefetch_related, submit_write
+
+# (stage, start event, end event); durations are stored in hours
+TAT_STAGES = [
+    ('collection_to_received', 'collected', 'received'),
+    ('received_to_assigned', 'received', 'assigned'),
+    ('assigned_to_completed', 'assigned', 'completed'),
+    ('completed_to_approved', 'completed', 'approved'),
+    ('received_to_approved', 'received', 'approved'),
+    ('collection_to_approved', 'collected', 'approved'),
+]
+
+# Rollup grain -> length of the approval date prefix used as its period
+# ('2026-02-03' for days, '2026-02' for months)
+TAT_GRAINS = {'day': 10, 'month': 7}
+
+# Relative accuracy of sketch quantiles: a reported p90 is within 1% of
+# the true value. Durations under SKETCH_MIN_HOURS share the lowest bucket.
+SKETCH_ACCURACY = 0.01
+SKETCH_MIN_HOURS = 1 / 60
+
+_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+def sketch_add(sketch, hours, weight=1):
+    """Add (or with a negative weight, remove) a duration to a sketch.
+
+    Sketches are dicts of log-spaced bucket index -> count, so two sketches
+    merge by adding counts and a result can be taken out again exactly.
+    """
+    bucket = math.ceil(math.log(max(hours, SKETCH_MIN_HOURS)) / _LOG_GAMMA)
+    count = sketch.get(bucket, 0) + weight
+    if count:
+        sketch[bucket] = count
+    else:
+        sketch.pop(bucket, None)
+
+def sketch_merge(sketch, other, sign=1):
+    """Add every count of other into sketch (subtract with sign=-1)"""
+    for bucket, count in other.items():
+        total = sketch.get(bucket, 0) + sign * count
+        if total:
+            sketch[bucket] = total
+        else:
+            sketch.pop(bucket, None)
+
+def sketch_quantile(sketch, q):
+    """Estimate the q quantile (0..1) of the durations in a sketch"""
+    total = sum(sketch.values())
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for bucket in sorted(sketch):
+        seen += sketch[bucket]
+        if seen > rank:
+            return 2 * _GAMMA ** bucket / (_GAMMA + 1)
+    return 2 * _GAMMA ** max(sketch) / (_GAMMA + 1)
+
+def _load_sketch(text):
+    return {int(bucket): count for bucket, count in json.loads(text).items()}
+
+def _dump_sketch(sketch):
+    return json.dumps(sketch, separators=(',', ':'), sort_keys=True)
+
+# Results added or changed since the watermark: new rowids, results updated
+# since the last run, and results of samples updated since the last run
+# (collection/receipt times live on the sample).
+CHANGED_RESULTS_QUERY = """
+    SELECT id FROM test_results WHERE id > :last_id AND id <= :max_id
+    UNION
+    SELECT id FROM test_results WHERE updated_at >= :updated_mark AND +id <= :last_id
+    UNION
+    SELECT tr.id
+    FROM samples s
+    CROSS JOIN test_assignments ta ON ta.sample_id = s.id
+    CROSS JOIN test_results tr ON tr.assignment_id = ta.id
+    WHERE s.updated_at >= :updated_mark AND tr.id <= :last_id
+"""
+
+# Event times (julian days, UTC) of approved results. Collection and receipt
+# dates are entered in the server's local time, so they are converted with
+# the 'utc' modifier; the other events are CURRENT_TIMESTAMP values, already
+# UTC. Receipt falls back to the first chain of custody entry for samples
+# without a received date. CROSS JOIN keeps the id lookup on test_results as
+# the outer loop.
+TAT_EVENTS_QUERY = """
+    SELECT
+        tr.id as result_id,
+        s.project_id,
+        ta.test_method_id as method_id,
+        DATE(tr.approved_at) as day,
+        julianday(s.collection_date || ' ' || COALESCE(s.collection_time, '00:00:00'), 'utc') as collected,
+        COALESCE(
+            julianday(s.received_date || ' ' || COALESCE(s.received_time, '00:00:00'), 'utc'),
+            julianday((SELECT MIN(c.custody_date) FROM chain_of_custody c WHERE c.sample_id = s.id))
+        ) as received,
+        julianday(ta.assigned_date) as assigned,
+        julianday(tr.test_completed_at) as completed,
+        julianday(tr.approved_at) as approved
+    FROM test_results tr
+    CROSS JOIN test_assignments ta ON tr.assignment_id = ta.id
+    JOIN samples s ON ta.sample_id = s.id
+    WHERE tr.id IN ({keys})
+      AND tr.status = 'approved' AND tr.is_deleted = 0 AND tr.approved_at IS NOT NULL
+"""
+
+_stats = {'refreshes': 0, 'results': 0, 'out_of_order': {stage: 0 for stage, _, _ in TAT_STAGES}}
+_stats_lock = threading.Lock()
+
+def _stage_hours(events):
+    """Stage durations in hours and the stages whose end comes before their start.
+
+    A stage is None where an event is missing or out of order; out of order
+    stages are left out of the rollups but counted (see get_tat_stats()).
+    """
+    hours = {}
+    out_of_order = []
+    for stage, start, end in TAT_STAGES:
+        if events[start] is None or events[end] is None:
+            hours[stage] = None
+        elif events[end] < events[start]:
+            hours[stage] = None
+            out_of_order.append(stage)
+        else:
+            hours[stage] = (events[end] - events[start]) * 24
+    return hours, out_of_order
+
+def _apply_contribution(deltas, row, sign):
+    """Add (sign=1) or remove (sign=-1) one result's durations from the rollup deltas"""
+    for grain, length in TAT_GRAINS.items():
+        period = row['day'][:length]
+        for stage, _, _ in TAT_STAGES:
+            hours = row[stage]
+            if hours is None:
+                continue
+            cell = deltas.setdefault(
+                (grain, stage, period, row['project_id'], row['method_id']), [0, 0.0, {}]
+            )
+            cell[0] += sign
+            cell[1] += sign * hours
+            sketch_add(cell[2], hours, sign)
+
+def _write_deltas(conn, deltas):
+    """Merge rollup deltas into tat_rollup, deleting cells that drop to zero"""
+    existing = {}
+    periods = {}
+    for grain, stage, period, _, _ in deltas:
+        periods.setdefault((grain, stage), set()).add(period)
+    for (grain, stage), keys in periods.items():
+        rows = prefetch_related(conn, f"""
+            SELECT period, project_id, method_id, count, total_hours, sketch
+            FROM tat_rollup
+            WHERE grain = '{grain}' AND stage = '{stage}' AND period IN ({{keys}})
+        """, sorted(keys), 'period')
+        for period_rows in rows.values():
+            for row in period_rows:
+                key = (grain, stage, row['period'], row['project_id'], row['method_id'])
+                existing[key] = [row['count'], row['total_hours'], _load_sketch(row['sketch'])]
+
+    upserts, deletes = [], []
+    for key, (count, total, sketch) in deltas.items():
+        cell = existing.get(key, [0, 0.0, {}])
+        cell[0] += count
+        cell[1] += total
+        sketch_merge(cell[2], sketch)
+        if cell[0] > 0:
+            upserts.append(key + (cell[0], cell[1], _dump_sketch(cell[2])))
+        else:
+            deletes.append(key)
+
+    conn.executemany("""
+        INSERT OR REPLACE INTO tat_rollup
+            (grain, stage, period, project_id, method_id, count, total_hours, sketch)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, upserts)
+    conn.executemany("""
+        DELETE FROM tat_rollup
+        WHERE grain = ? AND stage = ? AND period = ? AND project_id = ? AND method_id = ?
+    """, deletes)
+
+def refresh_tat_rollup(conn=None, full=False, chunk_size=5000):
+    """Bring the turnaround-time rollups up to date.
+
+    Only results changed since the stored watermark are read. Each result's
+    previous contribution (kept in tat_contributions) is subtracted before
+    its current one is added, so reprocessing a result is harmless and
+    approvals that are later revoked or deleted drop out of the rollups.
+    With full=True the rollups are rebuilt from scratch.
+    Returns the number of results reprocessed.
+    """
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    try:
+        with transaction(conn):
+            if full:
+                conn.execute("DELETE FROM tat_rollup")
+                conn.execute("DELETE FROM tat_contributions")
+                conn.execute("DELETE FROM rollup_state WHERE name = 'tat'")
+
+            state = conn.execute(
+                "SELECT last_id, updated_mark FROM rollup_state WHERE name = 'tat'"
+            ).fetchone()
+            last_id, updated_mark = (state['last_id'], state['updated_mark']) if state else (0, '')
+
+            # Writers are locked out by BEGIN IMMEDIATE, so nothing can commit
+            # with an earlier updated_at once this timestamp is taken
+            head = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) as max_id, CURRENT_TIMESTAMP as now FROM test_results"
+            ).fetchone()
+
+            changed = [row['id'] for row in conn.execute(CHANGED_RESULTS_QUERY, {
+                'last_id': last_id,
+                'max_id': head['max_id'],
+                'updated_mark': updated_mark,
+            })]
+
+            stage_columns = ", ".join(stage for stage, _, _ in TAT_STAGES)
+            out_of_order = {stage: 0 for stage, _, _ in TAT_STAGES}
+            for start in range(0, len(changed), chunk_size):
+                chunk = changed[start:start + chunk_size]
+                old = prefetch_related(conn, f"""
+                    SELECT result_id, day, project_id, method_id, {stage_columns}
+                    FROM tat_contributions WHERE result_id IN ({{keys}})
+                """, chunk, 'result_id')
+                new = prefetch_related(conn, TAT_EVENTS_QUERY, chunk, 'result_id')
+
+                deltas = {}
+                contributions = []
+                for result_id in chunk:
+                    for row in old[result_id]:
+                        _apply_contribution(deltas, row, -1)
+                    for events in new[result_id]:
+                        hours, stages = _stage_hours(events)
+                        for stage in stages:
+                            out_of_order[stage] += 1
+                        row = dict(events, **hours)
+                        _apply_contribution(deltas, row, 1)
+                        contributions.append(
+                            (result_id, row['day'], row['project_id'], row['method_id'])
+                            + tuple(row[stage] for stage, _, _ in TAT_STAGES)
+                        )
+
+                _write_deltas(conn, deltas)
+                conn.executemany(
+                    "DELETE FROM tat_contributions WHERE result_id = ?",
+                    [(result_id,) for result_id in chunk if old[result_id]]
+                )
+                conn.executemany(f"""
+                    INSERT INTO tat_contributions
+                        (result_id, day, project_id, method_id, {stage_columns})
+                    VALUES ({", ".join("?" for _ in range(4 + len(TAT_STAGES)))})
+                """, contributions)
+
+            conn.execute("""
+                INSERT OR REPLACE INTO rollup_state (name, last_id, updated_mark, refreshed_at)
+                VALUES ('tat', ?, ?, CURRENT_TIMESTAMP)
+            """, (head['max_id'], head['now']))
+
+        with _stats_lock:
+            _stats['refreshes'] += 1
+            _stats['results'] += len(changed)
+            for stage, count in out_of_order.items():
+                _stats['out_of_order'][stage] += count
+        return len(changed)
+    finally:
+        if close_conn:
+            conn.close()
+
+def get_tat_stats():
+    """Refresh counters, with out of order stage durations left out per stage"""
+    with _stats_lock:
+        return dict(_stats, out_of_order=dict(_stats['out_of_order']))
+
+# Cheap check for results or samples changed since the last refresh (uses
+# the rowid and the updated_at indexes only)
+TAT_STALE_QUERY = """
+    SELECT EXISTS (SELECT 1 FROM test_results WHERE id > :last_id)
+        OR EXISTS (SELECT 1 FROM test_results WHERE updated_at >= :updated_mark)
+        OR EXISTS (SELECT 1 FROM samples WHERE updated_at >= :updated_mark) as stale
+"""
+
+_pending_refresh = None
+_pending_refresh_lock = threading.Lock()
+
+def tat_rollup_is_stale(conn):
+    """Whether results or samples changed since the rollups were last refreshed"""
+    state = conn.execute(
+        "SELECT last_id, updated_mark FROM rollup_state WHERE name = 'tat'"
+    ).fetchone()
+    last_id, updated_mark = (state['last_id'], state['updated_mark']) if state else (0, '')
+    return bool(conn.execute(TAT_STALE_QUERY, {
+        'last_id': last_id,
+        'updated_mark': updated_mark,
+    }).fetchone()['stale'])
+
+def schedule_tat_refresh(conn):
+    """Queue a rollup refresh on the writer thread if the rollups are stale.
+
+    Only reads on conn; the refresh itself runs as a write job, and at most
+    one is queued at a time. Returns its Future (None if nothing is queued).
+    """
+    global _pending_refresh
+    with _pending_refresh_lock:
+        if _pending_refresh is not None and not _pending_refresh.done():
+            return _pending_refresh
+        if not tat_rollup_is_stale(conn):
+            return None
+        _pending_refresh = submit_write(refresh_tat_rollup)
+        return _pending_refresh
+
+def get_tat_trend(conn, stage, grain='month', start=None, end=None,
+                  project_id=None, method_id=None, by_method=False):
+    """Turnaround-time statistics per period from the rollups.
+
+    start and end are period strings of the grain ('2026-02' for months).
+    Cells are merged across projects and methods (kept apart per method
+    with by_method=True). Returns a list of dicts with period, method_id,
+    count, mean_hours, p50_hours, p90_hours and p99_hours.
+    """
+    if grain not in TAT_GRAINS:
+        raise ValueError(f"Unknown TAT grain: {grain}")
+    if stage not in [s for s, _, _ in TAT_STAGES]:
+        raise ValueError(f"Unknown TAT stage: {stage}")
+
+    where = "grain = ? AND stage = ?"
+    params = [grain, stage]
+    if start is not None:
+        where += " AND period >= ?"
+        params.append(start)
+    if end is not None:
+        where += " AND period <= ?"
+        params.append(end)
+    if project_id is not None:
+        where += " AND project_id = ?"
+        params.append(project_id)
+    if method_id is not None:
+        where += " AND method_id = ?"
+        params.append(method_id)
+
+    merged = {}
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT period, method_id, count, total_hours, sketch
+        FROM tat_rollup WHERE {where}
+        ORDER BY period
+    """, params)
+    for row in cursor.fetchall():
+        key = (row['period'], row['method_id'] if by_method else None)
+        cell = merged.setdefault(key, [0, 0.0, {}])
+        cell[0] += row['count']
+        cell[1] += row['total_hours']
+        sketch_merge(cell[2], _load_sketch(row['sketch']))
+
+    return [
+        {
+            'period': period,
+            'method_id': method,
+            'count': count,
+            'mean_hours': total / count,
+            'p50_hours': sketch_quantile(sketch, 0.5),
+            'p90_hours': sketch_quantile(sketch, 0.9),
+            'p99_hours': sketch_quantile(sketch, 0.99),
+        }
+        for (period, method), (count, total, sketch) in merged.items()
+    ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update CE-LIMS turnaround-time rollups")
+    parser.add_argument("--db", help="Database file (defaults to CE_LIMS_DB_PATH or ce_lims.db)")
+    parser.add_argument("--full", action="store_true", help="Rebuild the rollups from scratch")
+    args = parser.parse_args()
+
+    if args.db:
+        configure_database(args.db)
+
+    print("🔄 Updating turnaround-time rollups...")
+    count = refresh_tat_rollup(full=args.full)
+    print(f"✅ Turnaround-time rollups updated ({count} result(s) processed)")
+    for stage, skipped in get_tat_stats()['out_of_order'].items():
+        if skipped:
+            print(f"  ⚠️ {stage}: {skipped} duration(s) out of order, left out")
@@ -0,0 +1,26 @@
+"""
+CE-LIMS Calculation Tests
+Batch calculators against the scalar ones
+"""
+
+import pandas as pd
+from calculations import auto_calculate, auto_calculate_batch
+
+
+def test_penetration_batch_accepts_ragged_readings():
+    readings = [[1, 2, 3], [4, 5], [6, 7, 8, 9]]
+    batch = auto_calculate_batch('ASTM D5', {'readings': readings})
+
+    assert batch['error'].tolist() == [False, True, False]
+    for i in (0, 2):
+        scalar = auto_calculate('ASTM D5', {'readings': readings[i]})
+        assert batch['average_penetration'][i] == scalar['average_penetration']
+        assert batch['std_deviation'][i] == scalar['std_deviation']
+
+
+def test_penetration_batch_accepts_ragged_dataframe_column():
+    records = pd.DataFrame({'readings': [[1, 2, 3], [4, 5]]})
+    batch = auto_calculate_batch('ASTM D5', records)
+
+    assert batch['error'].tolist() == [False, True]
+    assert batch['average_penetration'][0] == 2.0
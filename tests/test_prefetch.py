@@ -0,0 +1,81 @@
+"""
+CE-LIMS Query Budget Tests
+Statement counts of list loaders must not grow with the page
+"""
+
+import numpy as np
+import pytest
+from curves import save_curve
+from database import (configure_database, get_connection, init_database, seed_initial_data,
+                      transaction, StatementCounter)
+from manager import load_pending_approvals
+from plots import curve_series
+
+
+@pytest.fixture
+def conn(tmp_path):
+    configure_database(str(tmp_path / "ce_lims.db"))
+    init_database()
+    seed_initial_data()
+    conn = get_connection()
+    yield conn
+    conn.close()
+
+
+def add_pending_results(conn, count, start=0):
+    """Add count submitted results, each on its own sample with two attached files"""
+    with transaction(conn):
+        for n in range(start, start + count):
+            sample_id = conn.execute("""
+                INSERT INTO samples (sample_id, project_id, material_type, material_type_ar,
+                                     collection_date, status, created_by)
+                VALUES (?, 1, 'Concrete', 'خرسانة', '2026-01-01', 'in_progress', 1)
+            """, (f"S-{n:05d}",)).lastrowid
+            assignment_id = conn.execute("""
+                INSERT INTO test_assignments (sample_id, test_method_id, assigned_to, assigned_by, status)
+                VALUES (?, 1, 3, 2, 'completed')
+            """, (sample_id,)).lastrowid
+            result_id = conn.execute("""
+                INSERT INTO test_results (assignment_id, tested_by, test_completed_at, result_value,
+                                          result_unit, status)
+                VALUES (?, 3, CURRENT_TIMESTAMP, 30.0, 'MPa', 'submitted')
+            """, (assignment_id,)).lastrowid
+            conn.executemany("""
+                INSERT INTO raw_files (test_result_id, file_name, file_path, file_type, uploaded_by)
+                VALUES (?, ?, ?, 'text/csv', 3)
+            """, [(result_id, f"{n}-{i}.csv", f"uploads/{n}-{i}.csv") for i in range(2)])
+
+
+def count_statements(conn, page_size):
+    with StatementCounter(conn) as counter:
+        page = load_pending_approvals(conn, page_size=page_size)
+    assert all(len(result['files']) == 2 for result in page.rows)
+    return counter.count, len(page.rows)
+
+
+def test_pending_approvals_statements_do_not_grow_with_page(conn):
+    add_pending_results(conn, 10)
+    small, rows = count_statements(conn, page_size=10)
+    assert rows == 10
+
+    add_pending_results(conn, 90, start=10)
+    large, rows = count_statements(conn, page_size=100)
+    assert rows == 100
+
+    assert large == small
+
+
+def test_pending_approval_curves_use_prefetched_info(conn, tmp_path):
+    add_pending_results(conn, 5)
+    root = str(tmp_path / "curves")
+    for result_id in range(1, 6):
+        save_curve(result_id, {'displacement': np.linspace(0, 5, 500), 'load': np.linspace(0, 90, 500)},
+                   conn=conn, root=root)
+
+    page = load_pending_approvals(conn, page_size=10)
+    assert all(result['curve'] for result in page.rows)
+    with StatementCounter(conn) as counter:
+        for result in page.rows:
+            series = curve_series(result['result_id'], conn=conn, root=root, info=result['curve'])
+            assert len(series) == 500
+    assert counter.count == 0
@@ -0,0 +1,39 @@
+"""
+CE-LIMS Report Export Tests
+Exported report files are served once and expire when never downloaded
+"""
+
+import os
+import time
+from datetime import date
+import pytest
+from database import configure_database, init_database, seed_initial_data
+from reports import export_report, expire_reports, take_report
+
+
+@pytest.fixture
+def report_dir(tmp_path):
+    configure_database(str(tmp_path / "ce_lims.db"))
+    init_database()
+    seed_initial_data()
+    return str(tmp_path / "reports")
+
+
+def test_take_report_deletes_the_export(report_dir):
+    path, count = export_report(date(2026, 1, 1), date(2026, 12, 31), report_dir=report_dir)
+    assert count == 0
+    assert take_report(path).decode("utf-8-sig").startswith("sample_id,")
+    assert not os.path.exists(path)
+
+
+def test_expire_reports_only_removes_old_exports(report_dir):
+    os.makedirs(report_dir)
+    old = time.time() - 48 * 3600
+    for name in ("report_old.csv", "recalculation_old.csv", "report_new.csv"):
+        with open(os.path.join(report_dir, name), "w") as f:
+            f.write("x\n")
+    for name in ("report_old.csv", "recalculation_old.csv"):
+        os.utime(os.path.join(report_dir, name), (old, old))
+
+    assert expire_reports(report_dir, max_age_hours=24) == 1
+    assert sorted(os.listdir(report_dir)) == ["recalculation_old.csv", "report_new.csv"]
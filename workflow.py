@@ -0,0 +1,200 @@
+"""
+CE-LIMS Workflow Module
+Sample, assignment and test result state machine with per-sample test counters
+"""
+
+from collections import defaultdict
+
+# Allowed status changes. Setting a record to the status it already has is
+# always accepted as a no-op.
+SAMPLE_TRANSITIONS = {
+    'registered': {'assigned'},
+    'assigned': {'in_progress', 'completed'},
+    'in_progress': {'completed'},
+    'completed': {'in_progress', 'approved'},
+    'approved': {'archived'},
+    'archived': set(),
+}
+
+ASSIGNMENT_TRANSITIONS = {
+    'assigned': {'in_progress', 'completed'},
+    'in_progress': {'completed'},
+    'completed': {'approved', 'in_progress'},
+    'rejected': {'in_progress', 'completed'},
+    'approved': set(),
+}
+
+RESULT_TRANSITIONS = {
+    'draft': {'submitted'},
+    'submitted': {'approved', 'rejected'},
+    'rejected': {'draft', 'submitted'},
+    'approved': set(),
+}
+
+TRANSITIONS = {
+    'sample': SAMPLE_TRANSITIONS,
+    'assignment': ASSIGNMENT_TRANSITIONS,
+    'result': RESULT_TRANSITIONS,
+}
+
+# Assignment statuses counted in samples.tests_completed / tests_approved
+COMPLETED_STATUSES = ('completed', 'approved')
+APPROVED_STATUSES = ('approved',)
+
+# Sample status derived from its counters once testing has started
+ROLLUP_STATUS = """
+    CASE
+        WHEN tests_total > 0 AND tests_approved = tests_total THEN 'approved'
+        WHEN tests_total > 0 AND tests_completed = tests_total THEN 'completed'
+        ELSE 'in_progress'
+    END
+"""
+
+def can_transition(kind, old_status, new_status):
+    """Check whether a sample/assignment/result may move between statuses"""
+    if old_status == new_status:
+        return True
+    return new_status in TRANSITIONS[kind].get(old_status, set())
+
+def check_transition(kind, old_status, new_status):
+    """Raise ValueError if the status change is not allowed"""
+    if not can_transition(kind, old_status, new_status):
+        raise ValueError(f"Invalid {kind} status change: {old_status} -> {new_status}")
+
+def _placeholders(values):
+    return ", ".join("?" for _ in values)
+
+def set_sample_status(conn, sample_ids, new_status, user_id):
+    """Move samples to new_status after validating every transition"""
+    sample_ids = list(dict.fromkeys(sample_ids))
+    if not sample_ids:
+        return
+
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT id, sample_id, status FROM samples WHERE id IN ({_placeholders(sample_ids)})
+    """, sample_ids)
+    for row in cursor.fetchall():
+        check_transition('sample', row['status'], new_status)
+
+    cursor.execute(f"""
+        UPDATE samples
+        SET status = ?, updated_at = CURRENT_TIMESTAMP, updated_by = ?
+        WHERE id IN ({_placeholders(sample_ids)}) AND status != ?
+    """, [new_status, user_id] + sample_ids + [new_status])
+
+def add_sample_tests(conn, sample_id, count, user_id):
+    """Record count new assignments on a sample and mark it assigned"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT status FROM samples WHERE id = ?", (sample_id,))
+    check_transition('sample', cursor.fetchone()['status'], 'assigned')
+
+    cursor.execute("""
+        UPDATE samples
+        SET tests_total = tests_total + ?,
+            status = 'assigned',
+            updated_at = CURRENT_TIMESTAMP,
+            updated_by = ?
+        WHERE id = ?
+    """, (count, user_id, sample_id))
+
+def move_assignments(conn, assignment_ids, new_status):
+    """Move assignments to new_status and roll the change up to their samples.
+
+    Every transition is validated before anything is written. Sample
+    counters are adjusted by the delta of each change, then the affected
+    samples get their status re-derived from the counters in one UPDATE.
+    Returns {sample id: sample status} for the affected samples.
+    """
+    assignment_ids = list(dict.fromkeys(assignment_ids))
+    if not assignment_ids:
+        return {}
+
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT id, sample_id, status FROM test_assignments
+        WHERE id IN ({_placeholders(assignment_ids)}) AND is_deleted = 0
+    """, assignment_ids)
+    rows = cursor.fetchall()
+    if len(rows) != len(assignment_ids):
+        raise ValueError("Test assignment not found")
+
+    deltas = defaultdict(lambda: [0, 0])
+    for row in rows:
+        check_transition('assignment', row['status'], new_status)
+        delta = deltas[row['sample_id']]
+        delta[0] += (new_status in COMPLETED_STATUSES) - (row['status'] in COMPLETED_STATUSES)
+        delta[1] += (new_status in APPROVED_STATUSES) - (row['status'] in APPROVED_STATUSES)
+
+    cursor.execute(f"""
+        UPDATE test_assignments
+        SET status = ?
+        WHERE id IN ({_placeholders(assignment_ids)}) AND status != ?
+    """, [new_status] + assignment_ids + [new_status])
+
+    cursor.executemany("""
+        UPDATE samples
+        SET tests_completed = tests_completed + ?,
+            tests_approved = tests_approved + ?
+        WHERE id = ?
+    """, [(completed, approved, sample_id)
+          for sample_id, (completed, approved) in deltas.items()
+          if completed or approved])
+
+    sample_ids = list(deltas)
+    cursor.execute(f"""
+        UPDATE samples
+        SET status = {ROLLUP_STATUS}
+        WHERE id IN ({_placeholders(sample_ids)})
+        AND status IN ('assigned', 'in_progress', 'completed', 'approved')
+        AND status != {ROLLUP_STATUS}
+    """, sample_ids)
+
+    cursor.execute(f"""
+        SELECT id, status FROM samples WHERE id IN ({_placeholders(sample_ids)})
+    """, sample_ids)
+    return {row['id']: row['status'] for row in cursor.fetchall()}
+
+def get_sample_progress(sample):
+    """Get (completed, total, percent) from a row carrying the sample counters"""
+    total = sample['tests_total']
+    completed = sample['tests_completed']
+    percent = int(completed / total * 100) if total > 0 else 0
+    return completed, total, percent
+
+def rebuild_sample_counters(conn):
+    """Recompute every sample's counters from its assignments"""
+    conn.execute("""
+        UPDATE samples SET
+            tests_total = (
+                SELECT COUNT(*) FROM test_assignments ta
+                WHERE ta.sample_id = samples.id AND ta.is_deleted = 0
+            ),
+            tests_completed = (
+                SELECT COUNT(*) FROM test_assignments ta
+                WHERE ta.sample_id = samples.id AND ta.is_deleted = 0
+                AND ta.status IN ('completed', 'approved')
+            ),
+            tests_approved = (
+                SELECT COUNT(*) FROM test_assignments ta
+                WHERE ta.sample_id = samples.id AND ta.is_deleted = 0
+                AND ta.status = 'approved'
+            )
+    """)
+
+if __name__ == "__main__":
+    import argparse
+    from database import configure_database, get_connection, transaction
+
+    parser = argparse.ArgumentParser(description="Rebuild CE-LIMS per-sample test counters")
+    parser.add_argument("--db", help="Database file (defaults to CE_LIMS_DB_PATH or ce_lims.db)")
+    args = parser.parse_args()
+
+    if args.db:
+        configure_database(args.db)
+
+    conn = get_connection()
+    with transaction(conn):
+        rebuild_sample_counters(conn)
+    conn.close()
+    print("✅ Sample counters rebuilt")